@@ -1,12 +1,36 @@
-from flask import Flask, render_template, redirect, url_for, request, session, jsonify
+from flask import Flask, render_template, redirect, url_for, request, session, jsonify, Response
+from markupsafe import Markup
 import os
 from datetime import datetime, timedelta
-import yfinance as yf
 import pandas as pd
 import numpy as np
 import time
-from concurrent.futures import ThreadPoolExecutor  # أداة التسريع الرئيسية
+import zlib
+import asyncio
+import importlib.util
+import threading
 from functools import lru_cache
+from urllib.parse import urlencode
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from batch_fetch import BatchDownloader, summarize  # محرك الجلب المجمّع
+from market_cache import MarketCache  # التحديث الخلفي للكاش
+from history_store import HistoryStore, period_start  # المخزن المحلي للبيانات التاريخية
+from indicators import IndicatorEngine  # محرك المؤشرات الفنية
+from sse import EventBroker, EventServer  # قناة الدفع المباشر للمتصفحات
+from bar_aggregator import BarAggregator, TIMEFRAMES, TIMEFRAME_LABELS  # الشموع اللحظية
+from symbol_master import SymbolMaster  # جدول الرموز والقطاعات
+from rankings import RankingIndex, VIEWS as RANKING_VIEWS  # فهرس الترتيب
+from search_index import SearchIndex  # فهرس البحث عن الشركات
+from fragment_cache import FragmentCache, accepted_encoding  # كاش الأجزاء المعروضة
+from shared_snapshot import SharedSnapshot, SharedText  # لقطة السوق ومقاييس التحديث المشتركة بين العمليات
+from market_state import MarketState  # حالة السوق الموحدة (البث المباشر + ياهو)
+import providers  # مزودو البيانات (حقيقي / تسجيل / إعادة / تركيبي)
+import upstream  # حد التزامن المتكيف وقاطع الدائرة لطلبات المصادر
+import http_session  # جلسة HTTP المشتركة لطلبات ياهو
+import metrics  # مقاييس التشغيل (/metrics)
+import profiling  # زمن مراحل الطلبات والمحلل بأخذ العينات
+from metrics import SYMBOL_FAILURES
+from websocket_stream import TadawulLiveStream  # خادم البث المباشر (الأسعار من market_provider)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-123'
@@ -147,19 +171,64 @@ users = {'turki': '123456', 'admin': 'admin123'}
 # ---------- ذاكرة كاش عالمية لتقليل عدد الطلبات ----------
 GLOBAL_CACHE = {
     'market_data': [],
+    'market_overview': {'current': 12000.00, 'change': 150.50, 'change_percent': 1.27, 'status': 'نشط', 'volume': 150000000},
     'last_update': None,
-    'expiry': 300 # التحديث كل 5 دقائق (300 ثانية)
+    'expiry': 300, # التحديث كل 5 دقائق (300 ثانية)
+    'refresh_ahead': 30 # بدء التحديث في الخلفية قبل انتهاء الصلاحية بـ 30 ثانية
 }
 
+# ---------- إعدادات الجلب المجمّع ----------
+FETCH_CONFIG = {
+    'chunk_size': 40,  # عدد الرموز في كل طلب
+    'max_workers': 8   # عدد الدفعات المتوازية (الطلبات الفعلية يحددها حد التزامن في upstream.py)
+}
+
+# ---------- البث المباشر داخل التطبيق ----------
+LIVE_CONFIG = {
+    'enabled': os.environ.get('LIVE_STREAM', '1') == '1',
+    'port': int(os.environ.get('LIVE_STREAM_PORT', 8765)),
+    'interval': 2,        # فترة استطلاع تكرتشارت (ثواني)
+    'merge_interval': 2,  # فترة دمج التحديثات اللحظية في لقطة السوق
+    'live_max_age': 30    # القيمة الحية الأقدم من هذا تعود للجلب المجمّع من ياهو
+}
+
+# ---------- قناة الدفع (SSE) على خادم asyncio مستقل ----------
+# SSE_PUBLIC_URL: عنوان الخادم كما يراه المتصفح خلف وكيل عكسي (افتراضياً نفس المضيف على SSE_PORT)
+SSE_CONFIG = {
+    'enabled': os.environ.get('SSE_STREAM', '1') == '1',
+    'port': int(os.environ.get('SSE_PORT', 8766)),
+    'public_url': os.environ.get('SSE_PUBLIC_URL', ''),
+    'token_max_age': 12 * 3600  # صلاحية رابط الاشتراك (يعاد توليده مع كل إعادة اتصال عبر /stream/market)
+}
+
+# ---------- التشغيل متعدد العمليات (serve.py) ----------
+# MARKET_SNAPSHOT_SHM: اسم الذاكرة المشتركة للقطة السوق
+# MARKET_SNAPSHOT_ROLE: refresher (يجلب البيانات وينشرها) أو reader (يقرأها فقط - الافتراضي)
+SNAPSHOT_SHM = os.environ.get('MARKET_SNAPSHOT_SHM')
+SNAPSHOT_ROLE = os.environ.get('MARKET_SNAPSHOT_ROLE', 'reader') if SNAPSHOT_SHM else None
+# MARKET_METRICS_SHM: مقاييس عملية التحديث (طلبات المصادر، جلسة HTTP) تعرضها العمال في /metrics
+METRICS_SHM = os.environ.get('MARKET_METRICS_SHM')
+METRICS_CONFIG = {'interval': 5, 'max_age': 60}  # فترة النشر، وأقصى عمر قبل تجاهل مقاييس التحديث
+
+# ---------- جدول الرموز: معرّفات رقمية وقطاعات مُعرّفة مرة واحدة ----------
+symbol_master = SymbolMaster(SAUDI_COMPANIES)
+market_state = MarketState(symbol_master, live_max_age=LIVE_CONFIG['live_max_age'])
+
+# ---------- مزود البيانات: MARKET_DATA=live | record:<ملف> | replay:<ملف>[:<السرعة>|max] | synthetic[:<المعدل>] ----------
+http_session.configure(FETCH_CONFIG['max_workers'])  # اتصال مفتوح لكل خيط جلب
+# ResilientProvider: حد تزامن متكيف وإعادة محاولة وقاطع دائرة لكل مصدر، مشترك بين التحليل والبث
+market_provider = upstream.ResilientProvider(providers.from_env(symbol_master.symbols))
+
 class StockAnalyzer:
-    def __init__(self):
-        self.symbols = [k for k in SAUDI_COMPANIES.keys() if not k.startswith('^')]
+    def __init__(self, provider):
+        self.symbols = [s for s in symbol_master.symbols if not s.startswith('^')]
+        self.provider = provider
+        self.downloader = BatchDownloader(**FETCH_CONFIG, provider=provider)
 
     def get_single_stock(self, symbol):
-        """دالة جلب بيانات شركة واحدة - سيتم استدعاؤها بالتوازي"""
+        """دالة جلب بيانات شركة واحدة"""
         try:
-            ticker = yf.Ticker(f"{symbol}.SR")
-            hist = ticker.history(period='2d')
+            hist = self.provider.history(f"{symbol}.SR", period='2d')
             if hist.empty: return None
 
             current = hist['Close'].iloc[-1]
@@ -169,8 +238,8 @@ class StockAnalyzer:
 
             return {
                 'symbol': symbol,
-                'name': SAUDI_COMPANIES.get(symbol, {}).get('name', f'شركة {symbol}'),
-                'sector': SAUDI_COMPANIES.get(symbol, {}).get('sector', 'غير معروف'),
+                'name': symbol_master.name(symbol),
+                'sector': symbol_master.sector(symbol),
                 'last': round(current, 2),
                 'change': round(change, 2),
                 'change_percent': round(change_percent, 2),
@@ -180,32 +249,66 @@ class StockAnalyzer:
                 'volume': int(hist['Volume'].iloc[-1]) if 'Volume' in hist.columns else 0,
                 'type': 'سهم'
             }
-        except:
+        except Exception as e:
+            print(f" فشل جلب {symbol}: {e}")
+            SYMBOL_FAILURES.inc(symbol=symbol, source=self.provider.source('history'))
             return None
 
     def get_market_statistics_real(self):
-        """جلب جميع البيانات باستخدام ThreadPoolExecutor للتسريع الفائق"""
-        # التأكد مما إذا كانت البيانات في الكاش صالحة
-        now = datetime.now()
-        if GLOBAL_CACHE['last_update'] and (now - GLOBAL_CACHE['last_update']).total_seconds() < GLOBAL_CACHE['expiry']:
-            return GLOBAL_CACHE['market_data']
-
-        # استخدام 20 خيط (Thread) للعمل في وقت واحد
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            results = list(executor.map(self.get_single_stock, self.symbols))
-        
-        # تصفية النتائج واستخراج البيانات الصحيحة فقط
-        market_data = [r for r in results if r is not None]
-        
-        # تحديث الكاش العالمي
-        GLOBAL_CACHE['market_data'] = market_data
-        GLOBAL_CACHE['last_update'] = now
-        return market_data
+        """آخر بيانات السوق من الكاش مع مصدر وعمر كل قيمة - التحديث يتم في الخلفية"""
+        now = time.time()
+        return [dict(row, age=round(now - row['updated_at'], 1))
+                for row in market_cache.snapshot()['market_data']]
+
+    def fetch_market_statistics(self, symbols=None):
+        """جلب البيانات على دفعات متعددة الرموز وإرجاع جدول الملخص المحسوب بشكل متجه"""
+        symbols = self.symbols if symbols is None else symbols
+        if not symbols:
+            return summarize(None)
+        wide, failed = self.downloader.fetch(symbols, period='2d')
+        if failed:
+            print(f" تعذر جلب {len(failed)} رمز")
+        return summarize(wide)
+
+    def build_market_rows(self, summary):
+        """تحويل جدول الملخص إلى صفوف العرض بنفس ترتيب قائمة الشركات"""
+        summary = summary.reindex([s for s in self.symbols if s in summary.index])
+        ids = symbol_master.ids_of(summary.index)
+        names = symbol_master.names[ids]
+        sectors = symbol_master.sector_names[symbol_master.sector_codes[ids]]
+        last = summary['last'].round(2).to_numpy()
+        change = summary['change'].round(2).to_numpy()
+        change_percent = summary['change_percent'].round(2).to_numpy()
+        volume = summary['volume'].to_numpy(dtype=np.int64)
+        trades = summary['trades'].to_numpy(dtype=np.int64)
+        liquidity = summary['liquidity_ratio'].round(2).to_numpy()
+        sources = summary['source'].to_numpy()
+        updated_at = summary['updated_at'].round(1).to_numpy()
+
+        return [{
+            'symbol': symbol,
+            'name': names[i],
+            'sector': sectors[i],
+            'last': float(last[i]),
+            'change': float(change[i]),
+            'change_percent': float(change_percent[i]),
+            'trades': int(trades[i]),
+            'liquidity_ratio': float(liquidity[i]),
+            'trend': 'صاعد' if change[i] > 0 else 'هابط',
+            'volume': int(volume[i]),
+            'type': 'سهم',
+            'source': sources[i],  # live (تكرتشارت) أو yahoo
+            'updated_at': float(updated_at[i])  # وقت القيمة (ثواني يونكس)
+        } for i, symbol in enumerate(summary.index)]
 
     def get_market_overview(self):
-        """نظرة سريعة على المؤشر العام"""
+        """نظرة سريعة على المؤشر العام من الكاش"""
+        return market_cache.snapshot()['market_overview']
+
+    def fetch_market_overview(self):
+        """جلب المؤشر العام - عند الفشل تُستخدم آخر قيمة معروفة وتُعلّم بأنها غير محدثة"""
         try:
-            tasi = yf.Ticker('^TASI.SR').history(period='2d')
+            tasi = self.provider.history('^TASI.SR', period='2d')
             current = tasi['Close'].iloc[-1]
             prev = tasi['Close'].iloc[-2]
             change_pct = ((current - prev) / prev) * 100
@@ -216,10 +319,327 @@ class StockAnalyzer:
                 'status': 'مرتفع' if change_pct > 0 else 'منخفض',
                 'volume': int(tasi['Volume'].iloc[-1])
             }
-        except:
-            return {'current': 12000.00, 'change': 150.50, 'change_percent': 1.27, 'status': 'نشط', 'volume': 150000000}
+        except Exception as e:
+            print(f" فشل جلب المؤشر العام: {e}")
+            SYMBOL_FAILURES.inc(symbol='^TASI', source=self.provider.source('history'))
+            return dict(GLOBAL_CACHE['market_overview'], status='غير محدث', stale=True)
+
+    def load_snapshot(self):
+        """
+        تحميل لقطة السوق كاملة - يستدعيها خيط التحديث الخلفي فقط
+        الشركات التي لها بث حي حديث لا تُطلب من ياهو وتُؤخذ قيمها من حالة السوق
+        """
+        live = market_state.live_symbols()
+        traffic = http_session.stats.snapshot()
+        summary = self.fetch_market_statistics([s for s in self.symbols if s not in live])
+        # الصفقات ونسبة السيولة لا توفرها ياهو (قيم تقديرية)
+        summary['trades'] = np.random.randint(1000, 50000, size=len(summary))
+        summary['liquidity_ratio'] = np.round(np.random.uniform(30, 80, size=len(summary)), 2)
+        summary = fill_activity(market_state.merge(summary), GLOBAL_CACHE.get('summary'))
+        market_overview = self.fetch_market_overview()
+        delta = http_session.stats.since(traffic)
+        if delta['requests']:
+            print(f" تحديث السوق: {http_session.describe(delta)}")
+        return self.snapshot_fields(summary, market_overview=market_overview)
+
+    def load_live_changes(self):
+        """دمج التحديثات اللحظية المتراكمة في اللقطة الحالية بدون أي جلب (None إذا لم يتغير شيء)"""
+        previous = GLOBAL_CACHE.get('summary')
+        if previous is None or not market_state.take_dirty():
+            return None
+        summary = fill_activity(market_state.merge(previous), previous)
+        return self.snapshot_fields(summary,
+                                    market_overview=GLOBAL_CACHE['market_overview'],
+                                    last_update=GLOBAL_CACHE['last_update'])
+
+    def load_shared_snapshot(self):
+        """قراءة اللقطة التي نشرتها عملية التحديث (وضع القارئ) - None إذا لم يُنشر إصدار جديد"""
+        fields = shared_snapshot.load(symbol_master)
+        if fields is None:
+            return None
+        return self.snapshot_fields(**fields)
+
+    def snapshot_fields(self, summary, **fields):
+        """حقول اللقطة المشتقة من جدول الملخص"""
+        columns = symbol_master.columns(summary)
+        return dict(fields,
+                    market_data=self.build_market_rows(summary),
+                    summary=summary,  # شموع اليوم لتحديث المؤشرات
+                    columns=columns,  # اللقطة كأعمدة متوازية مفهرسة بمعرّف الرمز
+                    sectors=symbol_master.sector_aggregates(columns))
+
+def fill_activity(summary, previous):
+    """قيم الصفقات والسيولة للشركات التي ليست لها قيمة (من اللقطة السابقة أولاً)"""
+    for column, make in (('trades', lambda n: np.random.randint(1000, 50000, size=n)),
+                         ('liquidity_ratio', lambda n: np.round(np.random.uniform(30, 80, size=n), 2))):
+        values = summary[column] if column in summary else pd.Series(np.nan, index=summary.index)
+        if previous is not None and column in previous:
+            values = values.fillna(previous[column].reindex(summary.index))
+        missing = values.isna().to_numpy()
+        values = values.to_numpy(dtype=float, copy=True)
+        values[missing] = make(int(missing.sum()))
+        summary[column] = values
+    return summary
+
+analyzer = StockAnalyzer(market_provider)
+shared_snapshot = SharedSnapshot.attach(SNAPSHOT_SHM) if SNAPSHOT_SHM else None
+if SNAPSHOT_ROLE == 'reader':
+    # العامل لا يجلب أي بيانات: يتابع إصدار اللقطة المشتركة كل ثانية
+    market_cache = MarketCache(GLOBAL_CACHE, analyzer.load_shared_snapshot, poll_interval=1)
+else:
+    if SNAPSHOT_ROLE == 'refresher':
+        # عملية تحديث أُعيد تشغيلها تكمل ترقيم الإصدارات المنشورة:
+        # العمال يتجاهلون أي إصدار لا يتجاوز آخر ما قرؤوه
+        GLOBAL_CACHE['version'] = shared_snapshot.version()
+    market_cache = MarketCache(GLOBAL_CACHE, analyzer.load_snapshot,
+                               refresh_ahead=GLOBAL_CACHE['refresh_ahead'])
+# كاتب واحد للمخزن: عملية التحديث (أو العملية الوحيدة)؛ العمال يقرؤون ما كتبته فقط
+history_store = HistoryStore(readonly=SNAPSHOT_ROLE == 'reader')
+indicator_engine = IndicatorEngine(analyzer.symbols)
+
+def update_indicators(snapshot):
+    """تحميل المؤشرات من المخزن التاريخي أول مرة ثم تحديثها بشمعة اليوم فقط"""
+    if not indicator_engine.loaded:
+        # في وضع القارئ تكون عملية التحديث قد حدّثت المخزن قبل نشر اللقطة
+        if SNAPSHOT_ROLE != 'reader':
+            history_store.sync_many(analyzer.symbols, analyzer.downloader, period='1y')
+        dates, matrix = history_store.read_matrix(analyzer.symbols, start=period_start('1y'))
+        indicator_engine.load(dates, matrix)
+        print(f" تم حساب المؤشرات الفنية لـ {len(analyzer.symbols)} شركة على {len(dates)} يوم")
+    indicator_engine.update_frame(snapshot.get('summary'))
+
+market_cache.add_listener(update_indicators)
+
+if SNAPSHOT_ROLE == 'refresher':
+    market_cache.add_listener(lambda snapshot: shared_snapshot.publish(snapshot, symbol_master))
+
+# ---------- الشموع اللحظية (15m / 30m / 1h ...) ----------
+bar_aggregator = BarAggregator(analyzer.symbols)
+
+def update_bars(snapshot):
+    """تعبئة الشموع اللحظية من ياهو أول مرة ثم تحديثها من كل لقطة"""
+    if not bar_aggregator.backfilled:
+        # في وضع القارئ لا يُطلب شيء من ياهو - الشموع تُبنى من اللقطات المنشورة فقط
+        if SNAPSHOT_ROLE != 'reader':
+            bar_aggregator.backfill(analyzer.downloader)
+            print(f" تم تحميل الشموع اللحظية: {bar_aggregator.stats()}")
+        bar_aggregator.backfilled = True
+    bar_aggregator.on_snapshot(snapshot)
+
+market_cache.add_listener(update_bars)
+
+# ---------- فهرس الترتيب (الأعلى ربحاً / خسارة / نشاطاً) ----------
+rankings = RankingIndex(analyzer.symbols)
+
+def update_rankings(snapshot):
+    """تحديث الترتيب من اللقطة الجديدة - تتم إعادة ترتيب الشركات المتغيرة فقط"""
+    if indicator_engine.loaded:
+        rankings.set_baseline(indicator_engine.volume_means())
+    rankings.update_rows(snapshot['market_data'])
+
+market_cache.add_listener(update_rankings)
+
+# ---------- فهرس البحث (يُبنى مرة واحدة) ----------
+search_index = SearchIndex({s: SAUDI_COMPANIES[s] for s in analyzer.symbols})
+
+def search_rows(query, limit=10):
+    """نتائج البحث مع آخر قيم السوق (الشركات بدون بيانات تظهر بالاسم والقطاع فقط)"""
+    symbols = search_index.search(query, limit)
+    return [row or {'symbol': s, 'name': symbol_master.name(s), 'sector': symbol_master.sector(s)}
+            for s, row in zip(symbols, rankings.rows_for(symbols))]
+
+def timeframe_rows(market_stats, timeframe):
+    """صفوف السوق بسعر وتغير آخر شمعة في الإطار الزمني (الرموز بدون شموع تبقى يومية)"""
+    bars = bar_aggregator.summary(timeframe)
+    rows = []
+    for row in market_stats:
+        if row['symbol'] in bars.index:
+            bar = bars.loc[row['symbol']]
+            row = dict(row,
+                       last=round(float(bar['last']), 2),
+                       change=round(float(bar['change']), 2),
+                       change_percent=round(float(bar['change_percent']), 2),
+                       volume=int(bar['volume']),
+                       trend='صاعد' if bar['change'] > 0 else 'هابط')
+        rows.append(row)
+    return rows
+
+# ---------- الدفع المباشر (SSE) ----------
+market_events = EventBroker()
+stream_tokens = URLSafeTimedSerializer(app.secret_key, salt='market-stream')
+
+def authorize_stream(token):
+    """التحقق من رمز الاشتراك الذي أصدره /stream/market لمستخدم مسجل"""
+    try:
+        stream_tokens.loads(token, max_age=SSE_CONFIG['token_max_age'])
+        return True
+    except BadSignature:
+        return False
+
+def start_event_server():
+    """
+    تشغيل خادم SSE داخل العملية التي تنشر الأحداث (عملية التحديث أو خادم التطوير):
+    كل المتصفحات تُخدم من حلقة asyncio واحدة بدلاً من خيط WSGI لكل اتصال
+    """
+    if not SSE_CONFIG['enabled']:
+        print(" قناة الدفع غير مفعّلة - الصفحات تستطلع /api/market")
+        return None
+    server = EventServer(market_events, port=SSE_CONFIG['port'], authorize=authorize_stream)
+    server.start()
+    return server
+
+def publish_market_changes(snapshot):
+    """نشر الشركات التي تغيرت في هذا التحديث لجميع المشتركين"""
+    _, rows, removed = market_cache.changes_since(snapshot['version'] - 1)
+    market_events.publish('market', {
+        'version': snapshot['version'],
+        'last_update': snapshot['last_update'].strftime('%H:%M:%S'),
+        'market_overview': snapshot['market_overview'],
+        'sectors': snapshot.get('sectors', []),
+        'changed': rows,
+        'removed': removed
+    })
+
+def publish_tick(stock_data):
+    """نشر تحديث لحظي من خادم البث المباشر وإضافته للشموع (TadawulLiveStream.add_listener)"""
+    if stock_data.get('type') == 'stock_update':
+        bar_aggregator.on_stock_update(stock_data)
+        data = stock_data['data']
+        rankings.update_tick(stock_data['symbol'], data.get('price'), data.get('change'),
+                             data.get('change_percent'), data.get('volume'))
+        market_events.publish('tick', stock_data)
+
+market_cache.add_listener(publish_market_changes)
+
+def live_source_available():
+    """هل مصدر الأسعار اللحظية متاح؟ تكرتشارت يحتاج مكتبة tkrtshare، والإعادة/التركيبي متاحان دائماً"""
+    if market_provider.source('get_individual_stock') != providers.TkShareProvider.name:
+        return True
+    return importlib.util.find_spec('tkrtshare') is not None
+
+def start_live_stream():
+    """
+    تشغيل البث المباشر داخل العملية (عملية التحديث أو خادم التطوير):
+    تكرتشارت يكتب في حالة السوق، والتحديثات تُدمج في اللقطة كل بضع ثوانٍ
+    """
+    if not LIVE_CONFIG['enabled']:
+        print(" البث المباشر غير مفعّل - البيانات من ياهو فقط")
+        return None
+    if not live_source_available():
+        print(" مكتبة tkrtshare غير مثبتة - البث المباشر معطل والبيانات من ياهو فقط")
+        return None
+
+    stream = TadawulLiveStream(host='0.0.0.0', port=LIVE_CONFIG['port'], provider=market_provider,
+                               history_store=history_store)
+    stream.watch(analyzer.symbols)
+    stream.add_listener(market_state.on_stock_update)
+    stream.add_cycle_listener(market_state.touch)
+    stream.add_listener(publish_tick)
+    threading.Thread(target=lambda: asyncio.run(stream.start_server()), name='live-stream', daemon=True).start()
+
+    def merge_live_changes():
+        while True:
+            time.sleep(LIVE_CONFIG['merge_interval'])
+            market_cache.refresh(loader=analyzer.load_live_changes)
+
+    threading.Thread(target=merge_live_changes, name='live-merge', daemon=True).start()
+    return stream
+
+def snapshot_context(snapshot):
+    """متغيرات وقت التحديث وعمر البيانات المشتركة بين الصفحات"""
+    last_update = snapshot['last_update'] or datetime.now()
+    return {
+        'last_update': last_update.strftime('%H:%M:%S'),
+        'data_age': int(snapshot['age'] or 0),
+        'is_stale': snapshot['stale'],
+        'refreshing': snapshot['refreshing'],
+        'data_version': snapshot['version']
+    }
 
-analyzer = StockAnalyzer()
+# ---------- كاش الأجزاء المعروضة (مشترك بين المستخدمين) ----------
+fragment_cache = FragmentCache()
+
+# ---------- زمن مراحل الطلبات: الكاش / الجلب من المصدر / عرض القوالب ----------
+# SLOW_REQUEST_MS: الطلب الأبطأ من هذا الحد يُسجل مع تفصيل مراحله
+request_timer = profiling.RequestTimer(app, slow_ms=float(os.environ.get('SLOW_REQUEST_MS', 500)))
+profiler = profiling.SamplingProfiler()
+market_cache.snapshot = profiling.timed('cache')(market_cache.snapshot)
+market_cache.changes_since = profiling.timed('cache')(market_cache.changes_since)
+fragment_cache.get = profiling.timed('cache')(fragment_cache.get)  # العرض داخله يُحسب render
+market_provider.listeners.append(lambda source, method, seconds: profiling.record('upstream', seconds))
+
+def render_fragment(name, version, key=(), **context):
+    """
+    عرض partials/<name>.html مرة واحدة لكل إصدار من اللقطة
+    (version=None يعني بيانات لا تتبع إصدار اللقطة فيُعرض بدون حفظ)
+    """
+    template = f'partials/{name}.html'
+    if version is None:
+        return Markup(render_template(template, **context))
+    fragment = fragment_cache.get((name,) + key, version, lambda: render_template(template, **context))
+    return Markup(fragment.html)
+
+def fragment_context(name, snapshot, args):
+    """(المفتاح، الإصدار، متغيرات القالب) لجزء من نفس البيانات التي تعرضها الصفحة"""
+    market_stats = snapshot['market_data']
+    if name == 'statistics_table':
+        return (), snapshot['version'], {'market_stats': market_stats}
+
+    search = args.get('search', '').strip()
+    if search:
+        # البحث من الفهرس المحسوب مسبقاً مع الحفاظ على ترتيب قوة التطابق
+        matches = {s: n for n, s in enumerate(search_index.search(search, len(analyzer.symbols)))}
+        market_stats = sorted((row for row in market_stats if row['symbol'] in matches),
+                              key=lambda row: matches[row['symbol']])
+
+    # الإطار الزمني يُقرأ من الشموع اللحظية التي تتغير مع كل تحديث لحظي، فلا يُحفظ
+    timeframe = args.get('timeframe')
+    version = snapshot['version']
+    if timeframe in TIMEFRAMES:
+        market_stats = timeframe_rows(market_stats, timeframe)
+        version = None
+    else:
+        timeframe = None
+    return (search,), version, {'market_stats': market_stats, 'search': search, 'timeframe': timeframe,
+                                'timeframe_label': TIMEFRAME_LABELS.get(timeframe)}
+
+FRAGMENTS = ('market_cards', 'statistics_table')
+
+def top_movers(count=10):
+    """الأعلى ربحاً والأعلى خسارة - قراءة مباشرة من فهرس الترتيب"""
+    return rankings.top('gainers', count), rankings.top('losers', count)
+
+def snapshot_response(name, build):
+    """
+    استجابة JSON مرتبطة بإصدار اللقطة مع دعم ETag/304 ووضع ?since=
+    build(snapshot, payload) يضيف الحقول الخاصة بكل مسار
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        snapshot = market_cache.snapshot()
+        rows, removed = snapshot['market_data'], []
+    else:
+        snapshot, rows, removed = market_cache.changes_since(since)
+
+    payload = {
+        'version': snapshot['version'],
+        'last_update': snapshot['last_update'].strftime('%H:%M:%S') if snapshot['last_update'] else None,
+        'age': snapshot['age'],
+        'stale': snapshot['stale'],
+        'market_overview': snapshot['market_overview']
+    }
+    if since is None:
+        payload['market_data'] = rows
+    else:
+        payload['since'] = since
+        payload['changed'] = rows
+        payload['removed'] = removed
+    build(snapshot, payload)
+
+    response = jsonify(payload)
+    response.set_etag(f"{name}-{snapshot['version']}")
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 # ---------- مسارات Flask ----------
 @app.route('/')
@@ -242,35 +662,240 @@ def login():
 def market():
     if 'username' not in session: return redirect(url_for('login'))
     
-    # جلب البيانات بالمحرك السريع
-    market_stats = analyzer.get_market_statistics_real()
-    market_overview = analyzer.get_market_overview()
+    # قراءة آخر لقطة فوراً - التحديث يتم في الخلفية
+    snapshot = market_cache.snapshot()
+    market_overview = snapshot['market_overview']
+    
+    # البطاقات تُعرض مرة واحدة لكل إصدار وبحث، والترويسة الخاصة بالمستخدم تُعرض لكل طلب
+    key, version, context = fragment_context('market_cards', snapshot, request.args)
     
     return render_template('market.html',
                           username=session.get('username'),
                           market_overview=market_overview,
-                          market_stats=market_stats,
+                          cards_html=render_fragment('market_cards', version, key, **context),
                           all_companies=SAUDI_COMPANIES,
-                          last_update=datetime.now().strftime('%H:%M:%S'))
+                          search=context['search'],
+                          timeframe=context['timeframe'],
+                          **snapshot_context(snapshot))
 
 @app.route('/statistics')
 def statistics():
     if 'username' not in session: return redirect(url_for('login'))
     
-    market_stats = analyzer.get_market_statistics_real()
-    market_overview = analyzer.get_market_overview()
+    snapshot = market_cache.snapshot()
+    market_stats = snapshot['market_data']
+    market_overview = snapshot['market_overview']
     
-    gainers = sorted([s for s in market_stats if s['change'] > 0], key=lambda x: x['change_percent'], reverse=True)[:10]
-    losers = sorted([s for s in market_stats if s['change'] < 0], key=lambda x: x['change_percent'])[:10]
+    gainers, losers = top_movers()
+    
+    key, version, context = fragment_context('statistics_table', snapshot, request.args)
     
     return render_template('statistics.html',
                           username=session.get('username'),
                           market_stats=market_stats,
+                          table_rows_html=render_fragment('statistics_table', version, key, **context),
                           gainers=gainers,
                           losers=losers,
+                          most_active=rankings.top('most_active', 5),
+                          unusual_volume=rankings.top('unusual_volume', 5),
                           total_stocks=len(market_stats),
                           market_overview=market_overview,
-                          last_update=datetime.now().strftime('%H:%M:%S'))
+                          sectors=snapshot.get('sectors', []),
+                          **snapshot_context(snapshot))
+
+@app.route('/analysis/<symbol>')
+def analysis(symbol):
+    if 'username' not in session: return redirect(url_for('login'))
+
+    snapshot = market_cache.snapshot()
+    row = next((s for s in snapshot['market_data'] if s['symbol'] == symbol), None)
+    
+    # ?timeframe= يحلل الشموع اللحظية، وبدونه الشموع اليومية
+    engine = indicator_engine
+    if request.args.get('timeframe') in TIMEFRAMES:
+        engine = bar_aggregator.indicators(symbol, request.args['timeframe']) or indicator_engine
+    result = engine.analyze(symbol, price=row['last'] if row else None)
+    if result is None:
+        return render_template('error.html', error=f'لا تتوفر بيانات تحليل للرمز {symbol}'), 404
+
+    result['name'] = symbol_master.name(symbol)
+    result['sector'] = symbol_master.sector(symbol)
+    return render_template('analysis.html',
+                          username=session.get('username'),
+                          analysis=result)
+
+# ---------- واجهة JSON للتحديث الجزئي ----------
+@app.route('/api/market')
+def api_market():
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+    return snapshot_response('market', lambda snapshot, payload: None)
+
+@app.route('/api/statistics')
+def api_statistics():
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+
+    def build(snapshot, payload):
+        gainers, losers = top_movers()
+        payload['gainers'] = gainers
+        payload['losers'] = losers
+        payload['most_active'] = rankings.top('most_active')
+        payload['unusual_volume'] = rankings.top('unusual_volume')
+        payload['total_stocks'] = len(snapshot['market_data'])
+        payload['sectors'] = snapshot.get('sectors', [])
+
+    return snapshot_response('statistics', build)
+
+@app.route('/api/rankings/<view>')
+def api_rankings(view):
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+    if view not in RANKING_VIEWS:
+        return jsonify({'error': f'قائمة غير معروفة: {view}', 'views': list(RANKING_VIEWS)}), 404
+
+    market_cache.snapshot()  # التأكد من تحميل أول لقطة
+    count = max(1, min(request.args.get('count', 10, type=int), len(analyzer.symbols)))
+    return jsonify({'view': view, 'items': rankings.top(view, count)})
+
+@app.route('/api/search')
+def api_search():
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({'query': query, 'items': search_rows(query, limit)})
+
+@app.route('/fragments/<name>')
+def fragment(name):
+    """جزء معروض جاهز بضغطه المحسوب مسبقاً - لتحديث جزء من الصفحة بدون إعادة تحميلها"""
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+    if name not in FRAGMENTS:
+        return jsonify({'error': f'جزء غير معروف: {name}', 'fragments': list(FRAGMENTS)}), 404
+
+    snapshot = market_cache.snapshot()
+    key, version, context = fragment_context(name, snapshot, request.args)
+    template = f'partials/{name}.html'
+    if version is None:
+        return Response(render_template(template, **context), mimetype='text/html')
+
+    fragment = fragment_cache.get((name,) + key, version, lambda: render_template(template, **context))
+    etag = f'"{name}-{version}-{zlib.crc32(repr(key).encode()):x}"'
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers={'ETag': etag})
+
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    response = Response(fragment.body(encoding), mimetype='text/html')
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/api/fragments/stats')
+def api_fragment_stats():
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+    return jsonify(fragment_cache.stats())
+
+# ---------- مقاييس التشغيل (Prometheus) ----------
+def collect_metrics():
+    """قراءة إحصائيات الكاش وحالة السوق والبث لحظة الطلب"""
+    cache = market_cache.stats()
+    fragments = fragment_cache.stats()
+    state = market_state.stats()
+    families = [
+        ('market_cache_version', 'gauge', 'إصدار لقطة السوق الحالية', [({}, cache['version'])]),
+        ('market_cache_age_seconds', 'gauge', 'عمر لقطة السوق', [({}, cache['age'])]),
+        ('market_cache_expiry_seconds', 'gauge', 'مدة صلاحية لقطة السوق', [({}, cache['expiry'])]),
+        ('market_cache_reads_total', 'counter', 'قراءات اللقطة حسب صلاحيتها',
+         [({'state': 'fresh'}, cache['fresh_reads']), ({'state': 'stale'}, cache['stale_reads'])]),
+        ('market_cache_refresh_failures_total', 'counter', 'تحديثات اللقطة الفاشلة', [({}, cache['refresh_failures'])]),
+        ('market_cache_last_refresh_seconds', 'gauge', 'زمن آخر تحديث للقطة', [({}, cache['refresh_duration'])]),
+        ('fragment_cache_requests_total', 'counter', 'طلبات كاش الأجزاء المعروضة',
+         [({'result': 'hit'}, fragments['hits']), ({'result': 'miss'}, fragments['misses'])]),
+        ('fragment_cache_bytes', 'gauge', 'حجم الأجزاء المحفوظة', [({}, fragments['bytes'])]),
+        ('live_symbols', 'gauge', 'الشركات التي لها قيمة بث حية حديثة', [({}, state['live_symbols'])]),
+        ('live_updates_total', 'counter', 'تحديثات البث المستلمة', [({}, state['live_updates'])]),
+        ('sse_clients', 'gauge', 'المتصفحات المتصلة بقناة الدفع', [({}, market_events.subscribers)]),
+    ]
+    if shared_snapshot is not None:
+        families.append(('shared_snapshot_read_retries_total', 'counter', 'إعادات قراءة اللقطة المشتركة',
+                         [({}, shared_snapshot.stats()['read_retries'])]))
+    return families
+
+metrics.register(collect_metrics)
+shared_metrics = SharedText.attach(METRICS_SHM) if METRICS_SHM else None
+
+def start_metrics_publisher():
+    """
+    عملية التحديث وحدها تطلب المصادر: تنشر مقاييسها كل بضع ثوانٍ في الذاكرة المشتركة
+    ليعرضها /metrics في أي عامل (بتسمية process="refresher")
+    """
+    if shared_metrics is None:
+        return None
+
+    def publish():
+        while True:
+            try:
+                shared_metrics.write(metrics.render(labels={'process': 'refresher'}))
+            except Exception as e:
+                print(f" خطأ في نشر المقاييس: {e}")
+            time.sleep(METRICS_CONFIG['interval'])
+
+    thread = threading.Thread(target=publish, name='metrics-publisher', daemon=True)
+    thread.start()
+    return thread
+
+@app.route('/metrics')
+def metrics_endpoint():
+    extra = []
+    if shared_metrics is not None and SNAPSHOT_ROLE == 'reader':
+        text, updated_at = shared_metrics.read()
+        # عملية تحديث متوقفة لا تُعرض مقاييسها القديمة كأنها حالية
+        if time.time() - updated_at < METRICS_CONFIG['max_age']:
+            extra.append(text)
+    return Response(metrics.render(extra=extra), content_type=metrics.CONTENT_TYPE)
+
+# ---------- أدوات المدير: زمن المسارات وتحليل الأداء ----------
+def is_admin():
+    return session.get('username') == 'admin'
+
+@app.route('/admin/timings')
+def admin_timings():
+    if not is_admin(): return jsonify({'error': 'غير مصرح'}), 403
+    return jsonify(request_timer.stats())
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    POST ?seconds=30&interval_ms=5 يبدأ التحليل في هذه العملية لفترة محددة؛
+    GET يعيد الحالة، و ?format=folded يعيد آخر نتيجة بصيغة folded stacks
+    """
+    if not is_admin(): return jsonify({'error': 'غير مصرح'}), 403
+    if request.method == 'POST':
+        seconds = min(max(request.args.get('seconds', 30, type=float), 1), 600)
+        interval = min(max(request.args.get('interval_ms', 5, type=float), 1), 1000) / 1000
+        if not profiler.start(seconds, interval):
+            return jsonify(dict(profiler.status(), error='يوجد تحليل جارٍ')), 409
+        return jsonify(profiler.status()), 202
+    if request.args.get('format') == 'folded':
+        return Response(profiler.folded(), mimetype='text/plain',
+                        headers={'Content-Disposition': 'attachment; filename=profile.folded'})
+    return jsonify(profiler.status())
+
+@app.route('/stream/market')
+def stream_market():
+    if 'username' not in session: return jsonify({'error': 'غير مصرح'}), 401
+
+    market_cache.start()
+    if not SSE_CONFIG['enabled']:
+        return Response(status=503, headers={'Retry-After': '30'})
+
+    # تحويل المتصفح لخادم SSE غير المتزامن: لا يبقى خيط WSGI محجوزاً طوال الاشتراك
+    query = {'token': stream_tokens.dumps(session['username'])}
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    if last_event_id:
+        query['last_event_id'] = last_event_id
+    host = request.host if request.host.endswith(']') else request.host.rsplit(':', 1)[0]
+    base = SSE_CONFIG['public_url'] or f"{request.scheme}://{host}:{SSE_CONFIG['port']}"
+    return redirect(f"{base.rstrip('/')}/stream/market?{urlencode(query)}", code=307)
 
 @app.route('/logout')
 def logout():
@@ -278,6 +903,6 @@ def logout():
     return redirect(url_for('login'))
 
 if __name__ == '__main__':
-    if not os.path.exists('templates'): os.makedirs('templates')
-    print(" تم تشغيل المحرك السريع - جميع الشركات جاهزة")
-    app.run(debug=True, host='0.0.0.0', port=8000, use_reloader=False)
\ No newline at end of file
+    # التشغيل عبر serve.py: عملية تحديث واحدة وعدة عمليات خادم (--dev لخادم Flask الواحد)
+    import serve
+    serve.main()
\ No newline at end of file
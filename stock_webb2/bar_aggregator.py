@@ -0,0 +1,267 @@
+"""
+مجمّع الشموع اللحظية (1m / 5m / 15m / 30m / 1h)
+يحوّل التحديثات اللحظية إلى شموع OHLCV لكل الرموز في مخازن دائرية ثابتة الحجم،
+مع تعبئة أولية من بيانات ياهو اللحظية، فيصبح تغيير الإطار الزمني قراءة من الذاكرة
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+import market_hours
+from indicators import IndicatorEngine
+
+# الإطار الزمني -> طوله بالثواني
+TIMEFRAMES = {'1m': 60, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600}
+TIMEFRAME_LABELS = {'1m': 'دقيقة', '5m': '5 دقائق', '15m': '15 دقيقة', '30m': '30 دقيقة', '1h': 'ساعة واحدة'}
+
+# طلبات التعبئة الأولية: (الفترة، الفاصل في ياهو، الأطر المشتقة منها)
+BACKFILL_REQUESTS = (
+    ('5d', '1m', ('1m', '5m')),
+    ('60d', '15m', ('15m', '30m', '1h')),
+)
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class BarRing:
+    """
+    شموع إطار زمني واحد لكل الرموز: مصفوفات (رموز × سعة) ومؤشر للشمعة الحالية لكل رمز
+    """
+
+    def __init__(self, symbols_count, seconds, capacity):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.time = np.zeros((symbols_count, capacity), dtype=np.int64)  # بداية الشمعة (ثواني يونكس)
+        self.bars = {f: np.zeros((symbols_count, capacity)) for f in FIELDS}
+        self.head = np.zeros(symbols_count, dtype=np.int64)
+        self.count = np.zeros(symbols_count, dtype=np.int64)
+
+    def update(self, rows, price, delta_volume, timestamp):
+        """تطبيق سعر لعدة رموز في نفس اللحظة (rows بدون تكرار)"""
+        bucket = int(timestamp) // self.seconds * self.seconds
+        head = self.head[rows]
+        current = self.time[rows, head]
+        empty = self.count[rows] == 0
+
+        same = ~empty & (current == bucket)
+        if same.any():
+            r, h = rows[same], head[same]
+            self.bars['high'][r, h] = np.maximum(self.bars['high'][r, h], price[same])
+            self.bars['low'][r, h] = np.minimum(self.bars['low'][r, h], price[same])
+            self.bars['close'][r, h] = price[same]
+            self.bars['volume'][r, h] += delta_volume[same]
+
+        # التحديثات الأقدم من الشمعة الحالية تُتجاهل
+        new = empty | (current < bucket)
+        if new.any():
+            r = rows[new]
+            h = np.where(empty[new], 0, (head[new] + 1) % self.capacity)
+            self.head[r] = h
+            self.count[r] = np.minimum(self.count[r] + 1, self.capacity)
+            self.time[r, h] = bucket
+            for f in ('open', 'high', 'low', 'close'):
+                self.bars[f][r, h] = price[new]
+            self.bars['volume'][r, h] = delta_volume[new]
+
+    def ordered(self, row):
+        """فهارس شموع الرمز من الأقدم للأحدث"""
+        count = int(self.count[row])
+        return (self.head[row] - np.arange(count - 1, -1, -1)) % self.capacity
+
+    def load(self, row, times, values):
+        """
+        دمج شموع تاريخية للرمز: الشموع الحية الموجودة لها الأولوية،
+        ويُحتفظ بآخر capacity شمعة فقط
+        """
+        order = self.ordered(row)
+        live_times = self.time[row, order]
+        keep = times < live_times[0] if len(order) else np.ones(len(times), dtype=bool)
+        times = np.concatenate([times[keep], live_times])[-self.capacity:]
+        merged = {f: np.concatenate([values[f][keep], self.bars[f][row, order]])[-self.capacity:] for f in FIELDS}
+
+        n = len(times)
+        self.time[row, :n] = times
+        for f in FIELDS:
+            self.bars[f][row, :n] = merged[f]
+        self.count[row] = n
+        self.head[row] = max(n - 1, 0)
+
+
+class BarAggregator:
+    """
+    شموع لحظية لكل الرموز ولكل الأطر الزمنية
+    """
+
+    def __init__(self, symbols, capacity=500, timeframes=TIMEFRAMES):
+        """
+        Args:
+            symbols: الرموز المتابعة
+            capacity: عدد الشموع المحفوظة لكل رمز في كل إطار
+        """
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.rings = {tf: BarRing(len(self.symbols), seconds, capacity) for tf, seconds in timeframes.items()}
+        self.cum_volume = np.full(len(self.symbols), np.nan)  # آخر حجم تراكمي يومي لكل رمز
+        self.session = None  # يوم الجلسة الذي يعود له الحجم التراكمي
+        self._session_checked = -np.inf  # آخر تحقق من تغير الجلسة (مرة في الدقيقة على الأكثر)
+        self.backfilled = False
+        self._engines = {}  # (الرمز، الإطار) -> (محرك المؤشرات، وقت آخر شمعة مطبقة)
+        self._lock = threading.Lock()
+        self._engines_lock = threading.Lock()
+
+    # ---------- التحديث ----------
+    def update(self, symbols, prices, volumes, timestamp=None):
+        """
+        تطبيق أسعار لحظية لعدة رموز
+
+        Args:
+            volumes: حجم التداول التراكمي لليوم (كما يرسله المصدر)؛ حجم الشمعة هو الفرق بين تحديثين
+            timestamp: وقت التحديث (ثواني يونكس)
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        rows = np.array([self.index.get(s, -1) for s in symbols], dtype=np.int64)
+        prices = np.asarray(prices, dtype=float)
+        volumes = np.asarray(volumes, dtype=float)
+        valid = (rows >= 0) & ~np.isnan(prices) & (prices > 0)
+        rows, prices, volumes = rows[valid], prices[valid], volumes[valid]
+        if len(rows) == 0:
+            return
+
+        with self._lock:
+            if abs(timestamp - self._session_checked) >= 60:
+                self._session_checked = timestamp
+                session = market_hours.last_session(timestamp)
+                if session != self.session:
+                    # جلسة جديدة: يبدأ الحجم التراكمي من الصفر
+                    self.session = session
+                    self.cum_volume[:] = np.nan
+            previous = self.cum_volume[rows]
+            # أول قراءة في الجلسة لا تُنسب لشمعة، والحجم الأقل من السابق (مصدر متأخر) لا يضيف شيئاً
+            delta = np.nan_to_num(np.maximum(volumes - previous, 0.0))
+            self.cum_volume[rows] = np.fmax(previous, volumes)
+            for ring in self.rings.values():
+                ring.update(rows, prices, delta, timestamp)
+
+    def on_stock_update(self, stock_data):
+        """مستمع لـ TadawulLiveStream.add_listener"""
+        if stock_data.get('type') == 'stock_update':
+            data = stock_data['data']
+            self.update([stock_data['symbol']], [data.get('price') or np.nan], [data.get('volume') or np.nan])
+
+    def on_snapshot(self, snapshot, now=None):
+        """
+        مستمع لـ MarketCache: آخر سعر وحجم اليوم من كل تحديث للكاش
+
+        أثناء جلسة التداول فقط: خارجها تكرر قيم ياهو اليومية نفس الإغلاق،
+        وكل تحديث كان يضيف شمعة مسطحة تدفع الشموع الحقيقية خارج المخزن الدائري
+        """
+        now = time.time() if now is None else now
+        summary = snapshot.get('summary')
+        if summary is None or not len(summary) or not market_hours.is_open(now):
+            return
+        self.update(summary.index, summary['last'].to_numpy(), summary['volume'].to_numpy(), timestamp=now)
+
+    # ---------- التعبئة الأولية ----------
+    def backfill(self, downloader):
+        """تعبئة الشموع من بيانات ياهو اللحظية بطلبات مجمّعة (BatchDownloader)"""
+        for period, interval, timeframes in BACKFILL_REQUESTS:
+            wide = downloader.download(self.symbols, period=period, interval=interval)
+            if wide.empty:
+                continue
+            index = wide.index.tz_convert('UTC') if wide.index.tz is not None else wide.index
+            wide = wide.set_axis(index.tz_localize(None) if index.tz is not None else index)
+            for tf in timeframes:
+                self._load_frame(tf, wide)
+        self.backfilled = True
+
+    def _load_frame(self, timeframe, wide):
+        ring = self.rings[timeframe]
+        rule = f"{ring.seconds}s"
+        agg = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+        resampled = {field.lower(): wide[field].resample(rule).agg(how)
+                     for field, how in agg.items() if field in wide.columns.get_level_values(0)}
+        close = resampled['close']
+        times = close.index.values.astype('datetime64[s]').astype(np.int64)
+
+        with self._lock:
+            for symbol in close.columns:
+                row = self.index.get(symbol)
+                if row is None:
+                    continue
+                valid = ~np.isnan(close[symbol].to_numpy())
+                values = {f: resampled[f][symbol].to_numpy(dtype=float)[valid] if f in resampled
+                          else np.zeros(int(valid.sum())) for f in FIELDS}
+                ring.load(row, times[valid], values)
+
+    # ---------- القراءة ----------
+    def read(self, symbol, timeframe, count=None):
+        """شموع الرمز كـ DataFrame (من الأقدم للأحدث) بنفس أعمدة ياهو"""
+        ring = self.rings[timeframe]
+        row = self.index[symbol]
+        with self._lock:
+            order = ring.ordered(row)
+            if count is not None:
+                order = order[-count:]
+            frame = pd.DataFrame({f.capitalize(): ring.bars[f][row, order] for f in FIELDS},
+                                 index=pd.DatetimeIndex(ring.time[row, order].astype('datetime64[s]'), name='Date'))
+        return frame
+
+    def summary(self, timeframe):
+        """
+        آخر شمعة لكل الرموز بشكل متجه، بنفس أعمدة batch_fetch.summarize
+        (التغير = إغلاق الشمعة الحالية مقابل إغلاق الشمعة السابقة)
+        """
+        ring = self.rings[timeframe]
+        with self._lock:
+            rows = np.flatnonzero(ring.count > 0)
+            head = ring.head[rows]
+            previous = np.where(ring.count[rows] > 1, (head - 1) % ring.capacity, head)
+            bar = {f: ring.bars[f][rows, head] for f in FIELDS}
+            prev = ring.bars['close'][rows, previous]
+            times = ring.time[rows, head]
+
+        change = bar['close'] - prev
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change_percent = np.where(prev != 0, change / prev * 100, 0.0)
+        return pd.DataFrame({
+            'date': pd.DatetimeIndex(times.astype('datetime64[s]')),
+            'open': bar['open'],
+            'high': bar['high'],
+            'low': bar['low'],
+            'last': bar['close'],
+            'prev': prev,
+            'change': change,
+            'change_percent': change_percent,
+            'volume': bar['volume'],
+        }, index=pd.Index([self.symbols[r] for r in rows], name='symbol'))
+
+    def indicators(self, symbol, timeframe):
+        """
+        محرك مؤشرات فنية لرمز واحد على شموع الإطار الزمني
+
+        يُحفظ المحرك بين الطلبات ويُطبق عليه فقط ما استجد من شموع
+        (الشمعة الحالية غير المكتملة يُعاد تطبيقها بدلاً من إضافتها)
+        """
+        if symbol not in self.index:
+            return None
+        bars = self.read(symbol, timeframe)
+        if bars.empty:
+            return None
+
+        key = (symbol, timeframe)
+        times = bars.index.values.astype('datetime64[s]').astype(np.int64)
+        with self._engines_lock:
+            engine, last_time = self._engines.get(key, (None, None))
+            if engine is None or last_time < times[0]:
+                engine = IndicatorEngine([symbol], unit='s', label=TIMEFRAME_LABELS[timeframe])
+            else:
+                bars = bars[times >= last_time]
+            for date, row in zip(bars.index, bars.itertuples(index=False)):
+                engine.update(date, [row.Open], [row.High], [row.Low], [row.Close], [row.Volume])
+            engine.loaded = True
+            self._engines[key] = (engine, int(times[-1]))
+        return engine
+
+    def stats(self):
+        return {tf: int(ring.count.sum()) for tf, ring in self.rings.items()}
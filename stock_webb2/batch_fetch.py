@@ -0,0 +1,180 @@
+"""
+محرك الجلب المجمّع لبيانات الأسهم
+يجلب جميع الرموز على دفعات (chunks) بطلبات متعددة الرموز بدلاً من طلب لكل سهم،
+ثم يحسب آخر سعر والتغير والحجم لكل الرموز دفعة واحدة باستخدام NumPy
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from providers import LiveProvider
+from metrics import SYMBOL_FAILURES
+
+OHLCV_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class BatchDownloader:
+    """
+    جلب مجمّع لعدة رموز في إطار بيانات عريض واحد
+    """
+
+    def __init__(self, chunk_size=40, max_workers=4, suffix='.SR', provider=None):
+        """
+        Args:
+            chunk_size: عدد الرموز في كل طلب
+            max_workers: عدد الدفعات التي تُجلب بالتوازي
+            suffix: لاحقة السوق في ياهو (.SR للسوق السعودي)
+            provider: مزود البيانات (providers.py) - ياهو افتراضياً
+        """
+        self.chunk_size = max(1, int(chunk_size))
+        self.max_workers = max(1, int(max_workers))
+        self.suffix = suffix
+        self.provider = provider or LiveProvider()
+
+    def _chunks(self, symbols):
+        for i in range(0, len(symbols), self.chunk_size):
+            yield symbols[i:i + self.chunk_size]
+
+    def _to_ticker(self, symbol):
+        return symbol if symbol.startswith('^') or symbol.endswith(self.suffix) else f"{symbol}{self.suffix}"
+
+    def _to_symbol(self, ticker):
+        return ticker[:-len(self.suffix)] if ticker.endswith(self.suffix) else ticker
+
+    def _download_chunk(self, chunk, **kwargs):
+        """
+        جلب دفعة واحدة - yf.download يجلب كل رمز بطلب مستقل ويعيد أعمدة فارغة للرموز الفاشلة،
+        وأي خطأ مرفوع (تقييد أو توقف المصدر) يُسقط الدفعة كاملة وتعيد المحاولة طبقة upstream.py
+        """
+        tickers = [self._to_ticker(s) for s in chunk]
+        try:
+            frame = self.provider.download(tickers, group_by='column', auto_adjust=True,
+                                           threads=False, progress=False, **kwargs)
+        except Exception as e:
+            print(f" فشل جلب دفعة من {len(chunk)} رمز: {e}")
+            return None
+
+        if frame is None or frame.empty:
+            return None
+
+        # توحيد الشكل: أعمدة (الحقل، الرمز) حتى عند وجود رمز واحد فقط
+        if not isinstance(frame.columns, pd.MultiIndex):
+            frame.columns = pd.MultiIndex.from_product([frame.columns, [tickers[0]]])
+
+        frame = frame.loc[:, frame.columns.get_level_values(0).isin(OHLCV_FIELDS)]
+        frame.columns = pd.MultiIndex.from_arrays([
+            frame.columns.get_level_values(0),
+            [self._to_symbol(t) for t in frame.columns.get_level_values(1)],
+        ])
+        return frame
+
+    def download(self, symbols, period='2d', interval='1d', **kwargs):
+        """
+        جلب جميع الرموز وإرجاع إطار بيانات عريض واحد
+
+        Returns:
+            DataFrame بأعمدة MultiIndex (الحقل، الرمز) وفهرس زمني
+        """
+        return self.fetch(symbols, period=period, interval=interval, **kwargs)[0]
+
+    def fetch(self, symbols, period='2d', interval='1d', **kwargs):
+        """
+        مثل download مع قائمة الرموز الفاشلة لهذا الاستدعاء فقط
+        (الاستدعاءات المتزامنة من التحديث ومزامنة التاريخ والشموع لا تتشارك أي حالة)
+
+        Returns:
+            (DataFrame، الرموز التي لم يعد لها أي سعر إغلاق)
+        """
+        symbols = list(symbols)
+        if not symbols:
+            return pd.DataFrame(), []
+
+        if period is not None and 'start' not in kwargs:
+            kwargs['period'] = period
+        kwargs['interval'] = interval
+
+        chunks = list(self._chunks(symbols))
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+            frames = list(executor.map(lambda c: self._download_chunk(c, **kwargs), chunks))
+
+        frames = [f for f in frames if f is not None and not f.empty]
+        if not frames:
+            self._count_failures(symbols)
+            return pd.DataFrame(), symbols
+
+        wide = pd.concat(frames, axis=1).sort_index()
+        wide = wide.loc[:, ~wide.columns.duplicated()]
+
+        # الرموز الغائبة أو التي عادت بدون أي سعر إغلاق تُعتبر فاشلة
+        close = wide['Close']
+        fetched = set(close.columns[close.notna().any().to_numpy()])
+        failed = [s for s in symbols if self._to_symbol(s) not in fetched]
+        self._count_failures(failed)
+        return wide, failed
+
+    def _count_failures(self, failed):
+        source = self.provider.source('download')
+        for symbol in failed:
+            SYMBOL_FAILURES.inc(symbol=self._to_symbol(symbol), source=source)
+
+
+def summarize(wide):
+    """
+    حساب آخر سعر والسعر السابق والتغير والحجم لكل الرموز بشكل متجه
+
+    يعتمد على آخر قيمتين صالحتين في كل عمود، لذلك لا يتأثر برموز
+    ينقصها يوم تداول في نهاية الإطار
+
+    Returns:
+        DataFrame مفهرس بالرمز يحتوي: date, open, high, low, last, prev, change, change_percent, volume
+    """
+    columns = ['date', 'open', 'high', 'low', 'last', 'prev', 'change', 'change_percent', 'volume']
+    if wide is None or wide.empty:
+        return pd.DataFrame(columns=columns)
+
+    close_frame = wide['Close']
+    symbols = close_frame.columns
+    close = close_frame.to_numpy(dtype=float)
+
+    def field(name):
+        if name in wide.columns.get_level_values(0):
+            return wide[name].reindex(columns=symbols).to_numpy(dtype=float)
+        return np.full_like(close, np.nan)
+
+    valid = ~np.isnan(close)
+    counts = np.cumsum(valid, axis=0)
+    total = counts[-1]
+
+    # في كل عمود توجد خلية واحدة فقط تحقق كل شرط
+    last_mask = valid & (counts == total)
+    prev_mask = valid & (counts == total - 1)
+
+    def pick(values, mask):
+        picked = np.where(mask, values, 0.0).sum(axis=0)
+        return np.where(mask.any(axis=0), picked, np.nan)
+
+    last = pick(close, last_mask)
+    prev = pick(close, prev_mask)
+    prev = np.where(np.isnan(prev), last, prev)
+
+    change = last - prev
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_percent = np.where(prev != 0, change / prev * 100, 0.0)
+
+    # تاريخ آخر شمعة صالحة لكل رمز
+    dates = wide.index[np.argmax(last_mask, axis=0)]
+    if getattr(dates, 'tz', None) is not None:
+        dates = dates.tz_localize(None)
+
+    result = pd.DataFrame({
+        'date': dates.normalize(),
+        'open': pick(field('Open'), last_mask),
+        'high': pick(field('High'), last_mask),
+        'low': pick(field('Low'), last_mask),
+        'last': last,
+        'prev': prev,
+        'change': change,
+        'change_percent': change_percent,
+        'volume': np.nan_to_num(pick(field('Volume'), last_mask)),
+    }, index=pd.Index(symbols, name='symbol'))
+    return result[~np.isnan(last)]
@@ -0,0 +1,432 @@
+"""
+قياس أداء المسارات الحرجة على مزود بيانات محلي (بدون شبكة)
+
+    python benchmark.py                      # كل القياسات على المولد التركيبي
+    python benchmark.py --only refresh pages # قياسات محددة
+    python benchmark.py --clients 500        # عدد عملاء WebSocket
+    python benchmark.py --only throttle      # التحديث الكامل مع مصدر يقيّد الطلبات (429)
+    MARKET_DATA=replay:session.rec:max python benchmark.py   # على جلسة مسجلة
+
+كل تشغيل يُضاف كسطر JSON إلى data/benchmarks.jsonl مع رقم الـ commit،
+ويُقارن بآخر تشغيل لـ commit مختلف لإظهار التراجع في الأداء
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+os.environ.setdefault('MARKET_DATA', 'synthetic')
+os.environ.pop('MARKET_SNAPSHOT_SHM', None)  # القياس داخل عملية واحدة
+
+RESULTS_PATH = os.path.join('data', 'benchmarks.jsonl')
+BENCHMARKS = ('refresh', 'pages', 'broadcast', 'throttle')
+
+
+def measure(fn, repeat, before=None):
+    """
+    تشغيل fn عدة مرات وإعادة إحصائيات الزمن (ملي ثانية)
+
+    Args:
+        before: دالة تُستدعى قبل كل تشغيل خارج الزمن المقاس (لتفريغ الكاش مثلاً)
+    """
+    samples = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+def summarize(samples):
+    samples = np.asarray(samples, dtype=float)
+    return {
+        'n': int(len(samples)),
+        'min_ms': round(float(samples.min()), 3),
+        'median_ms': round(float(np.median(samples)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'mean_ms': round(float(samples.mean()), 3),
+    }
+
+
+def load_app():
+    """تحميل التطبيق مع مخزن تاريخي مؤقت حتى لا تختلط البيانات المولدة بالمخزن الحقيقي"""
+    import app
+    from history_store import HistoryStore
+    app.history_store = HistoryStore(tempfile.mkdtemp(prefix='bench_history_'))
+    return app
+
+
+# ---------- تحديث السوق ----------
+def bench_refresh(app, repeat):
+    """تحديث كامل للسوق (جلب + ملخص + مستمعين) وقراءة الإحصائيات من اللقطة"""
+    app.market_cache.refresh()  # التحميل الأول (المؤشرات والشموع) خارج القياس
+    return {
+        'market_refresh': measure(app.market_cache.refresh, repeat),
+        'get_market_statistics_real': measure(app.analyzer.get_market_statistics_real, repeat * 10),
+    }
+
+
+# ---------- الصفحات ----------
+def bench_pages(app, repeat):
+    """زمن /market و /statistics بكاش بارد (عرض كامل) ودافئ (أجزاء محفوظة)"""
+    if not app.market_cache.snapshot().get('market_data'):
+        app.market_cache.refresh()
+    client = app.app.test_client()
+    with client.session_transaction() as s:
+        s['username'] = 'benchmark'
+
+    results = {}
+    for path in ('/market', '/statistics'):
+        def request():
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        results[f'{path}_cold'] = measure(request, repeat, before=app.fragment_cache.clear)
+        request()
+        results[f'{path}_warm'] = measure(request, repeat * 5)
+    return results
+
+
+# ---------- التحديث تحت التقييد ----------
+class ThrottledYahoo:
+    """
+    بديل لوحدة yfinance بحد طلبات (token bucket) وزمن استجابة بذيل طويل، يتصرف مثل yf.download:
+    طلب مستقل لكل رمز، والرمز المرفوض (429) يعود بأعمدة فارغة مع تسجيل الخطأ في مسجل yfinance
+    """
+
+    def __init__(self, inner, rate, burst, latency=0.02, slow_ratio=0.05, seed=1):
+        self.inner = inner
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.slow_ratio = slow_ratio
+        self.rng = np.random.default_rng(seed)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            else:
+                self.throttled += 1
+            delay = self.latency * self.rng.lognormal(0, 0.3) * (10 if self.rng.random() < self.slow_ratio else 1)
+        time.sleep(delay if allowed else self.latency / 5)
+        return allowed
+
+    def download(self, tickers, session=None, **kwargs):
+        frame = self.inner.download(tickers, **kwargs)
+        rejected = [t for t in tickers if not self._request()]
+        if rejected:
+            frame.loc[:, frame.columns.get_level_values(1).isin(rejected)] = np.nan
+            logger = logging.getLogger('yfinance')
+            logger.error(f'\n{len(rejected)} Failed downloads:')
+            logger.error(f"{rejected}: YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')")
+        return frame
+
+
+class PlainYahoo:
+    """yf.download مباشرة بدون فحص الأخطاء (سلوك الجلب قبل طبقة upstream.py)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def source(self, method):
+        return 'yahoo'
+
+    def download(self, tickers, **kwargs):
+        return self.client.download(tickers, **kwargs)
+
+
+def bench_throttle(repeat, chunk_size=10, workers=8, rate=20.0, burst=10, timeout=60):
+    """
+    تحديث كامل عبر BatchDownloader على ياهو مقيّدة: yf.download مباشرة بعدد عمال ثابت،
+    ثم عبر YFinanceProvider + ResilientProvider كما في التطبيق.
+    يُقاس التحديث الواحد (الزمن والرموز الناجحة والطلبات وردود 429) والزمن حتى اكتمال كل الرموز
+    بإعادة جلب الفاشلة فوراً
+    """
+    from batch_fetch import BatchDownloader
+    from providers import SyntheticProvider, YFinanceProvider
+    from upstream import ResilientProvider
+
+    logging.getLogger('yfinance').addHandler(logging.NullHandler())
+    symbols = [str(1000 + i) for i in range(200)]
+    results = {}
+    for name in ('direct', 'resilient'):
+        yahoo = ThrottledYahoo(SyntheticProvider([s + '.SR' for s in symbols], seed=1), rate, burst)
+        if name == 'direct':
+            provider = PlainYahoo(yahoo)
+        else:
+            provider = ResilientProvider(YFinanceProvider(cache=False, client=yahoo),
+                                         initial_concurrency=4, max_concurrency=workers, backoff=0.1)
+        downloader = BatchDownloader(chunk_size=chunk_size, max_workers=workers, provider=provider)
+        samples, succeeded, complete, rounds = [], [], [], []
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):  # رسالة لكل دفعة فاشلة
+            for _ in range(repeat):
+                time.sleep(burst / rate)  # امتلاء الرصيد بين التحديثات
+                if name == 'resilient':
+                    provider.last_good.clear()  # النجاح من آخر نتيجة محفوظة لا يُحسب
+                started = time.perf_counter()
+                _, failed = downloader.fetch(symbols)
+                samples.append((time.perf_counter() - started) * 1000)
+                succeeded.append(len(symbols) - len(failed))
+                n = 1
+                while failed and time.perf_counter() - started < timeout:
+                    _, failed = downloader.fetch(failed)
+                    n += 1
+                complete.append((time.perf_counter() - started) * 1000)
+                rounds.append(n)
+        results[f'{name}_refresh'] = summarize(samples)
+        results[f'{name}_complete'] = summarize(complete)
+        results[f'{name}_ok_symbols'] = round(float(np.mean(succeeded)), 1)
+        results[f'{name}_rounds'] = round(float(np.mean(rounds)), 1)
+        results[f'{name}_requests'] = round(yahoo.requests / repeat, 1)
+        results[f'{name}_throttled'] = round(yahoo.throttled / repeat, 1)
+        if name == 'resilient':
+            provider._executor.shutdown(wait=False)
+    return results
+
+
+# ---------- بث WebSocket ----------
+def rss_bytes():
+    """الذاكرة المقيمة للعملية الحالية (لينكس)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def stream_server(conn, port, symbol, batch_window):
+    """
+    عملية الخادم: TadawulLiveStream على مزود تركيبي، تنشر تحديثاً عند كل أمر publish
+    وتعيد وقت النشر، وتعيد ذاكرتها عند أمر rss
+    """
+    sys.stdout = open(os.devnull, 'w')  # رسائل الاتصال لكل عميل
+    import websockets
+    from providers import SyntheticProvider
+    from websocket_stream import TadawulLiveStream
+
+    stream = TadawulLiveStream(host='127.0.0.1', port=port, batch_window=batch_window,
+                               stream_depth=False, provider=SyntheticProvider([symbol], seed=1))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        async with websockets.serve(stream.handler, '127.0.0.1', port, write_limit=stream.write_limit):
+            conn.send(('ready', rss_bytes()))
+            price = 100.0
+            while True:
+                command = await loop.run_in_executor(None, conn.recv)
+                if command == 'stop':
+                    return
+                if command == 'rss':
+                    conn.send(rss_bytes())
+                elif command == 'publish':
+                    price = round(price + 0.01, 2)
+                    sent = time.time()
+                    stream.publish(symbol, {'type': 'stock_update', 'symbol': symbol,
+                                            'data': {'price': price, 'volume': int(price * 100)}})
+                    conn.send(sent)
+
+    asyncio.run(main())
+
+
+async def run_clients(conn, port, symbol, clients, rounds):
+    import websockets
+    loop = asyncio.get_running_loop()
+    sockets = []
+    for _ in range(clients):
+        websocket = await websockets.connect(f'ws://127.0.0.1:{port}', max_size=None)
+        await websocket.send(json.dumps({'type': 'subscribe', 'symbol': symbol}))
+        await websocket.recv()  # البيانات الأولية
+        sockets.append(websocket)
+    conn.send('rss')
+    connected_rss = await loop.run_in_executor(None, conn.recv)
+
+    latencies = []
+    for _ in range(rounds):
+        receives = [asyncio.ensure_future(websocket.recv()) for websocket in sockets]
+        conn.send('publish')
+        sent = await loop.run_in_executor(None, conn.recv)
+        arrivals = []
+        for receive in asyncio.as_completed(receives):
+            await receive
+            arrivals.append(time.time())
+        latencies.extend((t - sent) * 1000 for t in arrivals)
+
+    for websocket in sockets:
+        await websocket.close()
+    return connected_rss, latencies
+
+
+def bench_broadcast(clients, rounds, batch_window):
+    """
+    زمن وصول التحديث من TadawulLiveStream.publish إلى N عميل مشترك (الخادم في عملية منفصلة)،
+    والذاكرة الإضافية للخادم لكل عميل متصل
+    """
+    symbol = '2222'
+    port = free_port()
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    conn, child_conn = context.Pipe()
+    server = context.Process(target=stream_server, args=(child_conn, port, symbol, batch_window), daemon=True)
+    server.start()
+    try:
+        _, idle_rss = conn.recv()
+        connected_rss, latencies = asyncio.run(run_clients(conn, port, symbol, clients, rounds))
+        conn.send('stop')
+    finally:
+        server.join(timeout=5)
+        if server.is_alive():
+            server.terminate()
+
+    result = {f'ws_broadcast_{clients}_clients': summarize(latencies), 'batch_window_ms': batch_window * 1000}
+    if idle_rss is not None and connected_rss is not None:
+        result['memory_per_client_kb'] = round((connected_rss - idle_rss) / clients / 1024, 1)
+    return result
+
+
+# ---------- حفظ النتائج والمقارنة ----------
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results):
+    """{'pages': {'/market_cold': {'median_ms': ..}}} -> {'pages./market_cold': median}"""
+    flat = {}
+    for group, values in results.items():
+        for name, value in values.items():
+            if isinstance(value, dict) and 'median_ms' in value:
+                flat[f'{group}.{name}'] = value['median_ms']
+            elif isinstance(value, (int, float)):
+                flat[f'{group}.{name}'] = value
+    return flat
+
+
+def previous_run(path, commit):
+    """آخر تشغيل محفوظ لـ commit مختلف"""
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            run = json.loads(line)
+            if run.get('commit') != commit:
+                previous = run
+    return previous
+
+
+def compare(current, previous, threshold):
+    """طباعة الفرق مع آخر تشغيل - الزيادة فوق threshold تُعلّم كتراجع"""
+    before = flatten(previous['results'])
+    regressions = []
+    print(f"\n المقارنة مع {previous.get('commit')} ({previous.get('date')}):")
+    for name, value in flatten(current).items():
+        old = before.get(name)
+        if not old:
+            print(f"   {name:<45} {value:>10}")
+            continue
+        change = (value - old) / old
+        flag = ''
+        if change > threshold:
+            flag = '  <-- تراجع'
+            regressions.append(name)
+        print(f"   {name:<45} {old:>10} -> {value:>10} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس أداء تطبيق السوق السعودي')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=20, help='عدد مرات كل قياس')
+    parser.add_argument('--clients', type=int, default=100, help='عدد عملاء WebSocket')
+    parser.add_argument('--rounds', type=int, default=50, help='عدد التحديثات المبثوثة')
+    parser.add_argument('--batch-window', type=float, default=0.05, help='نافذة تجميع التحديثات في الخادم (ثواني)')
+    parser.add_argument('--output', default=RESULTS_PATH, help='ملف النتائج (JSON lines)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='نسبة الزيادة التي تُعتبر تراجعاً')
+    parser.add_argument('--no-save', action='store_true', help='عدم حفظ النتائج')
+    args = parser.parse_args()
+
+    results = {}
+    if 'broadcast' in args.only:
+        # قبل تحميل التطبيق حتى لا ترث عملية الخادم خيوطه وذاكرته
+        print(f" قياس البث لـ {args.clients} عميل...")
+        results['broadcast'] = bench_broadcast(args.clients, args.rounds, args.batch_window)
+    if {'refresh', 'pages'} & set(args.only):
+        app = load_app()
+        if 'refresh' in args.only:
+            print(" قياس تحديث السوق...")
+            results['refresh'] = bench_refresh(app, args.repeat)
+        if 'pages' in args.only:
+            print(" قياس الصفحات...")
+            results['pages'] = bench_pages(app, args.repeat)
+    if 'throttle' in args.only:
+        print(" قياس التحديث تحت التقييد...")
+        results['throttle'] = bench_throttle(max(3, args.repeat // 4))
+
+    run = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'provider': os.environ['MARKET_DATA'],
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('output', 'no_save')},
+        'results': results,
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    regressions = []
+    previous = previous_run(args.output, run['commit'])
+    if previous is not None:
+        regressions = compare(results, previous, args.threshold)
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run, ensure_ascii=False) + '\n')
+        print(f"\n تم حفظ النتائج في {args.output}")
+    if regressions:
+        print(f" تراجع في {len(regressions)} قياس: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
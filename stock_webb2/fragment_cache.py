@@ -0,0 +1,123 @@
+"""
+كاش الأجزاء المعروضة من القوالب
+الأجزاء الثقيلة (جدول الشركات، بطاقات التوصيات) تُعرض مرة واحدة لكل إصدار من لقطة السوق
+وتُشارك بين جميع المستخدمين، مع نسخ مضغوطة مسبقاً (gzip / brotli) تُرسل كما هي
+"""
+
+import gzip
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=6)}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=5)
+
+
+def accepted_encoding(accept_encoding):
+    """أفضل ضغط متاح يقبله العميل من ترويسة Accept-Encoding (None = بدون ضغط)"""
+    offered = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    for encoding in ('br', 'gzip'):
+        if encoding in offered and encoding in COMPRESSORS:
+            return encoding
+    return None
+
+
+class Fragment:
+    """
+    جزء معروض لإصدار واحد من البيانات مع نسخه المضغوطة
+    """
+
+    __slots__ = ('html', 'version', 'render_seconds', 'encoded')
+
+    def __init__(self, html, version, render_seconds):
+        self.html = html
+        self.version = version
+        self.render_seconds = render_seconds
+        self.encoded = {None: html.encode('utf-8')}
+
+    def body(self, encoding=None):
+        """محتوى الجزء بالضغط المطلوب (يُضغط مرة واحدة فقط)"""
+        data = self.encoded.get(encoding)
+        if data is None:
+            data = self.encoded[encoding] = COMPRESSORS[encoding](self.encoded[None])
+        return data
+
+
+class FragmentCache:
+    """
+    أجزاء معروضة مفهرسة بالاسم والمعاملات، صالحة ما دام إصدار اللقطة لم يتغير
+    """
+
+    def __init__(self, max_entries=64, precompress=('gzip',)):
+        """
+        Args:
+            max_entries: أقصى عدد أجزاء محفوظة (يُحذف الأقدم استخداماً)
+            precompress: أنواع الضغط المحسوبة فور العرض؛ غيرها يُضغط عند أول طلب
+        """
+        self.max_entries = max_entries
+        self.precompress = [e for e in precompress if e in COMPRESSORS]
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.render_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key, version, render):
+        """
+        الجزء المحفوظ للمفتاح إن كان بنفس الإصدار، وإلا يُعرض بـ render() ويُحفظ
+
+        Args:
+            key: اسم الجزء ومعاملاته (قابل للتجزئة)
+            version: إصدار البيانات المعروضة
+            render: دالة بدون معاملات تعيد HTML
+        """
+        with self._lock:
+            fragment = self.entries.get(key)
+            if fragment is not None and fragment.version == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += fragment.render_seconds
+                return fragment
+
+        started = time.perf_counter()
+        fragment = Fragment(str(render()), version, time.perf_counter() - started)
+        for encoding in self.precompress:
+            fragment.body(encoding)
+
+        with self._lock:
+            self.misses += 1
+            self.render_seconds += fragment.render_seconds
+            current = self.entries.get(key)
+            # طلب متزامن قد يكون حفظ إصداراً أحدث
+            if current is None or current.version is None or version is None or current.version <= version:
+                self.entries[key] = fragment
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        """حذف كل الأجزاء المحفوظة (أول طلب بعدها يعرض من جديد)"""
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests * 100, 1) if requests else 0.0,
+                'render_ms': round(self.render_seconds * 1000, 1),
+                'saved_render_ms': round(self.saved_seconds * 1000, 1),
+                'bytes': sum(len(data) for f in self.entries.values() for data in f.encoded.values()),
+                'encodings': list(COMPRESSORS),
+            }
@@ -0,0 +1,443 @@
+"""
+مخزن البيانات التاريخية المحلي (OHLCV)
+تخزين عمودي على القرص: مجلد لكل رمز وملف ثنائي لكل عمود،
+تتم القراءة عبر memory-map بدون نسخ، والإضافة تزايدية للأيام الناقصة فقط
+(الأحدث من آخر يوم مخزن، والأقدم من أول يوم مغطى عند طلب فترة أطول)
+
+كاتب واحد فقط لكل مجلد (عملية التحديث)؛ عمال الخادم يفتحونه للقراءة فقط (readonly=True)
+ويعيدون فتح خرائط الرمز عند تغير ملف التاريخ على القرص
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import market_hours
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history')
+
+# الأعمدة المخزنة: عمود التاريخ يُكتب أخيراً ليكون علامة اكتمال الصف
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+DATE_COLUMN = 'date'
+COVERED = 'covered'  # ملف أقدم يوم تغطيه البيانات المحلية (first_covered)
+DTYPES = {'date': np.int64, 'open': np.float64, 'high': np.float64,
+          'low': np.float64, 'close': np.float64, 'volume': np.float64}
+
+# الفترات بصيغة ياهو/تكرتشارت وعدد أيامها التقريبي
+PERIOD_DAYS = {'1d': 1, '5d': 5, '1mo': 31, '3mo': 92, '6mo': 183,
+               '1y': 366, '2y': 731, '5y': 1827, '10y': 3653}
+
+# الرمز يصبح اسم مجلد: أحرف ياهو/تداول فقط (يأتي من رسائل العملاء عبر get_history)
+SYMBOL_PATTERN = re.compile(r'^[\w^.\-]+$')
+
+
+def period_start(period, today=None):
+    """تحويل صيغة الفترة ('1y', '6mo', 'ytd', 'max') إلى تاريخ البداية"""
+    today = pd.Timestamp(today or datetime.now()).normalize()
+    if period in (None, 'max'):
+        return None
+    if period == 'ytd':
+        return today.replace(month=1, day=1)
+    if period in PERIOD_DAYS:
+        return today - timedelta(days=PERIOD_DAYS[period])
+    raise ValueError(f"فترة غير معروفة: {period}")
+
+
+def period_for_gap(days):
+    """أصغر فترة تغطي عدد الأيام الناقصة"""
+    for period, length in sorted(PERIOD_DAYS.items(), key=lambda item: item[1]):
+        if length >= days:
+            return period
+    return 'max'
+
+
+def _to_days(index):
+    """تحويل فهرس زمني (مع أو بدون منطقة زمنية) إلى أيام منذ 1970"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().values.astype('datetime64[D]').astype(np.int64)
+
+
+class HistoryStore:
+    """
+    مستودع OHLCV يومي بتقسيم لكل رمز
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, sync_interval=900, readonly=False):
+        """
+        Args:
+            root: مجلد التخزين
+            sync_interval: أقل مدة (بالثواني) بين محاولتي مزامنة لنفس الرمز
+            readonly: قراءة فقط (عمال الخادم) - الجلب والمزامنة تتجاهل، والإضافة ترفع خطأ
+        """
+        self.root = root
+        self.sync_interval = sync_interval
+        self.readonly = readonly
+        self._maps = {}       # الرمز -> (هوية ملف التاريخ، أعمدة memmap)
+        self._last_sync = {}  # الرمز -> وقت آخر مزامنة
+        self._last_backfill = {}  # الرمز -> وقت آخر استكمال للأيام الأقدم
+        self._lock = threading.RLock()
+        if not readonly:
+            os.makedirs(self.root, exist_ok=True)
+
+    # ---------- التخزين ----------
+    def _path(self, symbol, column):
+        if not isinstance(symbol, str) or not SYMBOL_PATTERN.match(symbol) or not symbol.strip('.'):
+            raise ValueError(f"رمز غير صالح: {symbol!r}")
+        return os.path.join(self.root, symbol, f"{column}.bin")
+
+    def _rows(self, symbol):
+        path = self._path(symbol, DATE_COLUMN)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // np.dtype(DTYPES[DATE_COLUMN]).itemsize
+
+    def _identity(self, symbol):
+        """هوية ملف التاريخ - تتغير مع كل إضافة أو استبدال (ولو من عملية أخرى)"""
+        try:
+            stat = os.stat(self._path(symbol, DATE_COLUMN))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _columns(self, symbol):
+        """خرائط الذاكرة لأعمدة الرمز (تُنشأ مرة واحدة حتى يتغير ملف التاريخ)"""
+        with self._lock:
+            identity = self._identity(symbol)
+            cached = self._maps.get(symbol)
+            if cached is not None and cached[0] == identity:
+                return cached[1]
+
+            rows = self._rows(symbol)
+            if rows == 0:
+                maps = {c: np.empty(0, dtype=DTYPES[c]) for c in (DATE_COLUMN,) + COLUMNS}
+            else:
+                maps = {c: np.memmap(self._path(symbol, c), dtype=DTYPES[c], mode='r', shape=(rows,))
+                        for c in (DATE_COLUMN,) + COLUMNS}
+            self._maps[symbol] = (identity, maps)
+            return maps
+
+    def _check_writable(self):
+        if self.readonly:
+            raise PermissionError("المخزن التاريخي مفتوح للقراءة فقط - الكتابة من عملية التحديث وحدها")
+
+    def symbols(self):
+        """الرموز المخزنة محلياً"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(s for s in os.listdir(self.root)
+                      if SYMBOL_PATTERN.match(s) and s.strip('.') and self._rows(s) > 0)
+
+    def last_date(self, symbol):
+        """آخر تاريخ مخزن للرمز (None إذا لم يوجد)"""
+        dates = self._columns(symbol)[DATE_COLUMN]
+        if len(dates) == 0:
+            return None
+        return pd.Timestamp(np.datetime64(int(dates[-1]), 'D'))
+
+    def first_covered(self, symbol):
+        """
+        أقدم يوم تغطيه البيانات المحلية للرمز (None إذا لم توجد)
+
+        قد يسبق أول صف مخزن: بداية الفترة المطلوبة عند الجلب وإن لم يكن للرمز تداول فيها
+        """
+        dates = self._columns(symbol)[DATE_COLUMN]
+        if len(dates) == 0:
+            return None
+        first = int(dates[0])
+        try:
+            first = min(first, int(np.fromfile(self._path(symbol, COVERED), dtype=np.int64, count=1)[0]))
+        except (OSError, IndexError):
+            pass
+        return pd.Timestamp(np.datetime64(first, 'D'))
+
+    def _cover(self, symbol, start):
+        """تسجيل أن البيانات المحلية تغطي كل الأيام منذ start (None = كامل التاريخ)"""
+        self._check_writable()
+        day = 0 if start is None else int(_to_days([start])[0])
+        current = self.first_covered(symbol)
+        if current is not None and int(_to_days([current])[0]) <= day:
+            return
+        path = self._path(symbol, COVERED)
+        np.array([day], dtype=np.int64).tofile(f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+    def _written_at(self, symbol):
+        """وقت آخر كتابة لصفوف الرمز (ثوانٍ منذ 1970)"""
+        try:
+            return os.path.getmtime(self._path(symbol, DATE_COLUMN))
+        except OSError:
+            return 0
+
+    def _prepare(self, frame):
+        """أيام الإطار مرتبة مع ترتيبها وقناع آخر صف لكل يوم"""
+        frame = frame.rename(columns=str.lower)
+        days = _to_days(frame.index)
+        order = np.argsort(days, kind='stable')
+        days = days[order]
+        keep = np.r_[days[1:] != days[:-1], True]  # آخر صف لكل يوم
+        return frame, days, order, keep
+
+    @staticmethod
+    def _values(frame, column, order, keep):
+        if column not in frame.columns:
+            return np.full(int(keep.sum()), np.nan)
+        return np.ascontiguousarray(frame[column].to_numpy(dtype=DTYPES[column])[order][keep])
+
+    def append(self, symbol, frame):
+        """
+        إضافة الصفوف الأحدث من آخر تاريخ مخزن فقط
+
+        صف آخر يوم مخزن يُستبدل إذا ورد مجدداً: قد يكون شمعة جلسة جارية جُلبت أثناء التداول
+
+        Args:
+            frame: DataFrame بفهرس زمني وأعمدة Open/High/Low/Close/Volume
+
+        Returns:
+            عدد الصفوف المضافة أو المستبدلة
+        """
+        self._check_writable()
+        if frame is None or frame.empty:
+            return 0
+
+        frame, days, order, keep = self._prepare(frame)
+
+        with self._lock:
+            rows = self._rows(symbol)
+            dates = self._columns(symbol)[DATE_COLUMN]
+            if rows:
+                keep &= days >= dates[-1]
+            if not keep.any():
+                return 0
+
+            # تحرير الخرائط قبل الكتابة (مطلوب على ويندوز)
+            replace = rows and days[keep][0] == dates[-1]
+            self._maps.pop(symbol, None)
+            del dates
+            os.makedirs(os.path.dirname(self._path(symbol, DATE_COLUMN)), exist_ok=True)
+
+            if replace:
+                # حذف الصف الأخير من عمود التاريخ أولاً: انقطاع الكتابة يترك يوماً ناقصاً يُعاد جلبه
+                rows -= 1
+                with open(self._path(symbol, DATE_COLUMN), 'ab') as f:
+                    f.truncate(rows * np.dtype(DTYPES[DATE_COLUMN]).itemsize)
+
+            for column in COLUMNS:
+                path = self._path(symbol, column)
+                with open(path, 'ab') as f:
+                    # قص أي بقايا كتابة سابقة غير مكتملة
+                    f.truncate(rows * np.dtype(DTYPES[column]).itemsize)
+                    f.write(self._values(frame, column, order, keep).tobytes())
+
+            with open(self._path(symbol, DATE_COLUMN), 'ab') as f:
+                f.truncate(rows * np.dtype(DTYPES[DATE_COLUMN]).itemsize)
+                f.write(days[keep].astype(DTYPES[DATE_COLUMN]).tobytes())
+
+            return int(keep.sum())
+
+    def prepend(self, symbol, frame):
+        """
+        إضافة الصفوف الأقدم من أول تاريخ مخزن (استكمال فترة أطول مما جُلب سابقاً)
+
+        الملفات تُعاد كتابتها كاملة، لذا يُفرَّغ عمود التاريخ أولاً:
+        انقطاع الكتابة يترك الرمز فارغاً فيُعاد جلبه بدلاً من أعمدة غير متطابقة
+
+        Returns:
+            عدد الصفوف المضافة
+        """
+        self._check_writable()
+        if frame is None or frame.empty:
+            return 0
+
+        frame, days, order, keep = self._prepare(frame)
+
+        with self._lock:
+            maps = self._columns(symbol)
+            if len(maps[DATE_COLUMN]) == 0:
+                return self.append(symbol, frame.iloc[order[keep]])
+            keep &= days < maps[DATE_COLUMN][0]
+            if not keep.any():
+                return 0
+
+            existing = {c: np.array(maps[c]) for c in (DATE_COLUMN,) + COLUMNS}
+            self._maps.pop(symbol, None)
+            del maps
+
+            with open(self._path(symbol, DATE_COLUMN), 'r+b') as f:
+                f.truncate(0)
+            for column in COLUMNS + (DATE_COLUMN,):
+                values = days[keep].astype(DTYPES[column]) if column == DATE_COLUMN \
+                    else self._values(frame, column, order, keep)
+                path = self._path(symbol, column)
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(values.tobytes())
+                    f.write(existing[column].tobytes())
+                os.replace(f'{path}.tmp', path)
+
+            return int(keep.sum())
+
+    # ---------- القراءة ----------
+    def read_arrays(self, symbol, start=None, end=None):
+        """
+        قراءة نطاق زمني كمصفوفات بدون نسخ (شرائح من memmap)
+
+        Returns:
+            قاموس {date, open, high, low, close, volume}؛ التاريخ بصيغة datetime64[D]
+        """
+        maps = self._columns(symbol)
+        dates = maps[DATE_COLUMN]
+        lo = 0 if start is None else int(np.searchsorted(dates, _to_days([start])[0], side='left'))
+        hi = len(dates) if end is None else int(np.searchsorted(dates, _to_days([end])[0], side='right'))
+
+        arrays = {c: maps[c][lo:hi] for c in COLUMNS}
+        arrays[DATE_COLUMN] = dates[lo:hi].view('datetime64[D]')
+        return arrays
+
+    def read(self, symbol, start=None, end=None):
+        """قراءة نطاق زمني كـ DataFrame بنفس أعمدة ياهو"""
+        arrays = self.read_arrays(symbol, start, end)
+        return pd.DataFrame({c.capitalize(): arrays[c] for c in COLUMNS},
+                            index=pd.DatetimeIndex(arrays[DATE_COLUMN], name='Date'))
+
+    def read_matrix(self, symbols, start=None, end=None, columns=COLUMNS):
+        """
+        قراءة عدة رموز كمصفوفات ثنائية الأبعاد (رموز × أيام) على محور تواريخ موحد
+
+        Returns:
+            (التواريخ، قاموس {العمود: مصفوفة float64})؛ الأيام الناقصة تكون NaN
+        """
+        parts = [self.read_arrays(s, start, end) for s in symbols]
+        dates = np.unique(np.concatenate([p[DATE_COLUMN] for p in parts])) if parts \
+            else np.empty(0, dtype='datetime64[D]')
+        matrix = {c: np.full((len(symbols), len(dates)), np.nan) for c in columns}
+        for row, part in enumerate(parts):
+            if len(part[DATE_COLUMN]) == 0:
+                continue
+            positions = np.searchsorted(dates, part[DATE_COLUMN])
+            for c in columns:
+                matrix[c][row, positions] = part[c]
+        return dates, matrix
+
+    # ---------- المزامنة ----------
+    def outdated(self, symbol, now=None):
+        """هل ينقص الرمز آخر جلسة تداول، أو صفها مؤقت جُلب قبل اعتماده نهائياً؟"""
+        last = self.last_date(symbol)
+        if last is None:
+            return True
+        session = market_hours.last_session(now)
+        if last < session:
+            return True
+        return last == session and self._written_at(symbol) < market_hours.settled_at(session)
+
+    def needs_sync(self, symbol, now=None):
+        """هل ينقص الرمز أيام تداول ولم تتم مزامنته مؤخراً؟"""
+        if time.time() - self._last_sync.get(symbol, 0) < self.sync_interval:
+            return False
+        return self.outdated(symbol, now)
+
+    def needs_backfill(self, symbol, start):
+        """هل تبدأ الفترة المطلوبة قبل أقدم يوم مغطى محلياً؟ (start=None: كامل التاريخ)"""
+        if time.time() - self._last_backfill.get(symbol, 0) < self.sync_interval:
+            return False
+        covered = self.first_covered(symbol)
+        if covered is None:
+            return False
+        return covered > (pd.Timestamp(0) if start is None else start)
+
+    def sync(self, symbol, fetch, period='1y'):
+        """
+        مزامنة تزايدية لرمز واحد
+
+        Args:
+            fetch: دالة fetch(symbol, period) تُرجع DataFrame من المصدر
+            period: الفترة المطلوبة عند عدم وجود بيانات محلية
+        """
+        last = self.last_date(symbol)
+        if last is not None:
+            period = period_for_gap((pd.Timestamp(datetime.now()).normalize() - last).days + 1)
+        self._last_sync[symbol] = time.time()
+        try:
+            added = self.append(symbol, fetch(symbol, period))
+        except Exception as e:
+            print(f" خطأ في مزامنة تاريخ {symbol}: {e}")
+            return 0
+        if last is None and added:
+            self._cover(symbol, period_start(period))
+        return added
+
+    def backfill(self, symbol, fetch, start):
+        """
+        جلب الأيام الأقدم من أول يوم مغطى حتى start
+
+        المصدر يقبل فترة فقط (وليس نطاقاً)، فتُجلب الفترة من start حتى اليوم
+        ويُضاف منها ما يسبق البيانات المخزنة فقط
+        """
+        today = pd.Timestamp(datetime.now()).normalize()
+        period = 'max' if start is None else period_for_gap((today - start).days)
+        self._last_backfill[symbol] = time.time()
+        try:
+            added = self.prepend(symbol, fetch(symbol, period))
+        except Exception as e:
+            print(f" خطأ في استكمال تاريخ {symbol}: {e}")
+            return 0
+        self._cover(symbol, start)
+        return added
+
+    def sync_many(self, symbols, downloader, period='1y'):
+        """
+        مزامنة عدة رموز بطلبات مجمّعة (BatchDownloader)
+
+        الرموز الجديدة تُجلب بالفترة الكاملة، والموجودة من أقدم آخر يوم مخزن فقط (يُستبدل صفه)
+        """
+        self._check_writable()
+        fresh, stale = [], {}
+        for symbol in symbols:
+            last = self.last_date(symbol)
+            if last is None:
+                fresh.append(symbol)
+            elif self.outdated(symbol):
+                stale[symbol] = last
+
+        added = 0
+        requests = []
+        if fresh:
+            requests.append((fresh, {'period': period}))
+        if stale:
+            # من آخر يوم مخزن نفسه: يُستبدل صفه إن كان شمعة جلسة غير مكتملة
+            start = min(stale.values())
+            requests.append((list(stale), {'period': None, 'start': start.strftime('%Y-%m-%d')}))
+
+        for batch, kwargs in requests:
+            wide = downloader.download(batch, **kwargs)
+            if wide.empty:
+                continue
+            for symbol in batch:
+                if symbol not in wide.columns.get_level_values(1):
+                    continue
+                frame = wide.xs(symbol, axis=1, level=1).dropna(subset=['Close'])
+                count = self.append(symbol, frame)
+                if count and symbol in fresh:
+                    self._cover(symbol, period_start(period))
+                added += count
+                self._last_sync[symbol] = time.time()
+        return added
+
+    def get(self, symbol, period='1y', fetch=None):
+        """
+        قراءة فترة من المخزن مع مزامنة الأيام الناقصة فقط عند الحاجة:
+        الأحدث من آخر يوم مخزن، والأقدم من أول يوم مغطى إذا طُلبت فترة أطول
+
+        Args:
+            fetch: دالة الجلب من المصدر؛ بدونها (أو في وضع القراءة فقط) تتم القراءة المحلية فقط
+        """
+        start = period_start(period)
+        if fetch is not None and not self.readonly:
+            if self.needs_sync(symbol):
+                self.sync(symbol, fetch, period)
+            if self.needs_backfill(symbol, start):
+                self.backfill(symbol, fetch, start)
+        return self.read(symbol, start=start)
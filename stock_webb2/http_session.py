@@ -0,0 +1,221 @@
+"""
+جلسة HTTP مشتركة لكل طلبات ياهو (yfinance)
+بدلاً من أن ينشئ كل yf.Ticker / yf.download اتصالاته الخاصة، تُستخدم جلسة واحدة آمنة للخيوط:
+- curl_cffi إن وُجدت (ما تتطلبه ياهو حالياً): مقبض curl لكل خيط يحتفظ باتصالاته مفتوحة (keep-alive)
+- وإلا requests مع HTTPAdapter بحجم مجمع اتصالات يساوي عدد خيوط الجلب
+- فك ضغط الاستجابات (gzip/deflate/br) تلقائياً
+- عدّ الاتصالات الجديدة (مصافحات TCP/TLS) والبايتات المنقولة لكل تحديث
+
+وكاش محلي اختياري لاستعلامات الشموع (HTTP_CACHE_TTL بالثواني، 0 = معطل) - على مستوى المزود
+لأن yfinance ترفض الجلسات ذات الكاش
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import pandas as pd
+import metrics
+
+POOL_SIZE = 8
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'http_cache')
+
+
+class SessionStats:
+    """عدادات الجلسة: الطلبات والاتصالات الجديدة والبايتات"""
+
+    FIELDS = ('requests', 'handshakes', 'bytes_received', 'bytes_sent')
+
+    def __init__(self):
+        self.values = dict.fromkeys(self.FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, received, sent, handshakes=0):
+        """طلب مكتمل (handshakes: الاتصالات الجديدة التي فتحها الطلب إن كانت معروفة)"""
+        with self._lock:
+            self.values['requests'] += 1
+            self.values['handshakes'] += handshakes
+            self.values['bytes_received'] += received
+            self.values['bytes_sent'] += sent
+
+    def handshake(self):
+        with self._lock:
+            self.values['handshakes'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+    def since(self, before):
+        """الفرق منذ snapshot سابقة (للتقرير عن تحديث واحد)"""
+        now = self.snapshot()
+        return {name: now[name] - before.get(name, 0) for name in self.FIELDS}
+
+
+stats = SessionStats()
+
+
+# ---------- curl_cffi ----------
+def _curl_session(pool_size):
+    from curl_cffi import CurlInfo, CurlOpt
+    from curl_cffi.requests import Session
+
+    class CountingSession(Session):
+        """جلسة curl_cffi تسجل الاتصالات الجديدة والبايتات لكل طلب"""
+
+        def request(self, *args, **kwargs):
+            response = super().request(*args, **kwargs)
+            stats.record(response.response_size, response.request_size + response.upload_size,
+                         handshakes=response.infos.get(CurlInfo.NUM_CONNECTS, 0))
+            return response
+
+    # impersonate: بصمة متصفح كما تفعل yfinance في جلستها الافتراضية؛ MAXCONNECTS لكل خيط
+    return CountingSession(impersonate='chrome', curl_infos=[CurlInfo.NUM_CONNECTS],
+                           curl_options={CurlOpt.MAXCONNECTS: pool_size})
+
+
+# ---------- requests ----------
+def _requests_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class CountingHTTPConnection(HTTPConnection):
+        def connect(self):
+            super().connect()
+            stats.handshake()
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            super().connect()
+            stats.handshake()
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    class CountingAdapter(HTTPAdapter):
+        """مجمع اتصالات بحجم ثابت يعد الاتصالات الجديدة والبايتات المستلمة (قبل فك الضغط)"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                                       'https': CountingHTTPSConnectionPool}
+
+        def send(self, request, stream=False, **kwargs):
+            response = super().send(request, stream=stream, **kwargs)
+            received = 0
+            if not stream:
+                content = response.content
+                received = response.raw.tell() or len(content)
+            sent = len(request.body or b'') if isinstance(request.body, (bytes, str)) else 0
+            stats.record(received, sent)
+            return response
+
+    session = requests.Session()
+    adapter = CountingAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    encodings = 'gzip, deflate'
+    try:
+        import brotli  # noqa: F401 - يفك urllib3 ضغط br عند وجودها
+        encodings += ', br'
+    except ImportError:
+        pass
+    session.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+        'Accept-Encoding': encodings,
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(pool_size):
+    """حجم مجمع الاتصالات (عدد خيوط الجلب) - قبل أول طلب"""
+    global POOL_SIZE
+    POOL_SIZE = max(1, int(pool_size))
+
+
+def shared():
+    """الجلسة المشتركة (تُنشأ عند أول استخدام)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            try:
+                _session = _curl_session(POOL_SIZE)
+                backend = 'curl_cffi'
+            except ImportError:
+                _session = _requests_session(POOL_SIZE)
+                backend = 'requests'
+            print(f" جلسة HTTP مشتركة ({backend}) بمجمع {POOL_SIZE} اتصال")
+        return _session
+
+
+def describe(delta):
+    """نص مختصر لعدادات تحديث واحد"""
+    return (f"{delta['requests']} طلب HTTP، {delta['handshakes']} اتصال جديد، "
+            f"{delta['bytes_received'] / 1024:.0f}KB مستلمة")
+
+
+def collect_metrics():
+    values = stats.snapshot()
+    return [
+        ('http_requests_total', 'counter', 'طلبات HTTP إلى ياهو', [({}, values['requests'])]),
+        ('http_handshakes_total', 'counter', 'الاتصالات الجديدة (مصافحات TCP/TLS)', [({}, values['handshakes'])]),
+        ('http_received_bytes_total', 'counter', 'البايتات المستلمة (قبل فك الضغط)', [({}, values['bytes_received'])]),
+        ('http_sent_bytes_total', 'counter', 'البايتات المرسلة', [({}, values['bytes_sent'])]),
+        ('http_cache_hits_total', 'counter', 'استعلامات شموع قُدمت من الكاش المحلي',
+         [({}, cache.hits if cache else 0)]),
+    ]
+
+
+metrics.register(collect_metrics)
+
+
+# ---------- كاش الاستعلامات ----------
+class ResponseCache:
+    """
+    نتائج استعلامات الشموع على القرص لمدة ttl ثانية (ملف pickle لكل استعلام)
+    """
+
+    def __init__(self, ttl, directory=CACHE_DIR):
+        self.ttl = ttl
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) <= self.ttl:
+                value = pd.read_pickle(path)
+                self.hits += 1
+                return value
+        except (OSError, EOFError, ValueError):
+            pass
+        self.misses += 1
+        return None
+
+    def put(self, key, frame):
+        if not isinstance(frame, pd.DataFrame) or frame.empty:
+            return
+        path = self._path(key)
+        temp = f'{path}.{threading.get_ident()}.tmp'
+        frame.to_pickle(temp)
+        os.replace(temp, path)
+
+
+cache_ttl = float(os.environ.get('HTTP_CACHE_TTL', 0))
+cache = ResponseCache(cache_ttl) if cache_ttl > 0 else None
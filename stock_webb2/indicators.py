@@ -0,0 +1,300 @@
+"""
+محرك المؤشرات الفنية المتجه
+يحسب المؤشرات لجميع الرموز دفعة واحدة على مصفوفة (رموز × شموع)،
+ويحدّثها تزايدياً عند وصول شمعة جديدة بدون إعادة حساب النافذة كاملة
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# نوافذ المؤشرات
+EMA_PERIODS = (9, 12, 21, 26)
+MACD_SIGNAL = 9
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+BOLLINGER_WIDTH = 2
+SMA_PERIODS = (20, 50)
+VOLUME_PERIOD = 20
+WINDOW = max(SMA_PERIODS)
+
+STATE_FIELDS = ('count', 'last_date', 'prev_close', 'avg_gain', 'avg_loss', 'atr',
+                'macd_signal', 'close_ring', 'volume_ring', 'close_sum_20', 'close_sum_50',
+                'close_sq_20', 'volume_sum', 'volume_sq', 'last_volume') + \
+               tuple(f'ema_{p}' for p in EMA_PERIODS)
+
+
+class IndicatorEngine:
+    """
+    حالة المؤشرات لكل الرموز كمصفوفات متوازية (عنصر لكل رمز)
+    """
+
+    def __init__(self, symbols, unit='D', label='يومي'):
+        """
+        Args:
+            unit: دقة مفتاح الشمعة ('D' يومي، 's' للشموع اللحظية)؛ شمعتان بنفس المفتاح تعتبران نفس الشمعة
+            label: اسم الإطار الزمني في نتيجة التحليل
+        """
+        self.symbols = list(symbols)
+        self.unit = unit
+        self.label = label
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.loaded = False
+        self.reset()
+
+    def reset(self):
+        """تصفير الحالة"""
+        n = len(self.symbols)
+        state = {f: np.zeros(n) for f in STATE_FIELDS}
+        state['count'] = np.zeros(n, dtype=np.int64)
+        state['last_date'] = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+        state['close_ring'] = np.zeros((n, WINDOW))
+        state['volume_ring'] = np.zeros((n, VOLUME_PERIOD))
+        self.state = state
+        self.prev_state = {k: v.copy() for k, v in state.items()}
+        self.last_bar = {k: np.full(n, np.nan) for k in ('open', 'high', 'low', 'close', 'volume')}
+
+    # ---------- الحساب ----------
+    def _step(self, state, apply, high, low, close, volume):
+        """
+        تطبيق شمعة واحدة على جميع الرموز المحددة في apply (عمليات متجهة فقط)
+        """
+        rows = np.arange(len(self.symbols))
+        count = state['count']
+        first = count == 0
+        prev_close = np.where(first, close, state['prev_close'])
+        n = count + 1  # عدد الشموع بعد هذه الشمعة
+
+        new = {}
+        # المتوسطات المتحركة الأسية
+        for p in EMA_PERIODS:
+            alpha = 2.0 / (p + 1)
+            old = state[f'ema_{p}']
+            new[f'ema_{p}'] = np.where(first, close, old + alpha * (close - old))
+        macd = new['ema_12'] - new['ema_26']
+        alpha = 2.0 / (MACD_SIGNAL + 1)
+        new['macd_signal'] = np.where(first, macd, state['macd_signal'] + alpha * (macd - state['macd_signal']))
+
+        # RSI و ATR بتنعيم وايلدر (متوسط بسيط خلال فترة الإحماء)
+        delta = close - prev_close
+        gain, loss = np.maximum(delta, 0), np.maximum(-delta, 0)
+        true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+        for key, value, period in (('avg_gain', gain, RSI_PERIOD), ('avg_loss', loss, RSI_PERIOD),
+                                   ('atr', true_range, ATR_PERIOD)):
+            weight = np.minimum(n, period)
+            new[key] = state[key] + (value - state[key]) / weight
+
+        # النوافذ المتحركة عبر حلقات دائرية ومجاميع جارية
+        ring = state['close_ring'].copy()
+        pos = count % WINDOW
+        out_20 = np.where(n > 20, ring[rows, (count - 20) % WINDOW], 0.0)
+        out_50 = np.where(n > 50, ring[rows, pos], 0.0)
+        ring[rows, pos] = np.where(apply, close, ring[rows, pos])
+        new['close_ring'] = ring
+        new['close_sum_20'] = state['close_sum_20'] + close - out_20
+        new['close_sum_50'] = state['close_sum_50'] + close - out_50
+        new['close_sq_20'] = state['close_sq_20'] + close ** 2 - out_20 ** 2
+
+        vring = state['volume_ring'].copy()
+        vpos = count % VOLUME_PERIOD
+        vout = np.where(n > VOLUME_PERIOD, vring[rows, vpos], 0.0)
+        vring[rows, vpos] = np.where(apply, volume, vring[rows, vpos])
+        new['volume_ring'] = vring
+        new['volume_sum'] = state['volume_sum'] + volume - vout
+        new['volume_sq'] = state['volume_sq'] + volume ** 2 - vout ** 2
+
+        new['prev_close'] = close
+        new['last_volume'] = volume
+        new['count'] = n
+
+        for key, value in new.items():
+            mask = apply if value.ndim == 1 else apply[:, None]
+            state[key] = np.where(mask, value, state[key])
+
+    def update(self, date, open_, high, low, close, volume):
+        """
+        تطبيق شمعة جديدة لجميع الرموز (مصفوفات بطول عدد الرموز، NaN = لا توجد شمعة)
+
+        إذا كان تاريخ الشمعة مساوياً لآخر شمعة للرمز (شمعة اليوم لم تكتمل)
+        يتم التراجع عنها وإعادة تطبيقها بدلاً من إضافتها مرة ثانية
+        """
+        day = np.datetime64(pd.Timestamp(date).tz_localize(None).to_datetime64(), self.unit).astype(np.int64)
+        close = np.asarray(close, dtype=float)
+        valid = ~np.isnan(close)
+        state = self.state
+
+        revise = valid & (state['last_date'] == day)
+        apply = valid & (state['last_date'] <= day)
+        if not apply.any():
+            return
+
+        # التراجع عن الشمعة السابقة لنفس اليوم
+        for key in STATE_FIELDS:
+            mask = revise if state[key].ndim == 1 else revise[:, None]
+            state[key] = np.where(mask, self.prev_state[key], state[key])
+            mask = apply if state[key].ndim == 1 else apply[:, None]
+            self.prev_state[key] = np.where(mask, state[key], self.prev_state[key])
+
+        high = np.asarray(high, dtype=float)
+        low = np.asarray(low, dtype=float)
+        high = np.where(np.isnan(high), close, high)
+        low = np.where(np.isnan(low), close, low)
+        volume = np.nan_to_num(np.asarray(volume, dtype=float))
+        self._step(state, apply, high, low, np.nan_to_num(close), volume)
+        state['last_date'] = np.where(apply, day, state['last_date'])
+
+        for key, values in (('open', open_), ('high', high), ('low', low), ('close', close), ('volume', volume)):
+            self.last_bar[key] = np.where(apply, np.asarray(values, dtype=float), self.last_bar[key])
+
+    def load(self, dates, matrix):
+        """
+        حساب كامل من مصفوفات تاريخية (رموز × أيام) في مرور واحد على الشموع
+
+        Args:
+            dates: مصفوفة التواريخ
+            matrix: قاموس {open, high, low, close, volume} بمصفوفات ثنائية الأبعاد
+        """
+        self.reset()
+        for t, date in enumerate(dates):
+            self.update(date, *(matrix[k][:, t] for k in ('open', 'high', 'low', 'close', 'volume')))
+        self.loaded = True
+
+    def update_frame(self, bars):
+        """
+        تطبيق شموع من DataFrame مفهرس بالرمز (date, open, high, low, last, volume)
+        """
+        if bars is None or len(bars) == 0:
+            return
+        bars = bars[bars.index.isin(self.symbols)]
+        for date, group in bars.groupby('date'):
+            arrays = {k: np.full(len(self.symbols), np.nan) for k in ('open', 'high', 'low', 'last', 'volume')}
+            positions = [self.index[s] for s in group.index]
+            for k in arrays:
+                arrays[k][positions] = group[k].to_numpy(dtype=float)
+            self.update(date, arrays['open'], arrays['high'], arrays['low'], arrays['last'], arrays['volume'])
+
+    # ---------- القراءة ----------
+    def volume_means(self):
+        """متوسط حجم التداول لآخر 20 شمعة لكل الرموز (NaN للرمز بدون بيانات)"""
+        volumes = np.minimum(self.state['count'], VOLUME_PERIOD)
+        return np.where(volumes > 0, self.state['volume_sum'] / np.maximum(volumes, 1), np.nan)
+
+    def values(self, symbol):
+        """قيم المؤشرات الحالية لرمز واحد (None إذا لم تتوفر بيانات)"""
+        i = self.index.get(symbol)
+        if i is None or self.state['count'][i] == 0:
+            return None
+        s = {k: v[i] for k, v in self.state.items()}
+        n = s['count']
+
+        sma_20 = s['close_sum_20'] / min(n, 20)
+        sma_50 = s['close_sum_50'] / min(n, 50)
+        variance = max(s['close_sq_20'] / min(n, 20) - sma_20 ** 2, 0.0)
+        std_20 = variance ** 0.5
+        rsi = 100.0 if s['avg_loss'] == 0 else 100 - 100 / (1 + s['avg_gain'] / s['avg_loss'])
+        macd = s['ema_12'] - s['ema_26']
+
+        volumes = min(n, VOLUME_PERIOD)
+        volume_mean = s['volume_sum'] / volumes
+        volume_std = max(s['volume_sq'] / volumes - volume_mean ** 2, 0.0) ** 0.5
+
+        result = {
+            'close': s['prev_close'],
+            'sma_20': sma_20,
+            'sma_50': sma_50,
+            'ema_9': s['ema_9'],
+            'ema_21': s['ema_21'],
+            'rsi': rsi,
+            'macd': macd,
+            'macd_signal': s['macd_signal'],
+            'macd_histogram': macd - s['macd_signal'],
+            'bollinger_upper': sma_20 + BOLLINGER_WIDTH * std_20,
+            'bollinger_lower': sma_20 - BOLLINGER_WIDTH * std_20,
+            'atr': s['atr'],
+            'current_volume': s['last_volume'],
+            'volume_mean': volume_mean,
+            'volume_zscore': (s['last_volume'] - volume_mean) / volume_std if volume_std else 0.0,
+        }
+        result = {k: float(v) for k, v in result.items()}
+        result['bars'] = int(n)
+        return result
+
+    def analyze(self, symbol, price=None):
+        """
+        توليد التوصية ومستويات الدخول والخروج وأسبابها لصفحة التحليل
+        """
+        v = self.values(symbol)
+        if v is None:
+            return None
+        price = float(price if price is not None else v['close'])
+
+        score, reasons = 0, []
+        if v['rsi'] < 30:
+            score += 2
+            reasons.append(f"مؤشر RSI عند {v['rsi']:.1f} - منطقة تشبع بيعي")
+        elif v['rsi'] > 70:
+            score -= 2
+            reasons.append(f"مؤشر RSI عند {v['rsi']:.1f} - منطقة تشبع شرائي")
+
+        if price > v['ema_9'] > v['ema_21']:
+            score += 1
+            reasons.append("السعر فوق المتوسطات الأسية 9 و 21 - اتجاه صاعد")
+        elif price < v['ema_9'] < v['ema_21']:
+            score -= 1
+            reasons.append("السعر تحت المتوسطات الأسية 9 و 21 - اتجاه هابط")
+
+        if v['macd'] > v['macd_signal']:
+            score += 1
+            reasons.append("تقاطع إيجابي لمؤشر MACD مع خط الإشارة")
+        else:
+            score -= 1
+            reasons.append("مؤشر MACD تحت خط الإشارة")
+
+        if price < v['bollinger_lower']:
+            score += 1
+            reasons.append("السعر تحت الحد السفلي لنطاق بولينجر - ارتداد محتمل")
+        elif price > v['bollinger_upper']:
+            score -= 1
+            reasons.append("السعر فوق الحد العلوي لنطاق بولينجر - تشبع محتمل")
+
+        if v['volume_zscore'] > 2:
+            score = int(round(score * 1.5))
+            reasons.append("حجم تداول غير اعتيادي يدعم الحركة الحالية")
+
+        if score >= 2:
+            recommendation = 'BUY'
+        elif score <= -2:
+            recommendation = 'SELL'
+        else:
+            recommendation = 'HOLD'
+
+        atr = v['atr'] or price * 0.02
+        volume_ratio = v['current_volume'] / v['volume_mean'] * 100 if v['volume_mean'] else 100
+        now = datetime.now()
+        return {
+            'symbol': symbol,
+            'recommendation': recommendation,
+            'confidence': min(95, 50 + abs(score) * 10),
+            'current_price': round(price, 2),
+            'stop_loss': round(price - 2 * atr, 2),
+            'take_profit': round(price + 3 * atr, 2),
+            'reasons': reasons,
+            'timeframe': self.label,
+            'last_update': now.strftime('%H:%M:%S'),
+            'analysis_time': now.strftime('%Y-%m-%d %H:%M'),
+            'technical_indicators': {
+                'rsi': round(v['rsi'], 1),
+                'ema_9': round(v['ema_9'], 2),
+                'ema_21': round(v['ema_21'], 2),
+                'sma_20': round(v['sma_20'], 2),
+                'sma_50': round(v['sma_50'], 2),
+                'macd': v['macd'],
+                'macd_signal': v['macd_signal'],
+                'bollinger_upper': round(v['bollinger_upper'], 2),
+                'bollinger_lower': round(v['bollinger_lower'], 2),
+                'atr': round(atr, 2),
+                'current_volume': int(v['current_volume']),
+                'volume_ratio': int(round(volume_ratio)),
+                'volume_zscore': round(v['volume_zscore'], 2),
+            }
+        }
@@ -0,0 +1,333 @@
+"""
+اختبار تحمل خادم البث (TadawulLiveStream) محلياً بدون شبكة
+
+يشغّل الخادم في عملية منفصلة على المولد التركيبي، وآلاف العملاء (asyncio) في عمليات أخرى،
+كل عميل يشترك في مزيج واقعي من الرموز (الشركات الكبيرة أكثر طلباً)، ثم يرفع عدد العملاء
+ومعدل التحديث تدريجياً ويقيس لكل مرحلة:
+زمن وصول التحديث من لحظة الاستطلاع حتى العميل (p50/p95/p99)، التحديثات المفقودة
+(المدمجة أو لعملاء مفصولين) والمتأخرة، ونسبة المعالج والذاكرة لعملية الخادم
+
+    python load_test.py
+    python load_test.py --clients 500 1000 2000 4000 --rates 0.5 1 2 --duration 10
+    python load_test.py --output data/load_test.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmark import free_port, rss_bytes, summarize, git_commit
+
+TIMESTAMP = re.compile(r'"timestamp":"(\d\d):(\d\d):(\d\d\.\d+)"')
+
+
+def raise_file_limit():
+    """آلاف الاتصالات تحتاج حداً أعلى للملفات المفتوحة"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+def seconds_of_day():
+    now = datetime.now()
+    return now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6
+
+
+# ---------- عملية الخادم ----------
+def run_server(conn, port, symbols, interval):
+    """
+    TadawulLiveStream.start_server على مزود تركيبي، مع أوامر من العملية الرئيسية:
+    ('interval', ثواني) لتغيير معدل التحديث أثناء البث، 'stats' للإحصائيات، 'stop' للإيقاف
+    """
+    sys.stdout = open(os.devnull, 'w')  # رسائل الاتصال لكل عميل
+    raise_file_limit()
+    from providers import SyntheticProvider
+    from websocket_stream import TadawulLiveStream
+
+    stream = TadawulLiveStream(host='127.0.0.1', port=port, provider=SyntheticProvider(symbols, rate=2.0))
+
+    def stats():
+        status = stream.get_connection_status()
+        return {
+            'cpu_seconds': time.process_time(),
+            'wall': time.monotonic(),
+            'rss': rss_bytes(),
+            'clients': status['websocket_clients'],
+            'cycles': status['poll']['cycles'],
+            'avg_cycle_ms': status['poll']['avg_cycle_ms'],
+            'missed_deadlines': status['poll']['missed_deadlines'],
+            'slow_disconnects': status['slow_disconnects'],
+            'conflated': sum(state.updates_conflated for state in stream.client_states.values()),
+        }
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        server = loop.create_task(stream.start_server(interval))
+        while stream.server is None:
+            await asyncio.sleep(0.01)
+        conn.send('ready')
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            if command == 'stop':
+                stream.stop_streaming()
+                stream.server.close()
+                server.cancel()
+                return
+            if command == 'stats':
+                conn.send(stats())
+            elif command[0] == 'interval':
+                stream.poll_interval = command[1]
+                conn.send('ok')
+
+    asyncio.run(main())
+
+
+# ---------- عمليات العملاء ----------
+class ClientPool:
+    """مجموعة عملاء في عملية واحدة تجمع زمن الوصول أثناء نافذة القياس فقط"""
+
+    def __init__(self, port, symbols, weights, mean_subscriptions, seed):
+        self.uri = f'ws://127.0.0.1:{port}'
+        self.symbols = symbols
+        self.weights = weights
+        self.mean_subscriptions = mean_subscriptions
+        self.rng = np.random.default_rng(seed)
+        self.clients = []          # (الاتصال، عدد الاشتراكات، مهمة القراءة)
+        self.measuring = False
+        self.latencies = []
+        self.closed = 0
+        self.failed = 0
+
+    def pick_symbols(self):
+        count = min(len(self.symbols), 1 + int(self.rng.poisson(self.mean_subscriptions - 1)))
+        return list(self.rng.choice(self.symbols, size=count, replace=False, p=self.weights))
+
+    async def read(self, websocket):
+        import websockets
+        try:
+            async for message in websocket:
+                if not self.measuring or isinstance(message, bytes):
+                    continue
+                now = seconds_of_day()
+                for hours, minutes, seconds in TIMESTAMP.findall(message):
+                    sent = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                    latency = now - sent
+                    if latency < -43200:  # عبور منتصف الليل
+                        latency += 86400
+                    self.latencies.append(latency * 1000)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        self.closed += 1
+
+    async def connect_one(self, limit):
+        import websockets
+        async with limit:
+            try:
+                websocket = await websockets.connect(self.uri, open_timeout=60, max_size=None)
+                symbols = self.pick_symbols()
+                for symbol in symbols:
+                    await websocket.send(json.dumps({'type': 'subscribe', 'symbol': symbol}))
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+                self.failed += 1
+                return
+        self.clients.append((websocket, len(symbols), asyncio.ensure_future(self.read(websocket))))
+
+    async def connect(self, count):
+        limit = asyncio.Semaphore(100)
+        await asyncio.gather(*(self.connect_one(limit) for _ in range(count)))
+
+    def subscriptions(self):
+        return sum(subscriptions for websocket, subscriptions, reader in self.clients if not reader.done())
+
+    async def close(self):
+        await asyncio.gather(*(websocket.close() for websocket, _, _ in self.clients), return_exceptions=True)
+
+
+def run_clients(conn, port, symbols, weights, mean_subscriptions, seed):
+    """
+    عملية عملاء: ('connect', n) لإضافة n عميل، 'start' لبدء القياس،
+    'stop' لإنهائه وإعادة النتائج، 'quit' لإغلاق الاتصالات
+    """
+    raise_file_limit()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        pool = ClientPool(port, symbols, weights, mean_subscriptions, seed)
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            if command == 'quit':
+                await pool.close()
+                conn.send('ok')
+                return
+            if command == 'start':
+                pool.latencies = []
+                pool.measuring = True
+                conn.send(pool.subscriptions())
+            elif command == 'stop':
+                pool.measuring = False
+                conn.send({'latencies': np.asarray(pool.latencies, dtype=np.float32),
+                           'subscriptions': pool.subscriptions(), 'closed': pool.closed, 'failed': pool.failed})
+            elif command[0] == 'connect':
+                await pool.connect(command[1])
+                conn.send(len(pool.clients))
+
+    asyncio.run(main())
+
+
+# ---------- التشغيل ----------
+def symbol_mix(skew):
+    """رموز الشركات مع أوزان Zipf حسب ترتيبها (الأكبر أولاً في قائمة التطبيق)"""
+    import app
+    symbols = list(app.analyzer.symbols)
+    weights = 1.0 / np.arange(1, len(symbols) + 1) ** skew
+    return symbols, weights / weights.sum()
+
+
+def broadcast(conns, command):
+    for conn in conns:
+        conn.send(command)
+    return [conn.recv() for conn in conns]
+
+
+def run_step(server, pools, clients, rate, duration, warmup, late_ms):
+    """مرحلة قياس واحدة بعدد عملاء ومعدل تحديث محددين"""
+    server.send(('interval', 1.0 / rate))
+    server.recv()
+    time.sleep(warmup)
+
+    server.send('stats')
+    before = server.recv()
+    subscriptions = sum(broadcast(pools, 'start'))
+    time.sleep(duration)
+    results = broadcast(pools, 'stop')
+    server.send('stats')
+    after = server.recv()
+
+    latencies = np.concatenate([r['latencies'] for r in results]) if results else np.array([])
+    cycles = after['cycles'] - before['cycles']
+    expected = cycles * subscriptions
+    received = int(len(latencies))
+    step = {
+        'clients': clients,
+        'connected': after['clients'],
+        'rate': rate,
+        'subscriptions': subscriptions,
+        'cycles': cycles,
+        'received': received,
+        'dropped_pct': round(max(0, expected - received) / expected * 100, 2) if expected else 0.0,
+        'late_pct': round(float((latencies > late_ms).mean()) * 100, 2) if received else 0.0,
+        'server_cpu_pct': round((after['cpu_seconds'] - before['cpu_seconds'])
+                                / (after['wall'] - before['wall']) * 100, 1),
+        'server_rss_mb': round(after['rss'] / 2 ** 20, 1) if after['rss'] else None,
+        'avg_cycle_ms': after['avg_cycle_ms'],
+        'missed_deadlines': after['missed_deadlines'] - before['missed_deadlines'],
+        'slow_disconnects': after['slow_disconnects'],
+        'conflated': after['conflated'] - before['conflated'],
+        'client_disconnects': sum(r['closed'] for r in results),
+        'connect_failures': sum(r['failed'] for r in results),
+    }
+    if received:
+        step['latency'] = summarize(latencies)
+    return step
+
+
+def print_step(step):
+    latency = step.get('latency', {})
+    print(f" {step['clients']:>6} عميل  {step['rate']:>5}/ث  "
+          f"p50 {latency.get('median_ms', 0):>8.1f}  p95 {latency.get('p95_ms', 0):>8.1f}  "
+          f"p99 {latency.get('p99_ms', 0):>8.1f} ms  مفقود {step['dropped_pct']:>5.1f}%  "
+          f"متأخر {step['late_pct']:>5.1f}%  CPU {step['server_cpu_pct']:>5.1f}%  "
+          f"RSS {step['server_rss_mb']} MB  دورة {step['avg_cycle_ms']} ms  "
+          f"مفصول {step['client_disconnects']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='اختبار تحمل خادم البث المباشر')
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 500, 1000, 2000],
+                        help='مراحل عدد العملاء (تصاعدياً)')
+    parser.add_argument('--rates', type=float, nargs='+', default=[0.5, 1, 2],
+                        help='معدلات التحديث (دورة استطلاع في الثانية) لكل مرحلة')
+    parser.add_argument('--duration', type=float, default=10, help='مدة القياس لكل مرحلة (ثواني)')
+    parser.add_argument('--warmup', type=float, default=2, help='مدة الانتظار قبل القياس (ثواني)')
+    parser.add_argument('--subscriptions', type=float, default=5, help='متوسط الرموز لكل عميل')
+    parser.add_argument('--skew', type=float, default=1.0, help='انحياز الاشتراك للشركات الكبيرة (Zipf)')
+    parser.add_argument('--client-procs', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help='عدد عمليات العملاء')
+    parser.add_argument('--late-ms', type=float, default=1000, help='الزمن الذي يُعتبر بعده التحديث متأخراً')
+    parser.add_argument('--collapse-ms', type=float, default=5000, help='إيقاف التصعيد عندما يتجاوز p99 هذا الحد')
+    parser.add_argument('--output', help='إضافة النتائج كسطر JSON لهذا الملف')
+    args = parser.parse_args()
+
+    raise_file_limit()
+    symbols, weights = symbol_mix(args.skew)
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    port = free_port()
+
+    def start(target, *target_args):
+        conn, child = context.Pipe()
+        process = context.Process(target=target, args=(child,) + target_args, daemon=True)
+        process.start()
+        return process, conn
+
+    server_process, server = start(run_server, port, symbols, 1.0 / args.rates[0])
+    server.recv()
+    pools = [start(run_clients, port, symbols, weights, args.subscriptions, seed)
+             for seed in range(args.client_procs)]
+    processes = [server_process] + [process for process, _ in pools]
+    pools = [conn for _, conn in pools]
+    print(f" الخادم على المنفذ {port} - {len(pools)} عملية عملاء - {len(symbols)} رمز")
+
+    steps = []
+    connected = 0
+    try:
+        for clients in sorted(args.clients):
+            # توزيع العملاء الإضافيين على عمليات العملاء
+            extra = clients - connected
+            shares = [extra // len(pools) + (1 if i < extra % len(pools) else 0) for i in range(len(pools))]
+            for conn, share in zip(pools, shares):
+                conn.send(('connect', share))
+            for conn in pools:
+                conn.recv()
+            connected = clients
+
+            collapsed = False
+            for rate in sorted(args.rates):
+                step = run_step(server, pools, clients, rate, args.duration, args.warmup, args.late_ms)
+                steps.append(step)
+                print_step(step)
+                if step.get('latency', {}).get('p99_ms', float('inf')) > args.collapse_ms:
+                    collapsed = True
+                    break
+            if collapsed:
+                print(f" تجاوز p99 حد {args.collapse_ms:.0f} ms عند {clients} عميل - إيقاف التصعيد")
+                break
+    finally:
+        broadcast(pools, 'quit')
+        server.send('stop')
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+                                'args': vars(args), 'steps': steps}, ensure_ascii=False) + '\n')
+        print(f" تم حفظ النتائج في {args.output}")
+
+
+if __name__ == '__main__':
+    main()
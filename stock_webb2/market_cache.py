@@ -0,0 +1,241 @@
+"""
+مالك لقطة السوق (Market Snapshot)
+يحدّث الكاش العالمي في خيط خلفي قبل انتهاء صلاحيته، مع تحديث واحد فقط في كل مرة،
+وتقديم آخر بيانات متوفرة فوراً للطلبات حتى أثناء التحديث
+"""
+
+import threading
+import time
+from datetime import datetime
+from metrics import REFRESH_SECONDS
+
+# الحقول التي يُعتبر تغيرها تغيراً في بيانات السهم
+DIFF_FIELDS = ('last', 'change', 'change_percent', 'volume', 'source')
+
+
+class MarketCache:
+    """
+    تحديث خلفي بأسلوب stale-while-revalidate للكاش العالمي
+    """
+
+    def __init__(self, cache, loader, refresh_ahead=30, retry_delay=30, initial_timeout=60, poll_interval=None):
+        """
+        Args:
+            cache: قاموس الكاش المشترك (GLOBAL_CACHE)
+            loader: دالة تُرجع قاموس الحقول الجديدة (market_data, market_overview ...)،
+                    أو None إذا لم يتغير المصدر؛ ويمكن أن تحدد version و last_update بنفسها
+            refresh_ahead: بدء التحديث قبل انتهاء الصلاحية بهذه الثواني
+            retry_delay: الانتظار قبل إعادة المحاولة عند فشل التحديث
+            initial_timeout: أقصى انتظار للطلب الأول قبل توفر أي بيانات
+            poll_interval: استدعاء loader كل هذه الثواني بدلاً من انتظار انتهاء الصلاحية
+                           (لقارئ لقطة تحدّثها عملية أخرى)
+        """
+        self.cache = cache
+        self.loader = loader
+        self.refresh_ahead = refresh_ahead
+        self.retry_delay = retry_delay
+        self.initial_timeout = initial_timeout
+        self.poll_interval = poll_interval
+        self._polled_at = None
+        self.listeners = []
+        self.row_versions = {}      # الرمز -> آخر إصدار تغيرت فيه بياناته
+        self.removed_versions = {}  # الرمز -> الإصدار الذي اختفى فيه من اللقطة
+        self.fresh_reads = 0        # طلبات قُدمت لها بيانات ضمن الصلاحية
+        self.stale_reads = 0        # طلبات قُدمت لها بيانات منتهية الصلاحية (أثناء التحديث)
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+        self._lock = threading.Lock()          # يحمي قراءة/كتابة اللقطة
+        self._refresh_lock = threading.Lock()  # تحديث واحد فقط في كل مرة
+        self._ready = threading.Event()
+        self._notifying = None                 # خيط التحديث أثناء استدعاء المستمعين
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+        self.cache.setdefault('version', 0)
+        self.cache.setdefault('refreshing', False)
+        if self.cache.get('last_update'):
+            self._ready.set()
+
+    def start(self):
+        """تشغيل خيط التحديث الخلفي (مرة واحدة فقط)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='market-cache', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """إيقاف خيط التحديث"""
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def add_listener(self, callback):
+        """تسجيل دالة تُستدعى بعد كل تحديث ناجح: callback(snapshot)"""
+        self.listeners.append(callback)
+
+    def age(self):
+        """عمر البيانات الحالية بالثواني (None إذا لم تُحمّل بعد)"""
+        last_update = self.cache.get('last_update')
+        if not last_update:
+            return None
+        return (datetime.now() - last_update).total_seconds()
+
+    def snapshot(self):
+        """
+        قراءة آخر لقطة فوراً
+
+        ينتظر فقط في أول طلب قبل توفر أي بيانات، وبعدها لا يحجب الطلبات أبداً
+        """
+        self._wait_ready()
+        with self._lock:
+            snapshot = dict(self.cache)
+        return self._decorate(snapshot)
+
+    def _wait_ready(self):
+        self.start()
+        # المستمعون يقرؤون اللقطة التي يُبلَّغون بها قبل إعلان الجاهزية
+        if not self._ready.is_set() and self._notifying != threading.get_ident():
+            self._wake.set()
+            self._ready.wait(self.initial_timeout)
+
+    def _decorate(self, snapshot):
+        """إضافة عمر البيانات وحالة القِدم إلى نسخة اللقطة"""
+        age = self.age()
+        snapshot['age'] = round(age, 1) if age is not None else None
+        snapshot['stale'] = age is None or age > self.cache['expiry']
+        if snapshot['stale']:
+            self.stale_reads += 1
+        else:
+            self.fresh_reads += 1
+        if snapshot['stale'] and not snapshot['refreshing']:
+            self._wake.set()
+        return snapshot
+
+    def refresh(self, loader=None, wait=False):
+        """
+        تحديث اللقطة الآن - إذا كان هناك تحديث جارٍ يُتجاهل الطلب (single-flight)
+
+        Args:
+            loader: دالة بديلة عن loader لهذا التحديث فقط (مثل دمج التحديثات اللحظية)
+            wait: انتظار انتهاء التحديث الجاري ثم التحديث بدلاً من تجاهل الطلب
+
+        Returns:
+            True إذا تم التحديث بنجاح، False إذا فشل loader، None إذا تُجوهل لوجود تحديث جارٍ
+        """
+        if not self._refresh_lock.acquire(blocking=wait):
+            return None
+        try:
+            self.cache['refreshing'] = True
+            started = time.time()
+            try:
+                fields = (loader or self.loader)()
+            except Exception as e:
+                print(f" خطأ في تحديث بيانات السوق: {e}")
+                self.refresh_failures += 1
+                REFRESH_SECONDS.observe(time.time() - started, result='error')
+                return False
+            finally:
+                self._polled_at = time.time()
+            if fields is None:
+                return True
+            self.refreshes += 1
+            REFRESH_SECONDS.observe(time.time() - started, result='ok')
+
+            with self._lock:
+                version = fields.pop('version', self.cache['version'] + 1)
+                if 'market_data' in fields:
+                    self._track_changes(self.cache.get('market_data') or [], fields['market_data'], version)
+                self.cache['refresh_duration'] = round(time.time() - started, 2)
+                self.cache['last_update'] = datetime.now()
+                self.cache.update(fields)
+                self.cache['version'] = version
+                snapshot = dict(self.cache)
+
+            self._notifying = threading.get_ident()
+            try:
+                for callback in self.listeners:
+                    try:
+                        callback(snapshot)
+                    except Exception as e:
+                        print(f" خطأ في مستمع الكاش: {e}")
+            finally:
+                self._notifying = None
+            # بعد المستمعين: أول الطلبات تجد الترتيب والمؤشرات مبنية من هذه اللقطة
+            self._ready.set()
+            return True
+        finally:
+            self.cache['refreshing'] = False
+            self._refresh_lock.release()
+
+    def _track_changes(self, old_rows, new_rows, version):
+        """تسجيل الإصدار الذي تغيرت فيه كل شركة لدعم طلبات ?since="""
+        old = {row['symbol']: row for row in old_rows}
+        for row in new_rows:
+            previous = old.pop(row['symbol'], None)
+            if previous is None or any(previous.get(f) != row.get(f) for f in DIFF_FIELDS):
+                self.row_versions[row['symbol']] = version
+            self.removed_versions.pop(row['symbol'], None)
+        for symbol in old:
+            self.row_versions.pop(symbol, None)
+            self.removed_versions[symbol] = version
+
+    def changes_since(self, since):
+        """
+        الشركات التي تغيرت بعد الإصدار المحدد
+
+        Returns:
+            (اللقطة، الصفوف المتغيرة، الرموز المحذوفة)
+        """
+        self._wait_ready()
+        with self._lock:
+            snapshot = self._decorate(dict(self.cache))
+            changed = {s for s, v in self.row_versions.items() if v > since}
+            removed = [s for s, v in self.removed_versions.items() if v > since]
+        rows = [row for row in snapshot['market_data'] if row['symbol'] in changed]
+        return snapshot, rows, removed
+
+    def stats(self):
+        reads = self.fresh_reads + self.stale_reads
+        return {
+            'version': self.cache['version'],
+            'age': self.age(),
+            'expiry': self.cache.get('expiry'),
+            'refreshing': self.cache['refreshing'],
+            'refresh_duration': self.cache.get('refresh_duration'),
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+            'fresh_reads': self.fresh_reads,
+            'stale_reads': self.stale_reads,
+            'hit_rate': round(self.fresh_reads / reads * 100, 1) if reads else 0.0,
+        }
+
+    def _next_delay(self):
+        if self.poll_interval is not None:
+            if self._polled_at is None:
+                return 0
+            return max(0, self.poll_interval - (time.time() - self._polled_at))
+        age = self.age()
+        if age is None:
+            return 0
+        return max(0, self.cache['expiry'] - self.refresh_ahead - age)
+
+    def _run(self):
+        while self._running:
+            delay = self._next_delay()
+            if delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                if not self._running:
+                    break
+                if self._next_delay() > 0:
+                    continue
+
+            # الانتظار خلف دمج لحظي جارٍ بدلاً من اعتباره فشلاً؛ التأخير بعد فشل فعلي فقط
+            if self.refresh(wait=True) is False:
+                self._wake.wait(self.retry_delay)
+                self._wake.clear()
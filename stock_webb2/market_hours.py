@@ -0,0 +1,64 @@
+"""
+مواعيد تداول السوق السعودي بتوقيت الرياض
+أيام الجلسات (الأحد - الخميس) وأوقاتها، لمعرفة آخر جلسة بدأت وهل السوق مفتوح الآن
+(العطل الرسمية غير محسوبة: يوم العطلة يُعامل كيوم تداول بلا بيانات)
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+MARKET_TZ = 'Asia/Riyadh'
+SESSION = ('10:00', '15:00')  # جلسة تداول السوق السعودي
+WEEKMASK = 'Sun Mon Tue Wed Thu'
+SETTLE = timedelta(minutes=30)  # المزاد الختامي وتأخر ياهو قبل اعتماد شمعة اليوم نهائية
+
+
+def market_time(when=None):
+    """
+    الوقت بتوقيت السوق
+
+    Args:
+        when: None (الآن) أو ثوانٍ منذ 1970 أو وقت (الوقت بدون منطقة زمنية يُعد بتوقيت الرياض)
+    """
+    if when is None:
+        return pd.Timestamp.now(tz=MARKET_TZ)
+    if isinstance(when, (int, float)):
+        return pd.Timestamp(when, unit='s', tz='UTC').tz_convert(MARKET_TZ)
+    when = pd.Timestamp(when)
+    return when.tz_localize(MARKET_TZ) if when.tzinfo is None else when.tz_convert(MARKET_TZ)
+
+
+def is_trading_day(day):
+    return bool(np.is_busday(np.datetime64(pd.Timestamp(day).date(), 'D'), weekmask=WEEKMASK))
+
+
+def session_bounds(day):
+    """بداية ونهاية جلسة اليوم بتوقيت السوق"""
+    day = pd.Timestamp(pd.Timestamp(day).date()).tz_localize(MARKET_TZ)
+    opens, closes = (pd.Timedelta(t + ':00') for t in SESSION)
+    return day + opens, day + closes
+
+
+def is_open(when=None):
+    """هل جلسة التداول جارية؟"""
+    now = market_time(when)
+    if not is_trading_day(now):
+        return False
+    opens, closes = session_bounds(now)
+    return opens <= now < closes
+
+
+def last_session(when=None):
+    """يوم آخر جلسة بدأت (تاريخ بدون منطقة زمنية كما تُخزن الشموع اليومية)"""
+    now = market_time(when)
+    day = pd.Timestamp(now.date())
+    if is_trading_day(day) and now >= session_bounds(day)[0]:
+        return day
+    return pd.Timestamp(np.busday_offset(day.date(), -1, roll='forward', weekmask=WEEKMASK))
+
+
+def settled_at(day):
+    """الوقت (ثوانٍ منذ 1970) الذي تصبح بعده شمعة اليوم نهائية"""
+    return (session_bounds(day)[1] + SETTLE).timestamp()
@@ -0,0 +1,146 @@
+"""
+حالة السوق الموحدة داخل العملية
+آخر قيمة لكل شركة من أحدث مصدر متوفر: البث المباشر (تكرتشارت) يكتب فيها مع كل تحديث،
+والجلب المجمّع من ياهو يغطي الشركات التي ليس لها بث حي؛ كل قيمة تحمل مصدرها ووقتها
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+SOURCE_YAHOO = 'yahoo'
+SOURCE_LIVE = 'live'
+
+# عمود جدول الملخص -> حقل تحديث البث
+LIVE_FIELDS = {
+    'open': 'open',
+    'high': 'high',
+    'low': 'low',
+    'last': 'price',
+    'prev': 'previous_close',
+    'change': 'change',
+    'change_percent': 'change_percent',
+    'volume': 'volume',
+}
+
+# الحقول التي يعني تغير أحدها تحديثاً جديداً للدمج في اللقطة
+CHANGE_FIELDS = ('last', 'change', 'volume')
+
+
+class MarketState:
+    """
+    آخر قيم البث المباشر لكل الشركات كمصفوفات مفهرسة بمعرّف الرمز
+    """
+
+    def __init__(self, symbol_master, live_max_age=30):
+        """
+        Args:
+            symbol_master: جدول الرموز (SymbolMaster)
+            live_max_age: عمر قيمة البث (ثواني) الذي تبقى بعده الشركة ضمن الجلب المجمّع
+        """
+        self.master = symbol_master
+        self.live_max_age = live_max_age
+        n = len(symbol_master)
+        self.values = {field: np.full(n, np.nan) for field in LIVE_FIELDS}
+        self.updated = np.full(n, np.nan)  # وقت آخر قيمة حية (ثواني يونكس)
+        self.dirty = set()  # شركات تغيرت قيمتها الحية منذ آخر دمج
+        self.live_updates = 0
+        self._lock = threading.Lock()
+
+    def on_stock_update(self, stock_data):
+        """مستمع لـ TadawulLiveStream.add_listener"""
+        if stock_data.get('type') != 'stock_update':
+            return
+        i = self.master.id(stock_data['symbol'])
+        data = stock_data['data']
+        if i is None or not data.get('price') or data.get('stale'):
+            return  # القيم القديمة المعادة من upstream.py ليست حية
+        row = {field: np.nan if data.get(key) is None else float(data[key]) for field, key in LIVE_FIELDS.items()}
+        now = time.time()
+        with self._lock:
+            # استطلاع بلا تغيير (مثل السوق المغلق) يجدد عمر القيمة فقط ولا يُحدث إصداراً جديداً
+            changed = not now - self.updated[i] <= self.live_max_age or not np.array_equal(
+                [row[f] for f in CHANGE_FIELDS], [self.values[f][i] for f in CHANGE_FIELDS], equal_nan=True)
+            for field, value in row.items():
+                self.values[field][i] = value
+            self.updated[i] = now
+            if changed:
+                self.dirty.add(i)
+                self.live_updates += 1
+
+    def touch(self, symbols):
+        """
+        تجديد عمر القيم الحية لرموز استطلعها البث بدون تغيير
+        (TadawulLiveStream.add_cycle_listener) - لا تعود الشركة الهادئة لقيم ياهو المتأخرة
+        """
+        ids = self.master.ids_of(symbols)
+        ids = ids[ids >= 0]
+        now = time.time()
+        with self._lock:
+            ids = ids[~np.isnan(self.updated[ids])]
+            self.updated[ids] = now
+
+    def live_ids(self, now=None):
+        """معرّفات الشركات التي لها قيمة حية حديثة"""
+        now = time.time() if now is None else now
+        with np.errstate(invalid='ignore'):
+            return np.flatnonzero(now - self.updated <= self.live_max_age)
+
+    def live_symbols(self):
+        return set(self.master.symbols[self.live_ids()])
+
+    def take_dirty(self):
+        """الشركات التي تغيرت منذ آخر استدعاء (وتفريغ القائمة)"""
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def merge(self, summary, fetched_at=None):
+        """
+        جدول ملخص كامل: قيم البث للشركات الحية تحل محل قيم الجلب المجمّع
+
+        Args:
+            summary: جدول batch_fetch.summarize (قد يحتوي source و updated_at من دمج سابق)
+            fetched_at: وقت الجلب للصفوف الجديدة من ياهو
+
+        Returns:
+            نسخة من الجدول مع عمودي source و updated_at لكل شركة
+        """
+        summary = summary.copy()
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        if 'source' not in summary:
+            summary['source'] = SOURCE_YAHOO
+            summary['updated_at'] = fetched_at
+        else:
+            fresh = summary['source'].isna()
+            summary.loc[fresh, 'source'] = SOURCE_YAHOO
+            summary.loc[fresh, 'updated_at'] = fetched_at
+
+        with self._lock:
+            ids = self.live_ids()
+            live = {field: values[ids] for field, values in self.values.items()}
+            updated = self.updated[ids]
+        if len(ids) == 0:
+            return summary
+
+        dates = summary['date'] if len(summary) else pd.Series(dtype='datetime64[ns]')
+        tz = getattr(dates.dt, 'tz', None) if len(dates) else None
+        live_frame = pd.DataFrame(live, index=pd.Index(self.master.symbols[ids], name='symbol'))
+        live_frame.insert(0, 'date', pd.Timestamp.now(tz=tz).normalize())
+        live_frame['source'] = SOURCE_LIVE
+        live_frame['updated_at'] = updated
+
+        # أعمدة الجلب الأخرى (مثل الصفقات) تبقى من الصف السابق إن وجد
+        extra = [c for c in summary.columns if c not in live_frame.columns]
+        if extra:
+            live_frame = live_frame.join(summary[extra], how='left')
+        rest = summary[~summary.index.isin(live_frame.index)]
+        return pd.concat([rest, live_frame[summary.columns]]) if len(rest) else live_frame[summary.columns]
+
+    def stats(self):
+        return {
+            'live_symbols': int(len(self.live_ids())),
+            'live_updates': self.live_updates,
+            'live_max_age': self.live_max_age,
+        }
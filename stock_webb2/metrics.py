@@ -0,0 +1,245 @@
+"""
+مقاييس التشغيل بصيغة Prometheus النصية
+عدادات ومقاييس لحظية ومدرجات تكرارية (histograms) بدون مكتبات خارجية، مع دوال جمع (collectors)
+تقرأ إحصائيات المكونات (الكاش، البث، ...) لحظة الطلب فقط
+
+    from metrics import UPSTREAM_SECONDS
+    with UPSTREAM_SECONDS.time(source='yahoo', method='download'):
+        ...
+    metrics.render()   # نص /metrics
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'tadawul_'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """مقياس بأسماء تسميات ثابتة؛ كل مجموعة قيم تسميات لها قيمتها"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"تسميات {self.name} يجب أن تكون {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """(اللاحقة، التسميات، القيمة) لكل عينة"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', tuple(zip(self.label_names, key)), value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """قياس زمن الكتلة بالثواني (يُسجل حتى عند حدوث خطأ)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self, **labels):
+        """العدد والمتوسط (ملي ثانية) لمجموعة تسميات - لصفحات الحالة"""
+        entry = self._values.get(self._key(labels))
+        if entry is None:
+            return {'count': 0, 'avg_ms': 0.0}
+        return {'count': entry[2], 'avg_ms': round(entry[1] / entry[2] * 1000, 2)}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield '_bucket', labels + (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+class Registry:
+    """كل المقاييس المسجلة ودوال الجمع"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def register(self, collector):
+        """
+        تسجيل دالة جمع تُستدعى عند كل طلب وتعيد قائمة:
+        (الاسم، النوع، الوصف، [(قاموس التسميات، القيمة) ...])
+        """
+        with self._lock:
+            self.collectors.append(collector)
+        return collector
+
+    def unregister(self, collector):
+        with self._lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def render(self, labels=None, extra=()):
+        """
+        كل المقاييس بصيغة Prometheus النصية
+
+        Args:
+            labels: تسميات ثابتة تُضاف لكل عينة (مثل process للعملية الناشرة)
+            extra: نصوص مقاييس من عمليات أخرى تُدمج عيناتها تحت نفس العائلات
+        """
+        constant = tuple(sorted((labels or {}).items()))
+        families = {}  # الاسم -> [الوصف، النوع، أسطر العينات]
+
+        def family(name, kind, documentation):
+            return families.setdefault(name, [documentation, kind, []])[2]
+
+        for metric in list(self.metrics):
+            lines = family(metric.name, metric.kind, metric.documentation)
+            for suffix, sample_labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(constant + sample_labels)} {_format_value(value)}')
+        for collector in list(self.collectors):
+            try:
+                collected = collector()
+            except Exception as e:
+                print(f" خطأ في جمع المقاييس: {e}")
+                continue
+            for name, kind, documentation, samples in collected:
+                name = PREFIX + name
+                lines = family(name, kind, documentation)
+                for sample_labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f'{name}{_format_labels(constant + tuple(sorted(sample_labels.items())))} '
+                                 f'{_format_value(value)}')
+        for text in extra:
+            for name, (documentation, kind, samples) in parse(text).items():
+                family(name, kind, documentation).extend(samples)
+
+        lines = []
+        for name, (documentation, kind, samples) in families.items():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def parse(text):
+    """نص Prometheus إلى عائلات {الاسم: [الوصف، النوع، أسطر العينات]} لدمجه في render"""
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            name, _, value = line[7:].partition(' ')
+            current = families.setdefault(name, ['', 'untyped', []])
+            current[0 if line.startswith('# HELP ') else 1] = value
+        elif line and not line.startswith('#') and current is not None:
+            current[2].append(line)
+    return families
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register = REGISTRY.register
+unregister = REGISTRY.unregister
+render = REGISTRY.render
+
+# ---------- المقاييس المشتركة بين الوحدات ----------
+UPSTREAM_SECONDS = histogram('upstream_request_seconds', 'زمن طلبات مصادر البيانات', ('source', 'method'))
+UPSTREAM_ERRORS = counter('upstream_errors_total', 'الطلبات الفاشلة لمصادر البيانات', ('source', 'method'))
+SYMBOL_FAILURES = counter('symbol_failures_total', 'مرات فشل جلب بيانات الشركة', ('symbol', 'source'))
+REFRESH_SECONDS = histogram('market_refresh_seconds', 'زمن تحديث لقطة السوق', ('result',))
+STREAM_FANOUT_SECONDS = histogram('stream_fanout_seconds', 'زمن توزيع تحديث سهم على طوابير مشتركيه',
+                                  buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+STREAM_POLL_SECONDS = histogram('stream_poll_cycle_seconds', 'زمن دورة استطلاع البث المباشر')
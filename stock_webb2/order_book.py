@@ -0,0 +1,249 @@
+"""
+دفتر الأوامر (عمق السوق L2) في الذاكرة
+كل جانب مصفوفتان NumPy مرتبتان (السعر كعدد صحيح مضروب بمعامل، والكمية)،
+أفضل سعر في آخر المصفوفة فالقراءة O(1) والتحديثات قرب السعر الحالي رخيصة
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+PRICE_SCALE = 1000  # السعر يُخزن كعدد صحيح بدقة 0.001
+
+
+def to_ticks(prices):
+    return np.round(np.asarray(prices, dtype=float) * PRICE_SCALE).astype(np.int64)
+
+
+class BookSide:
+    """
+    جانب واحد من الدفتر بسعة ثابتة
+
+    المفتاح = السعر للشراء و -السعر للبيع، مرتب تصاعدياً بحيث يكون
+    أفضل مستوى دائماً في الموضع count - 1
+    """
+
+    __slots__ = ('sign', 'keys', 'quantities', 'count')
+
+    def __init__(self, is_bid, capacity):
+        self.sign = 1 if is_bid else -1
+        self.keys = np.zeros(capacity, dtype=np.int64)
+        self.quantities = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+
+    def best(self):
+        """(السعر، الكمية) لأفضل مستوى أو None"""
+        if self.count == 0:
+            return None
+        i = self.count - 1
+        return self.sign * int(self.keys[i]) / PRICE_SCALE, float(self.quantities[i])
+
+    def set(self, ticks, quantity):
+        """
+        تعديل مستوى واحد (الكمية 0 تحذفه)
+
+        Returns:
+            True إذا تغير الدفتر
+        """
+        key = self.sign * ticks
+        n = self.count
+        i = int(np.searchsorted(self.keys[:n], key))
+        exists = i < n and self.keys[i] == key
+
+        if quantity <= 0:
+            if not exists:
+                return False
+            self.keys[i:n - 1] = self.keys[i + 1:n]
+            self.quantities[i:n - 1] = self.quantities[i + 1:n]
+            self.count -= 1
+            return True
+
+        if exists:
+            if self.quantities[i] == quantity:
+                return False
+            self.quantities[i] = quantity
+            return True
+
+        if n == len(self.keys):
+            # الدفتر ممتلئ: يُحذف أبعد مستوى عن السعر الحالي إن كان الجديد أفضل منه
+            if i == 0:
+                return False
+            self.keys[:i - 1] = self.keys[1:i]
+            self.quantities[:i - 1] = self.quantities[1:i]
+            i -= 1
+        else:
+            self.keys[i + 1:n + 1] = self.keys[i:n]
+            self.quantities[i + 1:n + 1] = self.quantities[i:n]
+            self.count += 1
+        self.keys[i] = key
+        self.quantities[i] = quantity
+        return True
+
+    def replace(self, ticks, quantities):
+        """استبدال الجانب بالكامل من لقطة المصدر (يُحتفظ بأفضل المستويات عند تجاوز السعة)"""
+        keys = self.sign * ticks
+        order = np.argsort(keys, kind='stable')
+        keys, quantities = keys[order], quantities[order]
+        valid = quantities > 0
+        keys, quantities = keys[valid], quantities[valid]
+        keep = np.r_[keys[1:] != keys[:-1], True]  # آخر قيمة لكل سعر مكرر
+        keys, quantities = keys[keep][-len(self.keys):], quantities[keep][-len(self.keys):]
+        n = len(keys)
+        self.keys[:n] = keys
+        self.quantities[:n] = quantities
+        self.count = n
+
+    def top(self, depth=None):
+        """أفضل المستويات (الأفضل أولاً) كمصفوفتي الأسعار بالوحدات الصحيحة والكميات"""
+        start = 0 if depth is None else max(0, self.count - depth)
+        return self.sign * self.keys[start:self.count][::-1], self.quantities[start:self.count][::-1]
+
+
+def _levels(ticks, quantities):
+    return [{"price": t / PRICE_SCALE, "quantity": q} for t, q in zip(ticks.tolist(), quantities.tolist())]
+
+
+def _diff(old, new):
+    """المستويات المتغيرة بين لقطتين (الكمية 0 = المستوى خرج من النافذة)"""
+    (old_ticks, old_qty), (new_ticks, new_qty) = old, new
+    position = {t: q for t, q in zip(old_ticks.tolist(), old_qty.tolist())}
+    changed = [[t / PRICE_SCALE, q] for t, q in zip(new_ticks.tolist(), new_qty.tolist())
+               if position.pop(t, None) != q]
+    changed.extend([t / PRICE_SCALE, 0] for t in position)
+    return changed
+
+
+class OrderBook:
+    """
+    دفتر أوامر لرمز واحد
+    """
+
+    __slots__ = ('symbol', 'bids', 'asks', 'sent', 'updates')
+
+    def __init__(self, symbol, capacity=64):
+        self.symbol = symbol
+        self.bids = BookSide(True, capacity)
+        self.asks = BookSide(False, capacity)
+        self.sent = None  # آخر نافذة عمق أُرسلت للعملاء (أساس الفروقات)
+        self.updates = 0
+
+    def apply(self, side, price, quantity):
+        """تحديث تزايدي لمستوى واحد: side = 'bid' أو 'ask'"""
+        book_side = self.bids if side == 'bid' else self.asks
+        changed = book_side.set(int(to_ticks(price)), quantity)
+        self.updates += changed
+        return changed
+
+    def replace(self, bids, asks):
+        """تحميل لقطة كاملة بصيغة تكرتشارت: قوائم {'price', 'quantity'}"""
+        for book_side, levels in ((self.bids, bids), (self.asks, asks)):
+            prices = np.fromiter((level.get('price', 0) for level in levels), dtype=float, count=len(levels))
+            quantities = np.fromiter((level.get('quantity', 0) for level in levels), dtype=float, count=len(levels))
+            book_side.replace(to_ticks(prices), quantities)
+        self.updates += 1
+
+    @property
+    def best_bid(self):
+        return self.bids.best()
+
+    @property
+    def best_ask(self):
+        return self.asks.best()
+
+    @property
+    def spread(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return round(ask[0] - bid[0], 6)
+
+    def snapshot(self, depth=5):
+        """أفضل المستويات بنفس صيغة تكرتشارت"""
+        return {"bids": _levels(*self.bids.top(depth)), "asks": _levels(*self.asks.top(depth))}
+
+    def depth_changes(self, depth=5):
+        """
+        المستويات التي تغيرت في نافذة أفضل depth مستوى منذ آخر استدعاء
+
+        Returns:
+            {"bids": [[السعر، الكمية]...], "asks": [...]} أو None إذا لم يتغير شيء
+        """
+        current = (self.bids.top(depth), self.asks.top(depth))
+        current = tuple((ticks.copy(), qty.copy()) for ticks, qty in current)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0))
+        previous = self.sent or (empty, empty)
+        self.sent = current
+
+        bids, asks = _diff(previous[0], current[0]), _diff(previous[1], current[1])
+        if not bids and not asks:
+            return None
+        return {"bids": bids, "asks": asks}
+
+
+class OrderBookManager:
+    """
+    دفاتر عدة رموز بذاكرة محدودة - يُحذف الأقدم استخداماً عند تجاوز الحد
+    """
+
+    def __init__(self, max_books=500, capacity=64, depth=5):
+        """
+        Args:
+            max_books: أقصى عدد دفاتر في الذاكرة
+            capacity: أقصى عدد مستويات لكل جانب
+            depth: عدد المستويات المرسلة للعملاء
+        """
+        self.max_books = max_books
+        self.capacity = capacity
+        self.depth = depth
+        self.books = OrderedDict()
+
+    def __contains__(self, symbol):
+        return symbol in self.books
+
+    def get(self, symbol):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol, self.capacity)
+            if len(self.books) > self.max_books:
+                self.books.popitem(last=False)
+        else:
+            self.books.move_to_end(symbol)
+        return book
+
+    def discard(self, symbol):
+        self.books.pop(symbol, None)
+
+    def update(self, symbol, depth):
+        """
+        تطبيق لقطة عمق من المصدر وإرجاع رسالة market_depth بالمستويات المتغيرة فقط
+
+        Returns:
+            الرسالة أو None إذا لم تتغير نافذة العمق
+        """
+        book = self.get(symbol)
+        book.replace(depth.get("bids", []), depth.get("asks", []))
+        changes = book.depth_changes(self.depth)
+        if changes is None:
+            return None
+        return dict(type="market_depth", symbol=symbol, **changes)
+
+    def snapshot_message(self, symbol):
+        """رسالة عمق كاملة لمشترك جديد (بنفس صيغة الفروقات)"""
+        book = self.books.get(symbol)
+        if book is None:
+            return None
+        snapshot = book.snapshot(self.depth)
+        return {
+            "type": "market_depth",
+            "symbol": symbol,
+            "snapshot": True,
+            "bids": [[level["price"], level["quantity"]] for level in snapshot["bids"]],
+            "asks": [[level["price"], level["quantity"]] for level in snapshot["asks"]],
+            "spread": book.spread,
+        }
+
+    def stats(self):
+        return {
+            "books": len(self.books),
+            "max_books": self.max_books,
+            "memory_bytes": len(self.books) * 2 * self.capacity * 16,
+        }
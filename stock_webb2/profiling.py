@@ -0,0 +1,251 @@
+"""
+قياس زمن الطلبات وتحليل الأداء عند الطلب
+- RequestTimer: زمن كل مرحلة في الطلب (الكاش، الجلب من المصدر، عرض القوالب، الباقي) لكل مسار،
+  مع ترويسة Server-Timing وتسجيل الطلبات البطيئة بتفصيلها
+- SamplingProfiler: أخذ عينات من مكدس كل الخيوط لفترة محددة وحفظها بصيغة folded stacks
+  (flamegraph.pl / speedscope)
+
+التكلفة بدون المحلل: استدعاءان لـ perf_counter لكل مرحلة فقط
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from metrics import histogram
+
+REQUEST_SECONDS = histogram('http_request_seconds', 'زمن مراحل طلبات HTTP', ('route', 'phase'))
+
+
+# ---------- مراحل الطلب ----------
+def _enter(name):
+    """بدء مرحلة - الزمن داخل مرحلة متداخلة يُحسب لها فقط وليس للمرحلة الأعلى"""
+    if not has_request_context() or 'phase_stack' not in g:
+        return False
+    g.phase_stack.append([name, time.perf_counter(), 0.0])
+    return True
+
+
+def _exit():
+    name, started, nested = g.phase_stack.pop()
+    elapsed = time.perf_counter() - started
+    g.phases[name] = g.phases.get(name, 0.0) + elapsed - nested
+    if g.phase_stack:
+        g.phase_stack[-1][2] += elapsed
+
+
+@contextmanager
+def phase(name):
+    """قياس كتلة كمرحلة من الطلب الحالي (لا شيء خارج الطلبات)"""
+    entered = _enter(name)
+    try:
+        yield
+    finally:
+        if entered:
+            _exit()
+
+
+def timed(name):
+    """مزخرف: قياس الدالة كمرحلة"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    """إضافة زمن مقاس مسبقاً لمرحلة في الطلب الحالي (مثل مستمعي InstrumentedProvider)"""
+    if has_request_context() and 'phases' in g:
+        g.phases[name] = g.phases.get(name, 0.0) + seconds
+        if g.phase_stack:
+            g.phase_stack[-1][2] += seconds
+
+
+class RequestTimer:
+    """
+    زمن مراحل كل طلب لكل مسار، وسجل بآخر الطلبات البطيئة
+    """
+
+    def __init__(self, app=None, slow_ms=500, keep_slow=100):
+        """
+        Args:
+            slow_ms: الطلب الذي يتجاوز هذا الزمن يُسجل مع تفصيل مراحله
+            keep_slow: عدد الطلبات البطيئة المحفوظة لصفحة الحالة
+        """
+        self.slow_ms = slow_ms
+        self.slow_requests = deque(maxlen=keep_slow)
+        self.routes = {}  # المسار -> {'count', 'total_ms', 'max_ms', 'phases_ms'}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.after_request(self._after)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _before(self):
+        g.request_started = time.perf_counter()
+        g.phases = {}
+        g.phase_stack = []
+
+    def _render_started(self, sender, template, context, **extra):
+        _enter('render')
+
+    def _render_finished(self, sender, template, context, **extra):
+        if 'phase_stack' in g and g.phase_stack and g.phase_stack[-1][0] == 'render':
+            _exit()
+
+    def _after(self, response):
+        if 'request_started' not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        phases = dict(g.phases)
+        phases['other'] = max(0.0, total - sum(phases.values()))
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+        # تكلفة الطلبات المتدفقة (SSE) تُحسب حتى بدء الإرسال فقط
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases.items()) + f', total;dur={total * 1000:.1f}'
+        for name, seconds in phases.items():
+            REQUEST_SECONDS.observe(seconds, route=route, phase=name)
+
+        total_ms = total * 1000
+        with self._lock:
+            stats = self.routes.setdefault(route, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'phases_ms': {}})
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            for name, seconds in phases.items():
+                stats['phases_ms'][name] = stats['phases_ms'].get(name, 0.0) + seconds * 1000
+
+        if total_ms >= self.slow_ms:
+            breakdown = {name: round(seconds * 1000, 1) for name, seconds in phases.items()}
+            self.slow_requests.append({'time': datetime.now().isoformat(timespec='seconds'),
+                                       'method': request.method, 'path': request.full_path.rstrip('?'),
+                                       'status': response.status_code, 'total_ms': round(total_ms, 1),
+                                       'phases_ms': breakdown})
+            print(f" طلب بطيء {request.method} {request.path} {total_ms:.0f}ms: "
+                  + ', '.join(f'{name} {ms:.0f}ms' for name, ms in breakdown.items()))
+        return response
+
+    def stats(self):
+        """متوسط كل مرحلة لكل مسار (ملي ثانية)"""
+        with self._lock:
+            routes = {route: {
+                'count': s['count'],
+                'avg_ms': round(s['total_ms'] / s['count'], 2),
+                'max_ms': round(s['max_ms'], 1),
+                'phases_avg_ms': {name: round(ms / s['count'], 2) for name, ms in s['phases_ms'].items()},
+            } for route, s in self.routes.items()}
+        return {'slow_ms': self.slow_ms, 'routes': routes, 'slow_requests': list(self.slow_requests)}
+
+
+# ---------- المحلل بأخذ العينات ----------
+class SamplingProfiler:
+    """
+    كل interval ثانية يُقرأ مكدس جميع الخيوط (sys._current_frames) ويُعد كل مكدس؛
+    لا يعمل أي شيء خارج فترة التحليل
+    """
+
+    def __init__(self, output_dir=os.path.join('data', 'profiles')):
+        self.output_dir = output_dir
+        self.samples = Counter()
+        self.sample_count = 0
+        self.interval = None
+        self.started_at = None
+        self.ends_at = None
+        self.last_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=30, interval=0.005):
+        """
+        بدء التحليل لمدة محددة (يتوقف ويحفظ النتيجة تلقائياً)
+
+        Returns:
+            False إذا كان هناك تحليل جارٍ
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.samples = Counter()
+            self.sample_count = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self.ends_at = self.started_at + seconds
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        print(f" بدأ تحليل الأداء لمدة {seconds} ثانية (عينة كل {interval * 1000:.0f}ms)")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.is_set() and time.time() < self.ends_at:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            stacks = [self._fold(names.get(ident, str(ident)), frame)
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._lock:
+                self.samples.update(stacks)
+                self.sample_count += 1
+            self._stop.wait(self.interval)
+        self.last_file = self.save()
+        print(f" انتهى تحليل الأداء: {self.sample_count} عينة - {self.last_file}")
+
+    @staticmethod
+    def _fold(thread_name, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        stack.append(thread_name)
+        return ';'.join(reversed(stack))
+
+    def folded(self):
+        """النتيجة بصيغة folded stacks: سطر لكل مكدس مع عدد العينات"""
+        with self._lock:
+            samples = Counter(self.samples)
+        return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+
+    def save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile_{datetime.fromtimestamp(self.started_at):%Y%m%d_%H%M%S}_{os.getpid()}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.folded())
+        return path
+
+    def status(self):
+        return {
+            'running': self.running,
+            'samples': self.sample_count,
+            'interval_ms': self.interval * 1000 if self.interval else None,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds') if self.started_at else None,
+            'remaining': round(max(0.0, self.ends_at - time.time()), 1) if self.running else 0,
+            'stacks': len(self.samples),
+            'file': self.last_file,
+            'pid': os.getpid(),
+        }
@@ -0,0 +1,777 @@
+"""
+مزودو بيانات السوق
+واجهة واحدة تعتمد عليها TadawulLive و TadawulLiveStream و StockAnalyzer/BatchDownloader بدلاً من
+tkrtshare و yfinance مباشرة، مع مسجّل يحفظ الاستجابات الحقيقية في ملف إلحاقي مضغوط،
+ومشغّل يعيد الجلسة المسجلة بسرعتها الأصلية أو أسرع، ومولّد تركيبي لكل الشركات بدون شبكة
+
+اختيار المزود من متغير البيئة MARKET_DATA:
+    live (الافتراضي) | record:<ملف> | replay:<ملف>[:<السرعة>|max] | synthetic[:<تحديثات/ثانية>]
+"""
+
+import bisect
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from metrics import UPSTREAM_SECONDS, UPSTREAM_ERRORS
+from market_hours import MARKET_TZ, SESSION, WEEKMASK
+
+
+class RateLimited(RuntimeError):
+    """
+    ياهو رفضت طلبات بعض الرموز (429) - yf.download تبتلع الخطأ وتعيد أعمدة فارغة
+
+    Attributes:
+        partial: أعمدة الرموز التي وصلت (None إذا لم يصل شيء)
+        missing: الرموز المرفوضة أو الفارغة
+    """
+
+    def __init__(self, message, partial=None, missing=()):
+        super().__init__(message)
+        self.partial = partial
+        self.missing = list(missing)
+
+
+class EmptyDownload(RuntimeError):
+    """كل رموز طلب متعدد الرموز عادت بدون بيانات (تعطل في المصدر وليس رموزاً غير موجودة)"""
+
+
+def is_empty(value):
+    """إطار بيانات فارغ أو كل قيمه NaN (نتيجة فاشلة لا تُحفظ في أي كاش)"""
+    return isinstance(value, pd.DataFrame) and (value.empty or bool(value.isna().all().all()))
+
+
+# ---------- الواجهة ----------
+class MarketDataProvider:
+    """
+    واجهة المزود: دوال تكرتشارت (الأسعار اللحظية والعمق) ودوال ياهو (الشموع)
+    الدالة غير المدعومة ترفع NotImplementedError
+    """
+
+    name = 'unknown'
+    BAR_METHODS = ('download', 'history')
+
+    def source(self, method):
+        """اسم المصدر الذي يخدم الدالة (لتسميات المقاييس)"""
+        return self.name
+
+    def connect(self):
+        pass
+
+    def get_individual_stock(self, symbol):
+        """آخر سعر لسهم بصيغة تكرتشارت: current, change, change_percent, volume, high, low, open ..."""
+        raise NotImplementedError
+
+    def get_market_depth(self, symbol):
+        """عمق السوق بصيغة تكرتشارت: {'bids': [{'price', 'quantity'}...], 'asks': [...]}"""
+        raise NotImplementedError
+
+    def get_historical_data(self, symbol, period):
+        """شموع يومية بصيغة تكرتشارت: قائمة {'date', 'open', 'high', 'low', 'close', 'volume'}"""
+        raise NotImplementedError
+
+    def get_all_stocks(self):
+        raise NotImplementedError
+
+    def subscribe(self, symbols, handler):
+        """بث مستمر: handler(quote) مع كل تحديث"""
+        raise NotImplementedError
+
+    def download(self, tickers, **kwargs):
+        """شموع عدة رموز كإطار عريض بأعمدة (الحقل، الرمز) بنفس صيغة yf.download"""
+        raise NotImplementedError
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        """شموع رمز واحد بنفس صيغة yf.Ticker.history"""
+        raise NotImplementedError
+
+
+class TkShareProvider(MarketDataProvider):
+    """تكرتشارت لايف (tkrtshare)"""
+
+    name = 'tkrtshare'
+
+    def __init__(self):
+        from tkrtshare import tk
+        self.tk = tk.TkShare()
+
+    def connect(self):
+        return self.tk.connect()
+
+    def get_individual_stock(self, symbol):
+        return self.tk.get_individual_stock(symbol)
+
+    def get_market_depth(self, symbol):
+        return self.tk.get_market_depth(symbol)
+
+    def get_historical_data(self, symbol, period):
+        return self.tk.get_historical_data(symbol, period)
+
+    def get_all_stocks(self):
+        return self.tk.get_all_stocks()
+
+    def subscribe(self, symbols, handler):
+        return self.tk.subscribe(symbols, handler)
+
+
+class _ThreadErrors(logging.Handler):
+    """أخطاء مسجل yfinance الصادرة من الخيط الحالي فقط"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.messages = []
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.messages.append(record.getMessage())
+
+
+def _missing_tickers(frame, tickers):
+    """الرموز التي ليس لها أي سعر إغلاق في نتيجة yf.download"""
+    if frame is None or frame.empty or 'Close' not in frame.columns.get_level_values(0):
+        return list(tickers)
+    close = frame['Close']
+    if not isinstance(close, pd.DataFrame):
+        return [] if close.notna().any() else list(tickers)
+    present = {str(t).upper() for t in close.columns[close.notna().any().to_numpy()]}
+    return [t for t in tickers if t.upper() not in present]
+
+
+class YFinanceProvider(MarketDataProvider):
+    """ياهو فاينانس (yfinance) عبر جلسة HTTP المشتركة، مع كاش الاستعلامات الاختياري (http_session.py)"""
+
+    name = 'yahoo'
+    THROTTLE_MARKERS = ('YFRateLimitError', 'Too Many Requests', 'Rate limited')
+
+    def __init__(self, session=None, cache=None, client=None):
+        """
+        Args:
+            cache: كاش الاستعلامات (False لتعطيله، None للإعداد من HTTP_CACHE_TTL)
+            client: وحدة yfinance أو بديل بنفس الواجهة (download و Ticker) - للاختبار والقياس
+        """
+        import http_session
+        if client is None:
+            import yfinance as client
+            session = session or http_session.shared()
+        self.yf = client
+        self.session = session
+        self.cache = cache if cache is not None else http_session.cache
+
+    @contextmanager
+    def _errors(self):
+        """
+        yfinance لا ترفع أخطاء الرموز داخل yf.download (ولا خطأ المنطقة الزمنية في history)
+        وتكتفي بتسجيلها، فتُلتقط من المسجل حتى يظهر التقييد لطبقة upstream.py
+        """
+        handler = _ThreadErrors()
+        logger = logging.getLogger('yfinance')
+        logger.addHandler(handler)
+        try:
+            yield handler.messages
+        finally:
+            logger.removeHandler(handler)
+
+    def _check(self, frame, tickers, messages):
+        missing = _missing_tickers(frame, tickers)
+        if not missing:
+            return frame
+        throttled = [m for m in messages if any(marker in m for marker in self.THROTTLE_MARKERS)]
+        if throttled:
+            partial = None
+            if len(missing) < len(tickers) and isinstance(frame.columns, pd.MultiIndex):
+                rejected = {t.upper() for t in missing}
+                partial = frame.loc[:, [str(t).upper() not in rejected for t in frame.columns.get_level_values(1)]]
+            raise RateLimited(f"429 Too Many Requests: {len(missing)}/{len(tickers)} رمز بدون بيانات ({throttled[0][:120]})",
+                              partial=partial, missing=missing)
+        # رمز واحد بدون بيانات قد يكون رمزاً غير موجود - يعود الإطار الفارغ كما هو
+        if len(tickers) > 1 and len(missing) == len(tickers):
+            detail = f" ({messages[-1][:120]})" if messages else ''
+            raise EmptyDownload(f"لا توجد بيانات لأي من {len(tickers)} رمز{detail}")
+        return frame
+
+    def _cached(self, method, args, fetch):
+        if not self.cache:
+            return fetch()
+        key = _key(method, args)
+        frame = self.cache.get(key)
+        if frame is None:
+            frame = fetch()
+            if not is_empty(frame):
+                self.cache.put(key, frame)
+        return frame
+
+    def _download(self, tickers, **kwargs):
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        with self._errors() as messages:
+            frame = self.yf.download(tickers, session=self.session, **kwargs)
+        return self._check(frame, tickers, messages)
+
+    def _history(self, ticker, period, interval):
+        with self._errors() as messages:
+            frame = self.yf.Ticker(ticker, session=self.session).history(period=period, interval=interval)
+        return self._check(frame, [ticker], messages)
+
+    def download(self, tickers, **kwargs):
+        return self._cached('download', [tickers, kwargs], lambda: self._download(tickers, **kwargs))
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self._cached('history', [ticker, period, interval], lambda: self._history(ticker, period, interval))
+
+
+class LiveProvider(MarketDataProvider):
+    """
+    المصادر الحقيقية: تكرتشارت للأسعار اللحظية وياهو للشموع
+    (كل مصدر يُحمّل عند أول استخدام، فغياب tkrtshare لا يمنع الجلب من ياهو)
+    """
+
+    def __init__(self):
+        self._quotes = None
+        self._bars = None
+
+    def source(self, method):
+        return YFinanceProvider.name if method in self.BAR_METHODS else TkShareProvider.name
+
+    @property
+    def quotes(self):
+        if self._quotes is None:
+            self._quotes = TkShareProvider()
+        return self._quotes
+
+    @property
+    def bars(self):
+        if self._bars is None:
+            self._bars = YFinanceProvider()
+        return self._bars
+
+    def connect(self):
+        return self.quotes.connect()
+
+    def get_individual_stock(self, symbol):
+        return self.quotes.get_individual_stock(symbol)
+
+    def get_market_depth(self, symbol):
+        return self.quotes.get_market_depth(symbol)
+
+    def get_historical_data(self, symbol, period):
+        return self.quotes.get_historical_data(symbol, period)
+
+    def get_all_stocks(self):
+        return self.quotes.get_all_stocks()
+
+    def subscribe(self, symbols, handler):
+        return self.quotes.subscribe(symbols, handler)
+
+    def download(self, tickers, **kwargs):
+        return self.bars.download(tickers, **kwargs)
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self.bars.history(ticker, period=period, interval=interval)
+
+
+# ---------- صيغة ملف التسجيل ----------
+# سجل = ترويسة (الوقت، طول المحتوى) + JSON مضغوط: [الدالة، المعاملات، النتيجة، الخطأ]
+MAGIC = b'TDREC1\n'
+RECORD_HEADER = struct.Struct('<dI')
+
+
+def _encode(value):
+    """تحويل النتيجة لقيمة JSON (إطارات البيانات بصيغة مضغوطة: فهرس، أعمدة، قيم)"""
+    if isinstance(value, pd.DataFrame):
+        index = value.index
+        return {'__frame__': {
+            'index': index.as_unit('ns').asi8.tolist() if isinstance(index, pd.DatetimeIndex) else index.tolist(),
+            'tz': str(index.tz) if getattr(index, 'tz', None) is not None else None,
+            'unit': getattr(index, 'unit', 'ns'),
+            'datetime': isinstance(index, pd.DatetimeIndex),
+            'names': [index.name, list(value.columns.names)],
+            'columns': [list(c) if isinstance(c, tuple) else c for c in value.columns],
+            'data': value.to_numpy(dtype=object).tolist(),
+        }}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(value)
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        frame = value.get('__frame__')
+        if frame is None:
+            return {k: _decode(v) for k, v in value.items()}
+        columns = frame['columns']
+        if columns and isinstance(columns[0], list):
+            columns = pd.MultiIndex.from_tuples([tuple(c) for c in columns])
+        index = frame['index']
+        if frame['datetime']:
+            index = pd.DatetimeIndex(np.array(index, dtype='datetime64[ns]')).as_unit(frame['unit'])
+            if frame['tz']:
+                index = index.tz_localize('UTC').tz_convert(frame['tz'])
+        result = pd.DataFrame(frame['data'], index=index, columns=columns).infer_objects()
+        result.index.name, result.columns.names = frame['names']
+        return result
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _key(method, args):
+    return method + json.dumps(_encode(args), sort_keys=True, default=str)
+
+
+def read_records(path):
+    """
+    قراءة ملف تسجيل
+
+    Yields:
+        (الوقت، الدالة، المعاملات، النتيجة، الخطأ)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"ملف تسجيل غير صالح: {path}")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, length = RECORD_HEADER.unpack(header)
+            blob = f.read(length)
+            if len(blob) < length:
+                return  # سجل أخير غير مكتمل (توقف التسجيل أثناء الكتابة)
+            method, args, result, error = json.loads(zlib.decompress(blob))
+            yield timestamp, method, args, result, error
+
+
+class RecordingProvider(MarketDataProvider):
+    """
+    يمرر الطلبات لمزود حقيقي ويسجل كل استجابة (أو خطأ) في ملف إلحاقي
+    """
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.records = 0
+        self.source = inner.source
+        self._lock = threading.Lock()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+
+    def _write(self, method, args, result, error=None):
+        blob = zlib.compress(json.dumps([method, _encode(args), _encode(result), error],
+                                        default=str).encode('utf-8'))
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(RECORD_HEADER.pack(time.time(), len(blob)) + blob)
+            self.records += 1
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            result = getattr(self.inner, method)(*args, **kwargs)
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            self._write(method, [args, kwargs], None, str(e))
+            raise
+        self._write(method, [args, kwargs], result)
+        return result
+
+    def connect(self):
+        return self.inner.connect()
+
+    def get_individual_stock(self, symbol):
+        return self._call('get_individual_stock', symbol)
+
+    def get_market_depth(self, symbol):
+        return self._call('get_market_depth', symbol)
+
+    def get_historical_data(self, symbol, period):
+        return self._call('get_historical_data', symbol, period)
+
+    def get_all_stocks(self):
+        return self._call('get_all_stocks')
+
+    def subscribe(self, symbols, handler):
+        def recorded(quote):
+            self._write('stream', [[quote.get('symbol')], {}], quote)
+            handler(quote)
+        return self.inner.subscribe(symbols, recorded)
+
+    def download(self, tickers, **kwargs):
+        return self._call('download', tickers, **kwargs)
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self._call('history', ticker, period=period, interval=interval)
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    إعادة جلسة مسجلة: كل طلب يعيد آخر استجابة مسجلة لنفس الطلب حتى لحظة الإعادة الحالية
+
+    speed=1 بنفس التوقيت الأصلي، N أسرع N مرة، None (max) بدون انتظار:
+    كل طلب يعيد الاستجابة التالية لنفس الطلب بالترتيب
+    """
+
+    name = 'replay'
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.calls = {}   # مفتاح الطلب -> (الأوقات، النتائج)
+        self.stream = []  # (الوقت، الرمز، السعر) لتحديثات البث المسجلة
+        for timestamp, method, args, result, error in read_records(path):
+            times, results = self.calls.setdefault(_key(method, args), ([], []))
+            times.append(timestamp)
+            results.append((result, error))
+            if method in ('stream', 'get_individual_stock') and error is None:
+                self.stream.append((timestamp, args[0][0], result))
+        starts = [times[0] for times, _ in self.calls.values() if times]
+        self.first = min(starts) if starts else 0.0
+        self.last = max((times[-1] for times, _ in self.calls.values() if times), default=self.first)
+        self.cursors = {}
+        self.started = time.monotonic()
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def clock(self):
+        """الوقت الحالي داخل الجلسة المسجلة"""
+        elapsed = (time.monotonic() - self.started) * self.speed
+        duration = self.last - self.first
+        if self.loop and duration > 0:
+            elapsed %= duration
+        return self.first + elapsed
+
+    def _replay(self, method, args):
+        key = _key(method, args)
+        entry = self.calls.get(key)
+        if entry is None:
+            self.misses += 1
+            raise LookupError(f"لا يوجد تسجيل للطلب {method}{args[0]}")
+        times, results = entry
+        if self.speed is None:
+            with self._lock:
+                position = self.cursors.get(key, 0)
+                self.cursors[key] = (position + 1) % len(results) if self.loop else min(position + 1, len(results) - 1)
+        else:
+            position = max(bisect.bisect_right(times, self.clock()) - 1, 0)
+        result, error = results[position]
+        if error is not None:
+            raise RuntimeError(error)
+        return _decode(result)
+
+    def get_individual_stock(self, symbol):
+        return self._replay('get_individual_stock', [[symbol], {}])
+
+    def get_market_depth(self, symbol):
+        return self._replay('get_market_depth', [[symbol], {}])
+
+    def get_historical_data(self, symbol, period):
+        return self._replay('get_historical_data', [[symbol, period], {}])
+
+    def get_all_stocks(self):
+        return self._replay('get_all_stocks', [[], {}])
+
+    def download(self, tickers, **kwargs):
+        return self._replay('download', [[tickers], kwargs])
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self._replay('history', [[ticker], {'period': period, 'interval': interval}])
+
+    def subscribe(self, symbols, handler):
+        """إعادة تحديثات الرموز المطلوبة بتوقيتها المسجل (مقسوماً على السرعة) في خيط خلفي"""
+        wanted = set(symbols)
+        events = [(t, quote) for t, symbol, quote in self.stream if symbol in wanted]
+
+        def run():
+            while True:
+                previous = events[0][0] if events else 0
+                for timestamp, quote in events:
+                    if self.speed:
+                        time.sleep(max(0.0, (timestamp - previous) / self.speed))
+                    previous = timestamp
+                    handler(_decode(quote))
+                if not self.loop or not events:
+                    return
+
+        threading.Thread(target=run, name='replay-stream', daemon=True).start()
+
+
+# ---------- المولد التركيبي ----------
+PERIOD_DAYS = {'d': 1, 'wk': 7, 'mo': 30, 'y': 365}
+INTERVAL_SECONDS = {'m': 60, 'h': 3600, 'd': 86400, 'wk': 7 * 86400}
+
+
+def _parse(value, units):
+    """'60d' / '1mo' / '15m' -> (العدد، الوحدة)"""
+    for unit in sorted(units, key=len, reverse=True):
+        if value.endswith(unit) and value[:-len(unit)].isdigit():
+            return int(value[:-len(unit)]), unit
+    raise ValueError(f"قيمة غير مدعومة: {value}")
+
+
+class SyntheticProvider(MarketDataProvider):
+    """
+    أسعار عشوائية (random walk) لكل الشركات بدون شبكة، بمعدل تحديثات قابل للضبط لكل رمز
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, symbols, rate=1.0, volatility=0.002, seed=None):
+        """
+        Args:
+            symbols: الرموز المحاكاة
+            rate: متوسط التحديثات في الثانية لكل رمز (رقم أو قاموس {الرمز: المعدل})
+            volatility: الانحراف المعياري لتغير السعر في التحديث الواحد
+        """
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        n = len(self.symbols)
+        self.rate = np.array([rate.get(s, 1.0) for s in self.symbols] if isinstance(rate, dict)
+                             else np.full(n, float(rate)))
+        self.volatility = volatility
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.prev_close = np.round(self.rng.uniform(10, 150, n), 2)
+        self.prev_close[[s.startswith('^') for s in self.symbols]] = 11000.0  # المؤشرات
+        self.price = self.prev_close.copy()
+        self.open = self.price.copy()
+        self.high = self.price.copy()
+        self.low = self.price.copy()
+        self.volume = np.zeros(n, dtype=np.int64)
+        self.updated = np.full(n, time.time())
+        self.ticks = 0
+        self._lock = threading.Lock()
+
+    def _advance(self, i, now=None):
+        """تطبيق عدد التحديثات المتوقع منذ آخر قراءة للرمز"""
+        now = time.time() if now is None else now
+        count = self.rng.poisson(self.rate[i] * max(0.0, now - self.updated[i]))
+        self.updated[i] = now
+        if count == 0:
+            return
+        step = self.rng.normal(0, self.volatility * np.sqrt(count))
+        self.price[i] = max(0.01, round(self.price[i] * np.exp(step), 2))
+        self.high[i] = max(self.high[i], self.price[i])
+        self.low[i] = min(self.low[i], self.price[i])
+        self.volume[i] += int(self.rng.integers(1, 50, count).sum()) * 10
+        self.ticks += int(count)
+
+    def _quote(self, i):
+        price, prev = float(self.price[i]), float(self.prev_close[i])
+        return {
+            'symbol': self.symbols[i],
+            'current': price,
+            'change': round(price - prev, 2),
+            'change_percent': round((price - prev) / prev * 100, 2),
+            'volume': int(self.volume[i]),
+            'high': float(self.high[i]),
+            'low': float(self.low[i]),
+            'open': float(self.open[i]),
+            'previous_close': prev,
+            'bid': round(price - 0.01, 2),
+            'ask': round(price + 0.01, 2),
+            'orders': [],
+        }
+
+    def _row(self, symbol):
+        i = self.index.get(symbol)
+        if i is None and symbol.endswith('.SR'):
+            i = self.index.get(symbol[:-3])
+        if i is None:
+            raise LookupError(f"رمز غير معروف: {symbol}")
+        return i
+
+    def get_individual_stock(self, symbol):
+        i = self._row(symbol)
+        with self._lock:
+            self._advance(i)
+            return self._quote(i)
+
+    def get_market_depth(self, symbol, levels=10):
+        i = self._row(symbol)
+        with self._lock:
+            self._advance(i)
+            price = float(self.price[i])
+            quantities = self.rng.integers(1, 50, 2 * levels) * 100
+        return {
+            'bids': [{'price': round(price - 0.01 * (k + 1), 2), 'quantity': int(quantities[k])}
+                     for k in range(levels)],
+            'asks': [{'price': round(price + 0.01 * (k + 1), 2), 'quantity': int(quantities[levels + k])}
+                     for k in range(levels)],
+        }
+
+    def get_all_stocks(self):
+        with self._lock:
+            return [self._quote(i) for i in range(len(self.symbols))]
+
+    def subscribe(self, symbols, handler):
+        """تحديثات بالمعدل المحدد لكل رمز في خيط خلفي"""
+        rows = [self._row(s) for s in symbols]
+        total = float(self.rate[rows].sum()) if rows else 0.0
+        if total <= 0:
+            return
+        weights = self.rate[rows] / total
+
+        def run():
+            while True:
+                time.sleep(self.rng.exponential(1 / total))
+                with self._lock:
+                    i = rows[self.rng.choice(len(rows), p=weights)]
+                    self._advance(i)
+                    quote = self._quote(i)
+                handler(quote)
+
+        threading.Thread(target=run, name='synthetic-stream', daemon=True).start()
+
+    # ---------- الشموع ----------
+    def _times(self, period=None, interval='1d', start=None):
+        now = pd.Timestamp.now(tz=MARKET_TZ)
+        last_day = now.tz_localize(None).normalize()
+        if start is not None:
+            days = pd.bdate_range(pd.Timestamp(start), last_day, freq='C', weekmask=WEEKMASK)
+        else:
+            count, unit = _parse(period or '1mo', PERIOD_DAYS)
+            if unit == 'd':  # '5d' = آخر 5 أيام تداول كما في ياهو
+                days = pd.bdate_range(end=last_day, periods=count, freq='C', weekmask=WEEKMASK)
+            else:
+                first = last_day - pd.Timedelta(days=count * PERIOD_DAYS[unit])
+                days = pd.bdate_range(first, last_day, freq='C', weekmask=WEEKMASK)
+        count, unit = _parse(interval, INTERVAL_SECONDS)
+        seconds = count * INTERVAL_SECONDS[unit]
+        if seconds >= 86400:
+            return days.tz_localize(MARKET_TZ)
+        opens, closes = (pd.Timedelta(t + ':00') for t in SESSION)
+        offsets = np.arange(opens.value, closes.value, seconds * 10 ** 9).astype('timedelta64[ns]')
+        times = (days.values[:, None] + offsets[None, :]).ravel()
+        times = pd.DatetimeIndex(times).tz_localize(MARKET_TZ)
+        return times[times <= now]
+
+    def _bars(self, symbol, times):
+        """شموع تنتهي عند السعر الحالي (مسار عشوائي ثابت لكل رمز)"""
+        i = self._row(symbol)
+        rng = np.random.default_rng([zlib.crc32(self.symbols[i].encode()), len(times), self.seed or 0])
+        n = len(times)
+        steps = rng.normal(0, self.volatility * 4, n)
+        # لوغاريتم السعر عند كل شمعة = السعر الحالي ناقص مجموع التغيرات التي بعدها
+        after = steps[::-1].cumsum()[::-1] - steps
+        close = np.round(float(self.price[i]) * np.exp(-after), 2)
+        open_ = np.round(np.r_[close[:1], close[:-1]], 2)
+        spread = np.abs(rng.normal(0, self.volatility, n)) * close
+        return pd.DataFrame({
+            'Open': open_,
+            'High': np.round(np.maximum(open_, close) + spread, 2),
+            'Low': np.round(np.minimum(open_, close) - spread, 2),
+            'Close': close,
+            'Volume': rng.integers(10_000, 2_000_000, n).astype(float),
+        }, index=pd.DatetimeIndex(times, name='Date'))
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self._bars(ticker, self._times(period, interval))
+
+    def get_historical_data(self, symbol, period):
+        bars = self._bars(symbol, self._times(period, '1d'))
+        return [{'date': date.strftime('%Y-%m-%d'), 'open': row.Open, 'high': row.High,
+                 'low': row.Low, 'close': row.Close, 'volume': row.Volume}
+                for date, row in zip(bars.index, bars.itertuples(index=False))]
+
+    def download(self, tickers, period=None, interval='1d', start=None, **kwargs):
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        times = self._times(period, interval, start)
+        frames = {t: self._bars(t, times) for t in tickers if t in self.index or t[:-3] in self.index}
+        if not frames:
+            return pd.DataFrame()
+        wide = pd.concat(frames, axis=1)  # (الرمز، الحقل)
+        return wide.swaplevel(axis=1).sort_index(axis=1)
+
+
+# ---------- المقاييس ----------
+class InstrumentedProvider(MarketDataProvider):
+    """
+    يقيس زمن كل طلب للمزود الداخلي ويعد الأخطاء حسب المصدر والدالة (metrics.py)
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.source = inner.source
+        self.listeners = []  # دوال تستقبل (المصدر، الدالة، الزمن) بعد كل طلب
+
+    def _call(self, method, *args, **kwargs):
+        source = self.inner.source(method)
+        started = time.perf_counter()
+        try:
+            return getattr(self.inner, method)(*args, **kwargs)
+        except NotImplementedError:
+            raise
+        except Exception:
+            UPSTREAM_ERRORS.inc(source=source, method=method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPSTREAM_SECONDS.observe(elapsed, source=source, method=method)
+            for callback in self.listeners:
+                callback(source, method, elapsed)
+
+    def connect(self):
+        return self._call('connect')
+
+    def get_individual_stock(self, symbol):
+        return self._call('get_individual_stock', symbol)
+
+    def get_market_depth(self, symbol):
+        return self._call('get_market_depth', symbol)
+
+    def get_historical_data(self, symbol, period):
+        return self._call('get_historical_data', symbol, period)
+
+    def get_all_stocks(self):
+        return self._call('get_all_stocks')
+
+    def subscribe(self, symbols, handler):
+        return self.inner.subscribe(symbols, handler)
+
+    def download(self, tickers, **kwargs):
+        return self._call('download', tickers, **kwargs)
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self._call('history', ticker, period=period, interval=interval)
+
+
+# ---------- الاختيار من الإعدادات ----------
+def from_spec(spec, symbols=()):
+    """
+    إنشاء مزود من نص الإعداد (انظر أعلى الملف)
+
+    Args:
+        spec: live | record:<ملف> | replay:<ملف>[:<السرعة>|max] | synthetic[:<المعدل>]
+        symbols: الرموز المحاكاة في الوضع التركيبي
+    """
+    kind, _, rest = (spec or 'live').partition(':')
+    if kind == 'live':
+        return LiveProvider()
+    if kind == 'record':
+        return RecordingProvider(LiveProvider(), rest or 'market_session.rec')
+    if kind == 'replay':
+        path, speed = rest, '1'
+        head, _, tail = rest.rpartition(':')
+        if head and (tail == 'max' or tail.replace('.', '', 1).isdigit()):
+            path, speed = head, tail
+        return ReplayProvider(path, speed=None if speed == 'max' else float(speed))
+    if kind == 'synthetic':
+        return SyntheticProvider(symbols, rate=float(rest or 1.0))
+    raise ValueError(f"مزود غير معروف: {spec}")
+
+
+def from_env(symbols=()):
+    """المزود المحدد في MARKET_DATA (المصادر الحقيقية افتراضياً) مع قياس زمن طلباته"""
+    return InstrumentedProvider(from_spec(os.environ.get('MARKET_DATA', 'live'), symbols))
@@ -0,0 +1,177 @@
+"""
+فهرس الترتيب (الأعلى ربحاً / خسارة / نشاطاً / حجماً غير اعتيادي)
+ترتيب كامل لكل مفتاح يُحدّث عند تغير اللقطة: إعادة ترتيب كاملة عند تغير أغلب الرموز،
+وإزالة وإدراج بالبحث الثنائي عند تغير رموز قليلة فقط؛ قراءة أفضل K تكون O(K)
+"""
+
+import threading
+import numpy as np
+
+# مفاتيح الترتيب (كلها تنازلياً)
+KEYS = ('change_percent', 'volume', 'value', 'volume_ratio')
+
+# القوائم المتاحة: (المفتاح، من الأعلى؟، شرط القيمة)
+VIEWS = {
+    'gainers': ('change_percent', True, lambda v: v > 0),
+    'losers': ('change_percent', False, lambda v: v < 0),
+    'most_active': ('volume', True, lambda v: v > 0),
+    'top_value': ('value', True, lambda v: v > 0),
+    'unusual_volume': ('volume_ratio', True, lambda v: v >= 2),
+}
+
+
+class SortedKey:
+    """
+    ترتيب الرموز حسب مفتاح واحد: order[i] معرّف الرمز في المرتبة i،
+    و sorted_values القيم المقابلة (سالبة القيمة ليكون الترتيب تصاعدياً)؛ القيم المفقودة في النهاية
+    """
+
+    __slots__ = ('order', 'sorted_values', 'ranked', 'valid')
+
+    def __init__(self, values):
+        self.rebuild(values)
+
+    def rebuild(self, values):
+        keys = np.where(np.isnan(values), np.inf, -values)
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_values = keys[self.order]
+        self.ranked = values.copy()  # قيمة كل رمز كما هي في الترتيب الحالي
+        self.valid = int(np.count_nonzero(~np.isnan(values)))
+
+    def changed(self, ids, values):
+        """الرموز التي تختلف قيمتها الحالية عن قيمتها في الترتيب"""
+        old, new = self.ranked[ids], values[ids]
+        return ids[~((old == new) | (np.isnan(old) & np.isnan(new)))]
+
+    def move(self, row, new):
+        """نقل رمز واحد من موضعه القديم إلى الجديد (حذف ثم إدراج بالبحث الثنائي)"""
+        old = self.ranked[row]
+        old_key = np.inf if np.isnan(old) else -old
+        new_key = np.inf if np.isnan(new) else -new
+        lo = int(np.searchsorted(self.sorted_values, old_key, side='left'))
+        hi = int(np.searchsorted(self.sorted_values, old_key, side='right'))
+        position = lo + int(np.flatnonzero(self.order[lo:hi] == row)[0])
+        order = np.delete(self.order, position)
+        values = np.delete(self.sorted_values, position)
+        target = int(np.searchsorted(values, new_key, side='right'))
+        self.order = np.insert(order, target, row)
+        self.sorted_values = np.insert(values, target, new_key)
+        self.ranked[row] = new
+        self.valid += int(not np.isnan(new)) - int(not np.isnan(old))
+
+
+class RankingIndex:
+    """
+    ترتيبات السوق كاملة لجميع الرموز
+    """
+
+    def __init__(self, symbols, incremental_limit=16):
+        """
+        Args:
+            symbols: الرموز المرتبة
+            incremental_limit: أقصى عدد رموز متغيرة يُحدّث لها الترتيب تزايدياً؛ ما زاد يُعاد ترتيبه كاملاً
+        """
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.incremental_limit = incremental_limit
+        n = len(self.symbols)
+        self.values = {key: np.full(n, np.nan) for key in KEYS + ('last', 'change')}
+        self.baseline_volume = np.full(n, np.nan)  # متوسط الحجم التاريخي لكل رمز
+        self.rows = [None] * n
+        self.sorted = {key: SortedKey(self.values[key]) for key in KEYS}
+        self.stats = {'full_rebuilds': 0, 'incremental_updates': 0}
+        self._lock = threading.Lock()
+
+    def set_baseline(self, volume_means):
+        """تحديد متوسط الحجم لكل رمز (بنفس ترتيب symbols) لحساب الحجم غير الاعتيادي"""
+        with self._lock:
+            self.baseline_volume = np.asarray(volume_means, dtype=float)
+            self._apply(np.arange(len(self.symbols)), {})
+
+    def update_rows(self, rows):
+        """تحديث من صفوف لقطة السوق (market_data) - يُعاد ترتيب الرموز المتغيرة فقط"""
+        ids = np.fromiter((self.index.get(r['symbol'], -1) for r in rows), dtype=np.int64, count=len(rows))
+        known = ids >= 0
+        rows = [r for r, k in zip(rows, known) if k]
+        ids = ids[known]
+        fields = {f: np.fromiter((r.get(f, np.nan) for r in rows), dtype=float, count=len(rows))
+                  for f in ('last', 'change', 'change_percent', 'volume')}
+        with self._lock:
+            for i, row in zip(ids, rows):
+                self.rows[i] = row
+            self._apply(ids, fields)
+
+    def update_tick(self, symbol, last, change, change_percent, volume):
+        """تحديث رمز واحد من البث المباشر"""
+        i = self.index.get(symbol)
+        if i is None:
+            return
+        fields = {'last': np.array([last], dtype=float), 'change': np.array([change], dtype=float),
+                  'change_percent': np.array([change_percent], dtype=float),
+                  'volume': np.array([volume], dtype=float)}
+        with self._lock:
+            self._apply(np.array([i]), fields)
+
+    def _apply(self, ids, fields):
+        values = self.values
+        for field, new in fields.items():
+            values[field][ids] = new
+        values['value'][ids] = values['last'][ids] * values['volume'][ids]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            baseline = self.baseline_volume[ids]
+            values['volume_ratio'][ids] = np.where(baseline > 0, values['volume'][ids] / baseline, np.nan)
+
+        for key in KEYS:
+            ranked = self.sorted[key]
+            changed = ranked.changed(ids, values[key])
+            if len(changed) == 0:
+                continue
+            if len(changed) > self.incremental_limit:
+                ranked.rebuild(values[key])
+                self.stats['full_rebuilds'] += 1
+            else:
+                for i in changed:
+                    ranked.move(i, values[key][i])
+                self.stats['incremental_updates'] += len(changed)
+
+    def top(self, view, count=10):
+        """
+        أفضل count رمز في القائمة (O(count))
+
+        Returns:
+            صفوف اللقطة مع آخر قيم حية وقيمة مفتاح الترتيب
+        """
+        key, descending, accept = VIEWS[view]
+        with self._lock:
+            ranked = self.sorted[key]
+            if descending:
+                candidates = ranked.order[:min(count, ranked.valid)]
+            else:
+                candidates = ranked.order[max(ranked.valid - count, 0):ranked.valid][::-1]
+
+            result = []
+            for i in candidates:
+                value = self.values[key][i]
+                if not accept(value):
+                    break
+                if self.rows[i] is None:
+                    continue
+                result.append(self._row(i))
+            return result
+
+    def rows_for(self, symbols):
+        """صفوف رموز محددة بآخر القيم الحية، بنفس الترتيب (None للرمز بدون بيانات)"""
+        with self._lock:
+            ids = (self.index.get(s) for s in symbols)
+            return [self._row(i) if i is not None and self.rows[i] is not None else None for i in ids]
+
+    def _row(self, i):
+        values = self.values
+        return dict(self.rows[i],
+                    last=round(float(values['last'][i]), 2),
+                    change=round(float(values['change'][i]), 2),
+                    change_percent=round(float(values['change_percent'][i]), 2),
+                    volume=int(np.nan_to_num(values['volume'][i])),
+                    value_traded=round(float(np.nan_to_num(values['value'][i])), 2),
+                    volume_ratio=round(float(values['volume_ratio'][i]), 2)
+                    if not np.isnan(values['volume_ratio'][i]) else None)
@@ -0,0 +1,170 @@
+"""
+فهرس البحث عن الشركات
+يُبنى مرة واحدة من قائمة الشركات: بحث ببادئة الرمز الرقمي، وبالاسم العربي بعد توحيد
+الحروف (الألف والهمزة والتاء المربوطة والتشكيل)، مع تحمل خطأ إملائي واحد (symmetric delete)
+"""
+
+import bisect
+import re
+from functools import lru_cache
+
+# التشكيل والتطويل
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي',
+})
+_SEPARATORS = re.compile(r'[^\w]+')
+
+# درجات الترتيب (الأعلى أولاً)
+SCORE_EXACT_CODE = 100
+SCORE_CODE_PREFIX = 80
+SCORE_EXACT_NAME = 70
+SCORE_TOKEN = 50
+SCORE_PREFIX = 40
+SCORE_FUZZY = 20
+
+
+def normalize(text):
+    """توحيد النص العربي للمقارنة: حذف التشكيل وتوحيد أشكال الألف والهمزة والتاء المربوطة"""
+    text = _DIACRITICS.sub('', str(text).lower()).translate(_FOLD)
+    return ' '.join(_SEPARATORS.sub(' ', text).split())
+
+
+def strip_article(token):
+    """حذف "ال" أو "لل" من بداية الكلمة"""
+    if len(token) > 3 and token.startswith(('ال', 'لل')):
+        return token[2:]
+    return token
+
+
+def tokens(text):
+    """كلمات النص الموحد، مع نسخة بدون أداة التعريف"""
+    result = []
+    for token in normalize(text).split():
+        result.append(token)
+        if strip_article(token) != token:
+            result.append(strip_article(token))
+    return result
+
+
+def _deletes(word):
+    """جميع النسخ بحذف حرف واحد"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _within_one_edit(a, b):
+    """هل المسافة بين الكلمتين تعديل واحد على الأكثر (إضافة/حذف/استبدال/تبديل متجاورين)"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                   and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    return any(b[:i] + b[i + 1:] == a for i in range(len(b)))
+
+
+class SearchIndex:
+    """
+    فهرس ثابت للبحث بالرمز والاسم
+    """
+
+    def __init__(self, companies, min_fuzzy_length=4, cache_size=2048):
+        """
+        Args:
+            companies: قاموس {الرمز: {'name', ...}}
+            min_fuzzy_length: أقل طول كلمة يُسمح فيه بخطأ إملائي
+            cache_size: عدد الاستعلامات المحفوظة نتائجها
+        """
+        self.symbols = list(companies)
+        self.min_fuzzy_length = min_fuzzy_length
+        self.codes = sorted((symbol.lower(), i) for i, symbol in enumerate(self.symbols))
+        self.code_keys = [code for code, _ in self.codes]
+        self.names = [normalize(info.get('name', '')) for info in companies.values()]
+
+        self.token_ids = {}   # الكلمة -> الشركات
+        self.prefix_ids = {}  # بادئة الكلمة -> الشركات
+        self.deletes = {}     # نسخة بحذف حرف -> الكلمات الأصلية
+        for i, info in enumerate(companies.values()):
+            for token in tokens(info.get('name', '')):
+                self.token_ids.setdefault(token, set()).add(i)
+                for end in range(1, len(token) + 1):
+                    self.prefix_ids.setdefault(token[:end], set()).add(i)
+        for token in self.token_ids:
+            if len(token) >= self.min_fuzzy_length:
+                for variant in _deletes(token):
+                    self.deletes.setdefault(variant, set()).add(token)
+
+        self._search = lru_cache(maxsize=cache_size)(self._search_normalized)
+
+    def _code_matches(self, query):
+        lo = bisect.bisect_left(self.code_keys, query)
+        hi = bisect.bisect_left(self.code_keys, query + '\uffff')
+        return {i: SCORE_EXACT_CODE if self.code_keys[k] == query else SCORE_CODE_PREFIX
+                for k, (_, i) in enumerate(self.codes[lo:hi], start=lo)}
+
+    def _fuzzy_tokens(self, word):
+        """الكلمات المفهرسة على بعد خطأ إملائي واحد من الكلمة"""
+        if len(word) < self.min_fuzzy_length:
+            return set()
+        candidates = set(self.deletes.get(word, ()))
+        for variant in _deletes(word):
+            candidates |= self.deletes.get(variant, set())
+            if variant in self.token_ids:
+                candidates.add(variant)
+        return {c for c in candidates if _within_one_edit(word, c)}
+
+    def _word_matches(self, word, last):
+        """الشركات المطابقة لكلمة واحدة مع درجة كل منها (الكلمة الأخيرة تُطابق كبادئة)"""
+        scores = {}
+        forms = {word, strip_article(word)}
+        for form in forms:
+            for i in self.token_ids.get(form, ()):
+                scores[i] = SCORE_TOKEN
+        if last:
+            for form in forms:
+                for i in self.prefix_ids.get(form, ()):
+                    scores.setdefault(i, SCORE_PREFIX)
+        if not scores:
+            for form in forms:
+                for token in self._fuzzy_tokens(form):
+                    for i in self.token_ids[token]:
+                        scores.setdefault(i, SCORE_FUZZY)
+        return scores
+
+    def _search_normalized(self, query, limit):
+        scores = self._code_matches(query)
+
+        words = query.split()
+        combined = None
+        for n, word in enumerate(words):
+            matches = self._word_matches(word, last=n == len(words) - 1)
+            if combined is None:
+                combined = matches
+            else:
+                combined = {i: combined[i] + s for i, s in matches.items() if i in combined}
+            if not combined:
+                break
+        for i, score in (combined or {}).items():
+            if self.names[i] == query:
+                score += SCORE_EXACT_NAME
+            scores[i] = max(scores.get(i, 0), score)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.symbols[item[0]]))
+        return tuple(self.symbols[i] for i, _ in ranked[:limit])
+
+    def search(self, query, limit=10):
+        """
+        الرموز المطابقة مرتبة حسب قوة التطابق
+
+        Returns:
+            tuple من الرموز
+        """
+        query = normalize(query or '')
+        if not query:
+            return ()
+        return self._search(query, limit)
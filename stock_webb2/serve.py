@@ -0,0 +1,158 @@
+"""
+تشغيل التطبيق للإنتاج
+عملية تحديث واحدة تجلب بيانات السوق وتنشرها في ذاكرة مشتركة (shared_snapshot)،
+وعدة عمليات خادم تتقاسم نفس المنفذ وتقرأ اللقطة منها بدون أي جلب خاص بها
+
+العمال يعملون تحت gunicorn (gthread مع preload) إذا كان مثبتاً،
+وإلا بخادم werkzeug متعدد الخيوط على منفذ مشترك (للتجربة فقط - لا يُنصح به للإنتاج)
+
+    python serve.py --workers 4 --port 8000
+    python serve.py --dev    # خادم Flask واحد للتطوير (السلوك السابق)
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from shared_snapshot import SharedSnapshot, SharedText
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def run_refresher(shm_name, metrics_name):
+    """عملية التحديث: نفس التطبيق بدون خادم، يحدّث الكاش وينشر كل لقطة جديدة ومقاييسه"""
+    os.environ['MARKET_SNAPSHOT_SHM'] = shm_name
+    os.environ['MARKET_METRICS_SHM'] = metrics_name
+    os.environ['MARKET_SNAPSHOT_ROLE'] = 'refresher'
+    import app
+    app.market_cache.start()
+    app.start_live_stream()
+    app.start_event_server()
+    app.start_metrics_publisher()
+    print(f" عملية التحديث تعمل (PID {os.getpid()})")
+    signal.signal(signal.SIGTERM, lambda *_: app.market_cache.stop() or os._exit(0))
+    while True:
+        time.sleep(3600)
+
+
+def run_worker(shm_name, metrics_name, host, port, fd=None):
+    """عملية خادم: تقرأ اللقطة (ومقاييس عملية التحديث) من الذاكرة المشتركة فقط"""
+    os.environ['MARKET_SNAPSHOT_SHM'] = shm_name
+    os.environ['MARKET_METRICS_SHM'] = metrics_name
+    os.environ['MARKET_SNAPSHOT_ROLE'] = 'reader'
+    from werkzeug.serving import make_server
+    import app
+    server = make_server(host, port, app.app, threaded=True, fd=fd)
+    print(f" عامل الخادم يعمل (PID {os.getpid()}) على {host}:{port}")
+    server.serve_forever()
+
+
+def run_gunicorn(shm_name, metrics_name, options):
+    """
+    مدير عمال gunicorn: التطبيق يُحمَّل مرة هنا ثم تتفرع العمال منه (preload_app)،
+    وgunicorn يعيد تشغيل أي عامل يتوقف أو يتجاوز المهلة
+    """
+    os.environ['MARKET_SNAPSHOT_SHM'] = shm_name
+    os.environ['MARKET_METRICS_SHM'] = metrics_name
+    os.environ['MARKET_SNAPSHOT_ROLE'] = 'reader'
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app
+            return app.app
+
+    Server().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تشغيل تطبيق السوق السعودي')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='عدد عمليات الخادم')
+    parser.add_argument('--threads', type=int, default=8, help='خيوط كل عامل تحت gunicorn')
+    parser.add_argument('--dev', action='store_true', help='خادم Flask واحد مع وضع التصحيح')
+    args = parser.parse_args()
+
+    if args.dev:
+        import app
+        app.start_live_stream()
+        app.start_event_server()
+        print(" تم تشغيل المحرك السريع - جميع الشركات جاهزة")
+        app.app.run(debug=True, host=args.host, port=args.port, use_reloader=False)
+        return
+
+    # تقاسم المنفذ بين العمال يحتاج fork؛ بدونه (ويندوز) يعمل عامل واحد
+    can_fork = 'fork' in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if can_fork else 'spawn')
+    workers = args.workers if can_fork else 1
+
+    snapshot = SharedSnapshot.create()
+    shared_metrics = SharedText.create()
+    use_gunicorn = BaseApplication is not None and can_fork
+    listener = None
+    if can_fork and not use_gunicorn:
+        listener = socket.create_server((args.host, args.port), backlog=1024)
+        listener.set_inheritable(True)
+
+    def start(target, *target_args):
+        process = context.Process(target=target, args=target_args, daemon=True)
+        process.start()
+        return process
+
+    def start_worker():
+        if use_gunicorn:
+            host = f'[{args.host}]' if ':' in args.host else args.host
+            return start(run_gunicorn, snapshot.name, shared_metrics.name, {
+                'bind': f'{host}:{args.port}', 'workers': workers, 'worker_class': 'gthread',
+                'threads': args.threads, 'preload_app': True, 'backlog': 1024})
+        if listener is None:
+            return start(run_worker, snapshot.name, shared_metrics.name, args.host, args.port)
+        return start(run_worker, snapshot.name, shared_metrics.name, args.host, args.port, listener.fileno())
+
+    refresher = start(run_refresher, snapshot.name, shared_metrics.name)
+    # تحت gunicorn تُدار العمال من عملية مديره الواحدة
+    pool = [start_worker() for _ in range(1 if use_gunicorn else workers)]
+    if not use_gunicorn:
+        print(" gunicorn غير مثبت - العمال على خادم werkzeug (غير مناسب للإنتاج)")
+    print(f" تم تشغيل المحرك: عملية تحديث و {workers} عامل على المنفذ {args.port} (الذاكرة المشتركة {snapshot.name})")
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    try:
+        # إعادة تشغيل أي عملية تتوقف
+        while not stopping:
+            time.sleep(1)
+            if not refresher.is_alive():
+                print(" توقفت عملية التحديث - إعادة التشغيل")
+                refresher = start(run_refresher, snapshot.name, shared_metrics.name)
+            for i, process in enumerate(pool):
+                if not process.is_alive():
+                    print(f" توقفت عملية الخادم {process.pid} - إعادة التشغيل")
+                    pool[i] = start_worker()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in [refresher] + pool:
+            process.terminate()
+        for process in [refresher] + pool:
+            process.join(timeout=5)
+        if listener is not None:
+            listener.close()
+        for block in (snapshot, shared_metrics):
+            block.close()
+            block.unlink()
+        print(" تم إيقاف المحرك")
+
+
+if __name__ == '__main__':
+    main()
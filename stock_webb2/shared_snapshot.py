@@ -0,0 +1,281 @@
+"""
+لقطة السوق في ذاكرة مشتركة بين العمليات
+عملية تحديث واحدة تكتب اللقطة كأعمدة ثابتة التخطيط (عنصر لكل شركة حسب معرّفها في جدول الرموز)،
+وعمليات الخادم تقرأها مباشرة من نفس الذاكرة؛ الاتساق مضمون بعدّاد تسلسل (seqlock):
+الكاتب يجعله فردياً قبل الكتابة وزوجياً بعدها، والقارئ يعيد القراءة إذا تغير العدّاد أثناءها
+"""
+
+import time
+from datetime import datetime
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# أعمدة اللقطة لكل شركة (present = الشركة موجودة في اللقطة)
+FIELDS = ('present', 'date', 'open', 'high', 'low', 'last', 'prev', 'change', 'change_percent',
+          'volume', 'trades', 'liquidity_ratio', 'updated_at', 'source')
+SUMMARY_FIELDS = FIELDS[1:]
+
+OVERVIEW_FIELDS = ('current', 'change', 'change_percent', 'volume')
+
+# مصدر القيمة يُخزن كرقم (market_state)
+SOURCES = ('yahoo', 'live')
+
+HEADER = np.dtype([
+    ('seq', '<u8'),               # عدّاد التسلسل (فردي = كتابة جارية)
+    ('version', '<u8'),           # إصدار اللقطة (0 = لم تُنشر بعد)
+    ('count', '<u8'),             # عدد الشركات في التخطيط
+    ('last_update', '<f8'),       # وقت التحديث (ثواني يونكس)
+    ('refresh_duration', '<f8'),
+    ('overview', '<f8', (len(OVERVIEW_FIELDS),)),
+    ('status', 'S64'),            # حالة المؤشر العام (UTF-8)
+])
+
+
+def _attach(name):
+    """
+    فتح ذاكرة موجودة بدون تتبعها (العملية المنشئة هي المسؤولة عن حذفها)
+
+    في بايثون < 3.13 يُسجل الفتح لدى resource_tracker المشترك مع العملية الأم في serve.py،
+    والتسجيل المكرر لا يغير شيئاً فيُحذف الاسم مرة واحدة عند unlink
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedSnapshot:
+    """
+    لقطة السوق كمصفوفات NumPy فوق multiprocessing.shared_memory
+    """
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        self.header = np.ndarray((), dtype=HEADER, buffer=shm.buf)
+        self.values = np.ndarray((len(FIELDS), capacity), dtype=np.float64,
+                                 buffer=shm.buf, offset=HEADER.itemsize)
+        self.read_version = 0  # آخر إصدار قرأته هذه العملية
+        self.retries = 0
+
+    @staticmethod
+    def size(capacity):
+        return HEADER.itemsize + len(FIELDS) * capacity * 8
+
+    @classmethod
+    def create(cls, name=None, capacity=1024):
+        """إنشاء الذاكرة المشتركة (عملية التشغيل الرئيسية فقط)"""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(capacity))
+        snapshot = cls(shm, capacity)
+        snapshot.header[()] = np.zeros((), dtype=HEADER)
+        snapshot.values[:] = np.nan
+        return snapshot
+
+    @classmethod
+    def attach(cls, name):
+        """فتح ذاكرة أنشأتها عملية أخرى"""
+        shm = _attach(name)
+        capacity = (shm.size - HEADER.itemsize) // (len(FIELDS) * 8)
+        return cls(shm, capacity)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        self.header = self.values = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    # ---------- الكتابة (عملية التحديث) ----------
+    def publish(self, snapshot, symbol_master):
+        """
+        نشر لقطة MarketCache (مستمع للكاش في عملية التحديث)
+
+        Args:
+            snapshot: لقطة تحتوي summary و market_overview و version و last_update
+            symbol_master: جدول الرموز الذي يحدد موضع كل شركة
+        """
+        n = len(symbol_master)
+        if n > self.capacity:
+            raise ValueError(f"عدد الشركات {n} أكبر من سعة الذاكرة المشتركة {self.capacity}")
+
+        columns = np.full((len(FIELDS), n), np.nan)
+        summary = snapshot.get('summary')
+        if summary is not None and len(summary):
+            ids = symbol_master.ids_of(summary.index)
+            known = ids >= 0
+            ids = ids[known]
+            columns[FIELDS.index('present'), ids] = 1.0
+            dates = pd.DatetimeIndex(summary['date'])
+            if dates.tz is not None:
+                dates = dates.tz_localize(None)
+            # دقة الفهرس تختلف حسب المصدر (ns / us / s)
+            columns[FIELDS.index('date'), ids] = dates.as_unit('s').asi8[known]
+            for field in SUMMARY_FIELDS[1:-1]:
+                if field in summary:
+                    columns[FIELDS.index(field), ids] = summary[field].to_numpy(dtype=float)[known]
+            if 'source' in summary:
+                codes = summary['source'].map({s: i for i, s in enumerate(SOURCES)})
+                columns[FIELDS.index('source'), ids] = codes.to_numpy(dtype=float)[known]
+
+        overview = snapshot.get('market_overview') or {}
+        last_update = snapshot.get('last_update') or datetime.now()
+
+        header = self.header
+        seq = int(header['seq'])
+        header['seq'] = seq + 1
+        try:
+            self.values[:, :n] = columns
+            header['count'] = n
+            header['last_update'] = last_update.timestamp()
+            header['refresh_duration'] = snapshot.get('refresh_duration') or 0.0
+            header['overview'] = [float(overview.get(f, np.nan)) for f in OVERVIEW_FIELDS]
+            header['status'] = str(overview.get('status', '')).encode('utf-8')[:64]
+            header['version'] = snapshot['version']
+        finally:
+            header['seq'] = seq + 2
+
+    # ---------- القراءة (عمليات الخادم) ----------
+    def version(self):
+        """الإصدار المنشور حالياً (قراءة رقم واحد بدون نسخ)"""
+        return int(self.header['version'])
+
+    def read(self):
+        """
+        نسخة متسقة من اللقطة
+
+        Returns:
+            (الترويسة، الأعمدة) - تُعاد القراءة إذا تزامنت مع كتابة
+        """
+        header = self.header
+        while True:
+            seq = int(header['seq'])
+            if seq & 1:
+                self.retries += 1
+                time.sleep(0)
+                continue
+            head = header.copy()
+            values = self.values[:, :int(head['count'])].copy()
+            if int(header['seq']) == seq:
+                return head, values
+            self.retries += 1
+
+    def load(self, symbol_master):
+        """
+        حقول اللقطة الجديدة لـ MarketCache إذا نُشر إصدار أحدث مما قرأته هذه العملية
+
+        Returns:
+            قاموس {summary, market_overview, version, last_update, refresh_duration} أو None
+        """
+        if self.version() <= self.read_version:
+            return None
+        head, values = self.read()
+        version = int(head['version'])
+
+        present = np.flatnonzero(values[FIELDS.index('present')] == 1.0)
+        summary = pd.DataFrame({field: values[FIELDS.index(field), present] for field in SUMMARY_FIELDS},
+                               index=pd.Index(symbol_master.symbols[present], name='symbol'))
+        summary['date'] = pd.to_datetime(summary['date'], unit='s')
+        codes = summary['source'].fillna(0).astype(int)
+        summary['source'] = np.array(SOURCES, dtype=object)[codes]
+
+        overview = dict(zip(OVERVIEW_FIELDS, (float(v) for v in head['overview'])))
+        overview = {k: round(v, 2) for k, v in overview.items()}
+        overview['volume'] = int(np.nan_to_num(overview['volume']))
+        overview['status'] = head['status'].item().decode('utf-8', errors='ignore')
+
+        self.read_version = version
+        return {
+            'summary': summary,
+            'market_overview': overview,
+            'version': version,
+            'last_update': datetime.fromtimestamp(float(head['last_update'])),
+            'refresh_duration': round(float(head['refresh_duration']), 2),
+        }
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'version': self.version(),
+            'read_version': self.read_version,
+            'capacity': self.capacity,
+            'bytes': self.shm.size,
+            'read_retries': self.retries,
+        }
+
+
+TEXT_HEADER = np.dtype([
+    ('seq', '<u8'),         # عدّاد التسلسل (فردي = كتابة جارية)
+    ('length', '<u8'),      # طول النص بالبايت
+    ('updated_at', '<f8'),  # وقت الكتابة (ثواني يونكس)
+])
+
+
+class SharedText:
+    """
+    نص متغير الطول في ذاكرة مشتركة بنفس عدّاد التسلسل
+    (مقاييس عملية التحديث لتعرضها عمليات الخادم في /metrics)
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.capacity = shm.size - TEXT_HEADER.itemsize
+        self.header = np.ndarray((), dtype=TEXT_HEADER, buffer=shm.buf)
+        self.data = np.ndarray((self.capacity,), dtype=np.uint8, buffer=shm.buf, offset=TEXT_HEADER.itemsize)
+
+    @classmethod
+    def create(cls, name=None, capacity=1 << 20):
+        shm = shared_memory.SharedMemory(name=name, create=True, size=TEXT_HEADER.itemsize + capacity)
+        text = cls(shm)
+        text.header[()] = np.zeros((), dtype=TEXT_HEADER)
+        return text
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        self.header = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def write(self, text):
+        """كتابة النص (يُقص عند آخر سطر كامل إذا تجاوز السعة)"""
+        data = text.encode('utf-8')
+        if len(data) > self.capacity:
+            data = data[:data.rfind(b'\n', 0, self.capacity) + 1]
+        header = self.header
+        seq = int(header['seq'])
+        header['seq'] = seq + 1
+        try:
+            self.data[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+            header['length'] = len(data)
+            header['updated_at'] = time.time()
+        finally:
+            header['seq'] = seq + 2
+
+    def read(self):
+        """
+        Returns:
+            (النص، وقت الكتابة) - وقت 0 إذا لم يُكتب شيء بعد
+        """
+        header = self.header
+        while True:
+            seq = int(header['seq'])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            length, updated_at = int(header['length']), float(header['updated_at'])
+            data = self.data[:length].tobytes()
+            if int(header['seq']) == seq:
+                return data.decode('utf-8', errors='ignore'), updated_at
@@ -0,0 +1,214 @@
+"""
+قناة Server-Sent Events لدفع تحديثات السوق للمتصفحات
+منتج واحد مشترك ينشر الأحداث في مخزن إعادة تشغيل محدود،
+وكل مشترك يقرأ منه فقط بدون أي جلب خاص به من المصدر
+
+المشتركون يُخدمون من حلقة asyncio واحدة (EventServer) وليس من خيوط WSGI:
+المشترك الخامل coroutine تنتظر الحدث التالي، ومسار Flask يحوّل المتصفح إليها فقط
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+from contextlib import aclosing
+from urllib.parse import parse_qs, urlsplit
+
+
+class EventBroker:
+    """
+    توزيع الأحداث على جميع المشتركين مع دعم الاستئناف عبر Last-Event-ID
+    """
+
+    def __init__(self, replay_size=500, heartbeat=15, max_subscribers=2000):
+        """
+        Args:
+            replay_size: عدد الأحداث المحفوظة لإعادة إرسالها بعد إعادة الاتصال
+            heartbeat: ثواني الخمول قبل إرسال نبضة حياة
+            max_subscribers: الحد الأقصى للاتصالات المتزامنة (ما زاد يعود للاستطلاع العادي)
+        """
+        self.replay_size = replay_size
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.subscribers = 0
+        self._events = deque(maxlen=replay_size)  # (id, نص الحدث الجاهز للإرسال)
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._loop = None     # حلقة الخادم التي تنتظر فيها الاشتراكات
+        self._changed = None  # asyncio.Event يُضبط ويُستبدل مع كل حدث جديد
+
+    def attach(self, loop):
+        """ربط الموزع بحلقة الخادم (من داخلها)"""
+        self._changed = asyncio.Event()
+        self._loop = loop
+
+    def publish(self, event, data):
+        """
+        نشر حدث لجميع المشتركين - يتم ترميزه مرة واحدة فقط (آمن من أي خيط)
+
+        Returns:
+            رقم الحدث
+        """
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        with self._lock:
+            self._last_id += 1
+            event_id = self._last_id
+            self._events.append((event_id, f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"))
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._notify)
+            except RuntimeError:
+                pass  # الحلقة متوقفة
+        return event_id
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def _after(self, last_id):
+        """الأحداث بعد رقم معين، أو None إذا خرج الرقم من مخزن الإعادة"""
+        if last_id > self._last_id:
+            return None  # رقم من تشغيل سابق للخادم
+        if not self._events or last_id == self._last_id:
+            return []
+        if last_id < self._events[0][0] - 1:
+            return None
+        return [message for event_id, message in self._events if event_id > last_id]
+
+    def subscribe(self, last_event_id=None):
+        """
+        حجز مقعد لمشترك جديد
+
+        Args:
+            last_event_id: آخر حدث استلمه العميل؛ بدونه يبدأ من الأحداث الجديدة فقط
+
+        Returns:
+            مؤشر البداية لـ stream()، أو None عند بلوغ الحد الأقصى
+        """
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                return None
+            self.subscribers += 1
+            return self._last_id if last_event_id is None else last_event_id
+
+    def release(self):
+        with self._lock:
+            self.subscribers -= 1
+
+    async def stream(self, cursor):
+        """مولّد نص SSE لمشترك واحد (داخل حلقة الخادم)"""
+        yield "retry: 3000\n\n"
+
+        while True:
+            with self._lock:
+                messages = self._after(cursor)
+                current = self._last_id
+            if messages == []:
+                # الحدث الجديد يُبلَّغ عبر _notify داخل الحلقة، فلا يفوت بين القراءة والانتظار
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                continue
+
+            if messages is None:
+                # العميل متأخر أكثر من مخزن الإعادة: يجب أن يعيد تحميل اللقطة كاملة
+                yield f"id: {current}\nevent: reset\ndata: {{}}\n\n"
+            else:
+                yield ''.join(messages)
+            cursor = current
+
+
+class EventServer:
+    """
+    خادم HTTP صغير على asyncio يخدم مسار SSE واحداً لمشتركي EventBroker
+    يعمل في خيط واحد مهما كان عدد المتصفحات المتصلة
+    """
+
+    def __init__(self, broker, host='0.0.0.0', port=8766, path='/stream/market',
+                 authorize=None, write_timeout=30):
+        """
+        Args:
+            authorize: دالة authorize(token) -> bool للتحقق من رمز الدخول في الرابط (?token=)
+            write_timeout: ثواني انتظار تفريغ مخزن الإرسال قبل فصل العميل البطيء
+        """
+        self.broker = broker
+        self.host = host
+        self.port = port
+        self.path = path
+        self.authorize = authorize
+        self.write_timeout = write_timeout
+
+    def start(self):
+        """تشغيل الخادم في خيط خلفي"""
+        threading.Thread(target=lambda: asyncio.run(self.serve()), name='sse-server', daemon=True).start()
+
+    async def serve(self):
+        self.broker.attach(asyncio.get_running_loop())
+        server = await asyncio.start_server(self._client, self.host, self.port)
+        print(f" خادم SSE يعمل على {self.host}:{self.port}{self.path}")
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    def _head(status, headers=()):
+        lines = [f"HTTP/1.1 {status}", "Access-Control-Allow-Origin: *"] + [f"{k}: {v}" for k, v in headers]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _client(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            method, target = (lines[0].split(' ') + ['', ''])[:2]
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+
+            if method == 'OPTIONS':
+                writer.write(self._head('204 No Content', [('Access-Control-Allow-Headers', 'Last-Event-ID'),
+                                                           ('Content-Length', '0')]))
+                return
+            if method != 'GET' or url.path != self.path:
+                writer.write(self._head('404 Not Found', [('Content-Length', '0')]))
+                return
+            if self.authorize is not None and not self.authorize(query.get('token', [''])[0]):
+                writer.write(self._head('403 Forbidden', [('Content-Length', '0')]))
+                return
+
+            last_event_id = headers.get('last-event-id') or query.get('last_event_id', [''])[0]
+            cursor = self.broker.subscribe(int(last_event_id) if last_event_id.isdigit() else None)
+            # عند امتلاء المقاعد يعود المتصفح للاستطلاع عبر /api/market
+            if cursor is None:
+                writer.write(self._head('503 Service Unavailable', [('Retry-After', '30'), ('Content-Length', '0')]))
+                return
+
+            # الإرسال حتى يغلق المتصفح الاتصال (نهاية القراءة) - يُحرر المقعد فوراً دون انتظار نبضة
+            sending = asyncio.ensure_future(self._send(writer, cursor))
+            closing = asyncio.ensure_future(reader.read())
+            try:
+                await asyncio.wait({sending, closing}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in (sending, closing):
+                    task.cancel()
+                await asyncio.gather(sending, closing, return_exceptions=True)
+                self.broker.release()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, cursor):
+        writer.write(self._head('200 OK', [('Content-Type', 'text/event-stream; charset=utf-8'),
+                                           ('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')]))
+        async with aclosing(self.broker.stream(cursor)) as chunks:
+            async for chunk in chunks:
+                writer.write(chunk.encode('utf-8'))
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
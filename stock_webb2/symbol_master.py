@@ -0,0 +1,127 @@
+"""
+جدول الرموز الرئيسي
+معرّف رقمي لكل شركة ورموز قطاعات مُعرّفة مرة واحدة، بحيث تُخزن لقطة السوق
+كأعمدة NumPy متوازية (عنصر لكل شركة) وتُحسب تجميعات القطاعات بدون حلقات
+"""
+
+import numpy as np
+
+UNKNOWN_SECTOR = 'غير معروف'
+
+# أعمدة لقطة السوق المحفوظة لكل شركة
+COLUMNS = ('last', 'change', 'change_percent', 'volume')
+
+
+class SymbolMaster:
+    """
+    بيانات الشركات الثابتة كمصفوفات مفهرسة بالمعرّف الرقمي
+    """
+
+    def __init__(self, companies):
+        """
+        Args:
+            companies: قاموس {الرمز: {'name', 'sector'}} (SAUDI_COMPANIES)
+        """
+        self.symbols = np.array(list(companies), dtype=object)
+        self.ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.names = np.array([info.get('name', f'شركة {s}') for s, info in companies.items()], dtype=object)
+
+        sectors = [info.get('sector', UNKNOWN_SECTOR) for info in companies.values()]
+        self.sector_names, self.sector_codes = np.unique(np.array(sectors, dtype=object), return_inverse=True)
+        self.sector_codes = self.sector_codes.astype(np.int64)
+        self.sector_sizes = np.bincount(self.sector_codes, minlength=len(self.sector_names))
+        # أعضاء كل قطاع (معرّفات) محسوبة مسبقاً
+        order = np.argsort(self.sector_codes, kind='stable')
+        self.sector_members = np.split(order, np.cumsum(self.sector_sizes)[:-1])
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def id(self, symbol):
+        return self.ids.get(symbol)
+
+    def ids_of(self, symbols):
+        """معرّفات عدة رموز (-1 للرمز غير المعروف)"""
+        return np.fromiter((self.ids.get(s, -1) for s in symbols), dtype=np.int64, count=len(symbols))
+
+    def name(self, symbol):
+        i = self.ids.get(symbol)
+        return self.names[i] if i is not None else f'شركة {symbol}'
+
+    def sector(self, symbol):
+        i = self.ids.get(symbol)
+        return self.sector_names[self.sector_codes[i]] if i is not None else UNKNOWN_SECTOR
+
+    def columns(self, summary):
+        """
+        تحويل جدول الملخص (batch_fetch.summarize) إلى أعمدة متوازية بطول جدول الرموز
+
+        Returns:
+            قاموس {last, change, change_percent, volume, valid}؛ الشركات بدون بيانات NaN و valid=False
+        """
+        n = len(self.symbols)
+        columns = {c: np.full(n, np.nan) for c in COLUMNS}
+        columns['valid'] = np.zeros(n, dtype=bool)
+        if summary is None or len(summary) == 0:
+            return columns
+
+        ids = self.ids_of(summary.index)
+        known = ids >= 0
+        for c in COLUMNS:
+            columns[c][ids[known]] = summary[c].to_numpy(dtype=float)[known]
+        columns['valid'][ids[known]] = ~np.isnan(columns['last'][ids[known]])
+        return columns
+
+    def sector_aggregates(self, columns):
+        """
+        تجميعات القطاعات دفعة واحدة: الصاعدة والهابطة، اتساع السوق،
+        التغير المرجّح بالحجم، وأفضل وأسوأ شركة في كل قطاع
+
+        Returns:
+            قائمة قواميس مرتبة حسب التغير المرجّح بالحجم (الأعلى أولاً)
+        """
+        valid = columns['valid']
+        codes = self.sector_codes[valid]
+        change_percent = columns['change_percent'][valid]
+        volume = np.nan_to_num(columns['volume'][valid])
+        size = len(self.sector_names)
+
+        count = np.bincount(codes, minlength=size)
+        advancers = np.bincount(codes, weights=change_percent > 0, minlength=size).astype(int)
+        decliners = np.bincount(codes, weights=change_percent < 0, minlength=size).astype(int)
+        total_volume = np.bincount(codes, weights=volume, minlength=size)
+        weighted = np.bincount(codes, weights=change_percent * volume, minlength=size)
+        plain = np.bincount(codes, weights=change_percent, minlength=size)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            breadth = np.where(count > 0, (advancers - decliners) / count * 100, 0.0)
+            # القطاع بدون حجم مسجل يُستخدم فيه متوسط التغير العادي
+            vw_change = np.where(total_volume > 0, weighted / total_volume,
+                                 np.where(count > 0, plain / count, 0.0))
+
+        # الأفضل والأسوأ: ترتيب حسب (القطاع، التغير) ثم أول وآخر عنصر في كل مجموعة
+        ids = np.flatnonzero(valid)
+        order = np.lexsort((change_percent, codes))
+        sorted_codes = codes[order]
+        starts = np.searchsorted(sorted_codes, np.arange(size), side='left')
+        ends = np.searchsorted(sorted_codes, np.arange(size), side='right') - 1
+
+        sectors = []
+        for code in np.flatnonzero(count):
+            leader, laggard = ids[order[ends[code]]], ids[order[starts[code]]]
+            sectors.append({
+                'sector': self.sector_names[code],
+                'companies': int(count[code]),
+                'advancers': int(advancers[code]),
+                'decliners': int(decliners[code]),
+                'unchanged': int(count[code] - advancers[code] - decliners[code]),
+                'breadth': round(float(breadth[code]), 1),
+                'vw_change_percent': round(float(vw_change[code]), 2),
+                'volume': int(total_volume[code]),
+                'leader': {'symbol': self.symbols[leader], 'name': self.names[leader],
+                           'change_percent': round(float(columns['change_percent'][leader]), 2)},
+                'laggard': {'symbol': self.symbols[laggard], 'name': self.names[laggard],
+                            'change_percent': round(float(columns['change_percent'][laggard]), 2)},
+            })
+        sectors.sort(key=lambda s: s['vw_change_percent'], reverse=True)
+        return sectors
@@ -1,12 +1,16 @@
-from tkrtshare import tk
 import pandas as pd
 from datetime import datetime
 import time
+from history_store import HistoryStore
+from order_book import OrderBookManager
+from providers import LiveProvider
 
 class TadawulLive:
-    def __init__(self):
-        self.tk = tk.TkShare()
+    def __init__(self, history_store=None, provider=None):
+        self.tk = provider or LiveProvider()  # مزود البيانات (providers.py)
         self.connected = False
+        self.history = history_store or HistoryStore()  # المخزن المحلي للبيانات التاريخية
+        self.books = OrderBookManager()  # دفاتر الأوامر في الذاكرة
         
     def connect(self):
         """الاتصال بخدمة تكرتشارت"""
@@ -48,7 +52,11 @@ class TadawulLive:
             return {"error": str(e)}
     
     def get_historical_data(self, symbol, period="1y"):
-        """الحصول على بيانات تاريخية"""
+        """الحصول على بيانات تاريخية من المخزن المحلي - يتم جلب الأيام الناقصة فقط"""
+        return self.history.get(symbol, period, fetch=self.fetch_historical_data)
+
+    def fetch_historical_data(self, symbol, period="1y"):
+        """جلب بيانات تاريخية من المصدر مباشرة"""
         try:
             # بيانات تاريخية من تكرتشارت
             hist_data = self.tk.get_historical_data(symbol, period)
@@ -61,18 +69,20 @@ class TadawulLive:
             return df
         except Exception as e:
             # استخدام yfinance كبديل
-            import yfinance as yf
-            stock = yf.Ticker(symbol + ".SR")
-            hist = stock.history(period=period)
+            hist = self.tk.history(symbol + ".SR", period=period)
             return hist
     
-    def get_market_depth(self, symbol):
-        """الحصول على عمق السوق (أوامر الشراء والبيع)"""
+    def get_market_depth(self, symbol, depth=None):
+        """الحصول على عمق السوق (أوامر الشراء والبيع) - أفضل depth مستوى أو جميعها"""
         try:
             market_depth = self.tk.get_market_depth(symbol)
+            book = self.books.get(symbol)
+            book.replace(market_depth.get("bids", []), market_depth.get("asks", []))
+            levels = book.snapshot(depth)
             return {
-                "bids": market_depth.get("bids", []),  # أوامر الشراء
-                "asks": market_depth.get("asks", []),  # أوامر البيع
+                "bids": levels["bids"],  # أوامر الشراء (الأعلى سعراً أولاً)
+                "asks": levels["asks"],  # أوامر البيع (الأقل سعراً أولاً)
+                "spread": book.spread,
                 "timestamp": datetime.now().strftime("%H:%M:%S")
             }
         except Exception as e:
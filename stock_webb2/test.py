@@ -1,5 +1,6 @@
 # test.py - إصدار بدون رموز تعبيرية
 import yfinance as yf
+from http_session import shared, stats, describe  # جلسة HTTP المشتركة
 import pandas as pd
 from datetime import datetime
 
@@ -20,7 +21,7 @@ fail_count = 0
 for symbol in test_symbols:
     try:
         print(f"\nجاري جلب {symbol}...")
-        ticker = yf.Ticker(symbol)
+        ticker = yf.Ticker(symbol, session=shared())
         
         # جلب بيانات 5 أيام
         data = ticker.history(period="5d")
@@ -45,6 +46,7 @@ for symbol in test_symbols:
 
 print("\n" + "=" * 50)
 print(f"النتيجة: نجح {success_count} / فشل {fail_count} من {len(test_symbols)}")
+print(f"الشبكة: {describe(stats.snapshot())}")
 
 if success_count == 0:
     print("المشكلة: yfinance لا يتصل بالإنترنت أو هناك حظر")
@@ -0,0 +1,59 @@
+"""
+اختبار مجمّع الشموع اللحظية (bar_aggregator.py): لقطات الكاش خارج الجلسة لا تضيف شموعاً،
+وحجم الشمعة هو الفرق في الحجم التراكمي فقط
+
+    python -m unittest test_bar_aggregator
+"""
+
+import unittest
+
+import pandas as pd
+
+from bar_aggregator import BarAggregator
+from market_hours import market_time
+
+# الأحد 2026-10-18 بتوقيت الرياض (الجلسة 10:00 - 15:00)
+OPEN = market_time('2026-10-18 11:00').timestamp()
+CLOSED = market_time('2026-10-16 20:00').timestamp()  # الجمعة
+
+
+def snapshot(last, volume):
+    summary = pd.DataFrame({'last': [last], 'volume': [volume], 'source': ['yahoo']},
+                           index=pd.Index(['2222'], name='symbol'))
+    return {'summary': summary}
+
+
+class SnapshotBarsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bars = BarAggregator(['2222'], capacity=5, timeframes={'1m': 60})
+
+    def test_closed_market_adds_no_bars(self):
+        for minute in range(10):
+            self.bars.on_snapshot(snapshot(30.5, 1_000_000), now=CLOSED + minute * 60)
+        self.assertTrue(self.bars.read('2222', '1m').empty)
+
+    def test_flat_snapshots_do_not_evict_live_bars(self):
+        self.bars.update(['2222'], [30.0], [100], timestamp=OPEN)
+        self.bars.update(['2222'], [30.4], [150], timestamp=OPEN + 60)
+        for hour in range(1, 6):
+            self.bars.on_snapshot(snapshot(30.4, 150), now=CLOSED + hour * 3600)
+        self.assertEqual(self.bars.read('2222', '1m')['Close'].tolist(), [30.0, 30.4])
+
+    def test_bar_volume_is_the_cumulative_delta(self):
+        self.bars.on_snapshot(snapshot(30.0, 1_000_000), now=OPEN)
+        self.bars.on_snapshot(snapshot(30.1, 1_000_500), now=OPEN + 60)
+        # قيمة متأخرة بحجم أقل (ياهو بعد البث المباشر) لا تُحسب يوماً جديداً
+        self.bars.on_snapshot(snapshot(30.1, 999_000), now=OPEN + 120)
+        self.bars.on_snapshot(snapshot(30.2, 1_000_800), now=OPEN + 180)
+        self.assertEqual(self.bars.read('2222', '1m')['Volume'].tolist(), [0, 500, 0, 300])
+
+    def test_new_session_restarts_cumulative_volume(self):
+        self.bars.update(['2222'], [30.0], [5_000], timestamp=OPEN - 86400 * 3)
+        self.bars.update(['2222'], [30.0], [100], timestamp=OPEN)
+        self.bars.update(['2222'], [30.1], [160], timestamp=OPEN + 60)
+        self.assertEqual(self.bars.read('2222', '1m')['Volume'].tolist()[-2:], [0, 60])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+اختبار المخزن التاريخي (history_store.py): الإضافة التزايدية، استكمال الفترات الأطول،
+المزامنة حسب آخر جلسة تداول، وعمال الخادم بوضع القراءة فقط
+
+    python -m unittest test_history_store
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore, period_start
+from market_hours import WEEKMASK, market_time
+
+
+def daily(start, end, close=None):
+    """شموع يومية لأيام التداول (الأحد - الخميس)"""
+    index = pd.bdate_range(start, end, freq='C', weekmask=WEEKMASK)
+    closes = np.arange(len(index), dtype=float) if close is None else np.full(len(index), close)
+    return pd.DataFrame({'Open': closes, 'High': closes + 1, 'Low': closes - 1, 'Close': closes,
+                         'Volume': np.full(len(index), 1000.0)}, index=index)
+
+
+class FakeSource:
+    """مصدر يعيد الفترة المطلوبة حتى اليوم ويسجل الطلبات"""
+
+    def __init__(self):
+        self.periods = []
+
+    def __call__(self, symbol, period):
+        self.periods.append(period)
+        return daily(period_start(period), pd.Timestamp.now().normalize())
+
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='history_test_')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.store = HistoryStore(self.root)
+
+    def test_append_keeps_order_and_replaces_last_day(self):
+        self.assertEqual(self.store.append('2222', daily('2026-10-01', '2026-10-08')), 6)
+        # اليوم الأخير يُستبدل (شمعة جلسة جارية)، والأيام الأقدم لا تُكرر
+        self.assertEqual(self.store.append('2222', daily('2026-10-05', '2026-10-11', close=50.0)), 2)
+
+        frame = self.store.read('2222')
+        self.assertTrue(frame.index.is_monotonic_increasing)
+        self.assertEqual(len(frame), 7)
+        self.assertEqual(frame.index[-1], pd.Timestamp('2026-10-11'))
+        self.assertEqual(frame['Close'].tolist()[-3:], [4.0, 50.0, 50.0])
+        self.assertEqual(self.store.read('2222', start='2026-10-06', end='2026-10-07').index.tolist(),
+                         [pd.Timestamp('2026-10-06'), pd.Timestamp('2026-10-07')])
+
+    def test_longer_period_backfills_once(self):
+        source = FakeSource()
+        short = self.store.get('2222', '5d', fetch=source)
+        year = self.store.get('2222', '1y', fetch=source)
+        again = self.store.get('2222', '1y', fetch=source)
+
+        self.assertEqual(source.periods, ['5d', '1y'])
+        self.assertLess(len(short), len(year))
+        self.assertGreater(len(year), 250)
+        self.assertTrue(year.index.is_unique and year.index.is_monotonic_increasing)
+        self.assertEqual(len(again), len(year))
+        self.assertLessEqual(self.store.first_covered('2222'), period_start('1y'))
+
+    def test_sync_follows_last_session(self):
+        self.store.append('2222', daily('2026-10-01', '2026-10-15'))  # آخر يوم الخميس
+        date_file = os.path.join(self.root, '2222', 'date.bin')
+
+        # كُتبت بعد اعتماد شمعة الخميس: لا حاجة لمزامنة حتى تبدأ جلسة الأحد
+        settled = market_time('2026-10-15 18:00').timestamp()
+        os.utime(date_file, (settled, settled))
+        self.assertFalse(self.store.outdated('2222', now=market_time('2026-10-17 12:00')))
+        self.assertFalse(self.store.outdated('2222', now=market_time('2026-10-18 09:30')))
+        self.assertTrue(self.store.outdated('2222', now=market_time('2026-10-18 10:30')))
+
+        # كُتبت أثناء جلسة الخميس: الشمعة مؤقتة وتُعاد مزامنتها
+        intraday = market_time('2026-10-15 12:00').timestamp()
+        os.utime(date_file, (intraday, intraday))
+        self.assertTrue(self.store.outdated('2222', now=market_time('2026-10-17 12:00')))
+
+    def test_readonly_store_follows_writer(self):
+        reader = HistoryStore(self.root, readonly=True)
+        self.store.append('2222', daily('2026-10-01', '2026-10-08'))
+        self.assertEqual(len(reader.read('2222')), 6)
+
+        self.store.append('2222', daily('2026-10-11', '2026-10-12'))
+        self.store.prepend('2222', daily('2026-09-27', '2026-09-30'))
+        frame = reader.read('2222')
+        self.assertEqual((frame.index[0], frame.index[-1]), (pd.Timestamp('2026-09-27'), pd.Timestamp('2026-10-12')))
+
+        source = FakeSource()
+        self.assertEqual(len(reader.get('2222', 'max', fetch=source)), len(frame))
+        self.assertEqual(source.periods, [])
+        with self.assertRaises(PermissionError):
+            reader.append('2222', daily('2026-10-13', '2026-10-13'))
+
+    def test_invalid_symbol_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.store.read('../etc')
+
+
+if __name__ == '__main__':
+    unittest.main()
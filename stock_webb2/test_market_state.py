@@ -0,0 +1,70 @@
+"""
+اختبار حالة السوق الموحدة (market_state.py): الاستطلاع بلا تغيير لا يُحدث إصداراً جديداً للقطة
+
+    python -m unittest test_market_state
+"""
+
+import unittest
+
+from market_cache import MarketCache
+from market_state import MarketState
+from symbol_master import SymbolMaster
+
+COMPANIES = {'2222': {'name': 'أرامكو السعودية', 'sector': 'الطاقة'},
+             '1120': {'name': 'مصرف الراجحي', 'sector': 'البنوك'}}
+
+
+def tick(symbol, price, volume=1000, change=0.5):
+    return {'type': 'stock_update', 'symbol': symbol,
+            'data': {'price': price, 'change': change, 'change_percent': 1.0, 'volume': volume,
+                     'high': price, 'low': price, 'open': price, 'previous_close': price - change}}
+
+
+class LiveMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = MarketState(SymbolMaster(COMPANIES))
+        self.cache = MarketCache({}, lambda: {'market_data': []})
+
+    def merge(self):
+        """نفس دمج app.load_live_changes: None إذا لم تتغير أي شركة"""
+        return self.cache.refresh(loader=lambda: {'live': 1} if self.state.take_dirty() else None)
+
+    def test_unchanged_tick_keeps_version(self):
+        self.state.on_stock_update(tick('2222', 30.5))
+        self.merge()
+        version = self.cache.cache['version']
+
+        self.state.on_stock_update(tick('2222', 30.5))
+        self.merge()
+        self.assertEqual(self.cache.cache['version'], version)
+        self.assertEqual(self.state.live_updates, 1)
+        self.assertIn('2222', self.state.live_symbols())
+
+    def test_changed_tick_bumps_version(self):
+        self.state.on_stock_update(tick('2222', 30.5))
+        self.merge()
+        version = self.cache.cache['version']
+
+        for changed in (tick('2222', 30.6), tick('2222', 30.6, volume=2000), tick('2222', 30.6, 2000, 0.6)):
+            self.state.on_stock_update(changed)
+            self.merge()
+            version += 1
+            self.assertEqual(self.cache.cache['version'], version)
+
+    def test_touch_keeps_quiet_symbol_live(self):
+        self.state.on_stock_update(tick('2222', 30.5))
+        self.state.updated[:] -= 60
+        self.assertNotIn('2222', self.state.live_symbols())
+        self.state.touch(['2222', '1120', 'XXXX'])
+        self.assertEqual(self.state.live_symbols(), {'2222'})
+
+    def test_stale_tick_is_ignored(self):
+        stale = tick('1120', 80.0)
+        stale['data']['stale'] = True
+        self.state.on_stock_update(stale)
+        self.assertEqual(self.state.take_dirty(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+اختبار فهرس الترتيب (rankings.py): القوائم صحيحة بعد التحديث الكامل والتزايدي،
+والترتيب التزايدي يطابق إعادة الترتيب الكاملة
+
+    python -m unittest test_rankings
+"""
+
+import unittest
+
+import numpy as np
+
+from rankings import RankingIndex, VIEWS
+
+SYMBOLS = [str(1000 + i) for i in range(40)]
+
+
+def row(symbol, change_percent, volume, last=10.0):
+    return {'symbol': symbol, 'name': f'شركة {symbol}', 'last': last,
+            'change': last * change_percent / 100, 'change_percent': change_percent, 'volume': volume}
+
+
+class RankingIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RankingIndex(['2222', '1120', '2010', '7010'])
+        self.index.update_rows([row('2222', 1.5, 900), row('1120', -2.0, 300),
+                                row('2010', 0.5, 1200), row('7010', -0.5, 0), row('XXXX', 9.0, 1)])
+
+    def symbols(self, view, count=10):
+        return [r['symbol'] for r in self.index.top(view, count)]
+
+    def test_views(self):
+        self.assertEqual(self.symbols('gainers'), ['2222', '2010'])
+        self.assertEqual(self.symbols('losers'), ['1120', '7010'])
+        self.assertEqual(self.symbols('most_active'), ['2010', '2222', '1120'])
+        self.assertEqual(self.symbols('gainers', 1), ['2222'])
+        self.assertEqual(self.index.top('top_value', 1)[0]['value_traded'], 12000.0)
+
+    def test_tick_moves_symbol(self):
+        updates = self.index.stats['incremental_updates']
+        self.index.update_tick('7010', 10.5, 0.5, 5.0, 100)
+        self.assertEqual(self.symbols('gainers'), ['7010', '2222', '2010'])
+        self.assertEqual(self.symbols('losers'), ['1120'])
+        self.assertEqual(self.index.rows_for(['7010', 'XXXX'])[0]['last'], 10.5)
+        self.assertIsNone(self.index.rows_for(['7010', 'XXXX'])[1])
+        self.assertGreater(self.index.stats['incremental_updates'], updates)
+
+    def test_unusual_volume_uses_baseline(self):
+        self.index.set_baseline([300, 300, 1000, 10])
+        self.assertEqual(self.symbols('unusual_volume'), ['2222'])
+        self.assertEqual(self.index.top('unusual_volume')[0]['volume_ratio'], 3.0)
+
+    def test_incremental_matches_full_rebuild(self):
+        rng = np.random.default_rng(7)
+        incremental = RankingIndex(SYMBOLS, incremental_limit=len(SYMBOLS))
+        rebuilt = RankingIndex(SYMBOLS, incremental_limit=0)
+        rows = [row(s, float(p), float(v)) for s, p, v in
+                zip(SYMBOLS, rng.normal(0, 2, len(SYMBOLS)).round(1), rng.integers(0, 5000, len(SYMBOLS)))]
+        for index in (incremental, rebuilt):
+            index.update_rows(rows)
+
+        for _ in range(200):
+            symbol = SYMBOLS[rng.integers(len(SYMBOLS))]
+            # قيم مكررة ومفقودة أحياناً لاختبار الإزالة من بين قيم متساوية
+            change_percent = float(rng.choice([np.nan, 0.0, 1.0, round(rng.normal(0, 2), 1)]))
+            volume = float(rng.integers(0, 5000))
+            for index in (incremental, rebuilt):
+                index.update_tick(symbol, 10.0, 0.1, change_percent, volume)
+
+        # ترتيب القيم المتساوية غير محدد: تُقارن القيم، وكل رمز بقيمته الفعلية
+        self.assertGreater(incremental.stats['incremental_updates'], 0)
+        for view, (key, _, _) in VIEWS.items():
+            field = 'value_traded' if key == 'value' else key
+            top = incremental.top(view, 15)
+            self.assertEqual([r[field] for r in top], [r[field] for r in rebuilt.top(view, 15)], view)
+            actual = rebuilt.rows_for([r['symbol'] for r in top])
+            self.assertEqual([r[field] for r in top], [r[field] for r in actual], view)
+
+
+if __name__ == '__main__':
+    unittest.main()
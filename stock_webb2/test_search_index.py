@@ -0,0 +1,58 @@
+"""
+اختبار فهرس البحث (search_index.py): الرمز والبادئة، توحيد الحروف العربية،
+أداة التعريف، وخطأ إملائي واحد
+
+    python -m unittest test_search_index
+"""
+
+import unittest
+
+from search_index import SearchIndex, normalize
+
+COMPANIES = {
+    '2222': {'name': 'أرامكو السعودية'},
+    '1120': {'name': 'مصرف الراجحي'},
+    '1180': {'name': 'البنك الأهلي السعودي'},
+    '2010': {'name': 'سابك'},
+    '7010': {'name': 'الاتصالات السعودية'},
+    '4013': {'name': 'مجموعة الدكتور سليمان الحبيب'},
+}
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex(COMPANIES)
+
+    def test_code(self):
+        self.assertEqual(self.index.search('2222')[0], '2222')
+        self.assertEqual(self.index.search('11'), ('1120', '1180'))
+        self.assertEqual(self.index.search('2', limit=1), ('2010',))
+
+    def test_normalized_name(self):
+        self.assertEqual(normalize('مَجْمُوعَة  الدكتـور'), 'مجموعه الدكتور')
+        self.assertEqual(self.index.search('ارامكو'), ('2222',))
+        self.assertEqual(self.index.search('الأهلى'), ('1180',))
+
+    def test_words_and_article(self):
+        self.assertEqual(self.index.search('راجحي'), ('1120',))
+        self.assertEqual(self.index.search('السعودية'), ('2222', '7010'))
+        # الكلمة الأخيرة بادئة أيضاً: المطابقة التامة أولاً
+        self.assertEqual(self.index.search('السعودي'), ('1180', '2222', '7010'))
+        self.assertEqual(self.index.search('اتصالات سعو'), ('7010',))
+        # الاسم الكامل يتقدم على الأسماء التي تشترك معه في كلمة
+        self.assertEqual(self.index.search('الاتصالات السعودية')[0], '7010')
+
+    def test_one_typo(self):
+        self.assertEqual(self.index.search('الحبييب'), ('4013',))
+        self.assertEqual(self.index.search('ساب'), ('2010',))  # بادئة وليست خطأ
+        self.assertEqual(self.index.search('سبك'), ())  # الكلمات القصيرة بلا تحمل للخطأ
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.search(''), ())
+        self.assertEqual(self.index.search(None), ())
+        self.assertEqual(self.index.search('  ،  '), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
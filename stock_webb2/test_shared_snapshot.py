@@ -0,0 +1,109 @@
+"""
+اختبار الذاكرة المشتركة (shared_snapshot.py): اللقطة تصل للعمال كما نُشرت،
+وعملية تحديث أُعيد تشغيلها تكمل ترقيم الإصدارات؛ ونص المقاييس يُقرأ كما كُتب
+
+    python -m unittest test_shared_snapshot
+"""
+
+import unittest
+from datetime import datetime
+
+import pandas as pd
+
+from market_cache import MarketCache
+from shared_snapshot import SharedSnapshot, SharedText
+from symbol_master import SymbolMaster
+
+COMPANIES = {'2222': {'name': 'أرامكو السعودية', 'sector': 'الطاقة'},
+             '1120': {'name': 'مصرف الراجحي', 'sector': 'البنوك'},
+             '2010': {'name': 'سابك', 'sector': 'المواد الأساسية'}}
+
+
+def summary(last):
+    """ملخص لقطة لشركتين من الثلاث (سابك غائبة)"""
+    return pd.DataFrame({'date': pd.to_datetime(['2026-10-15', '2026-10-15']),
+                         'last': [last, 80.0], 'change': [0.5, -1.0], 'volume': [1_000_000.0, 250_000.0],
+                         'source': ['live', 'yahoo']},
+                        index=pd.Index(['2222', '1120'], name='symbol'))
+
+
+class SharedSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.master = SymbolMaster(COMPANIES)
+        self.shared = SharedSnapshot.create(capacity=8)
+        self.addCleanup(self.shared.unlink)
+        self.addCleanup(self.shared.close)
+
+    def refresher(self, last):
+        """نفس ربط app.py لعملية التحديث: الكاش يبدأ من آخر إصدار منشور وينشر كل لقطة"""
+        cache = MarketCache({'version': self.shared.version()},
+                            lambda: {'summary': summary(last), 'market_overview': {'current': 11000.0, 'status': 'open'}})
+        cache.add_listener(lambda snapshot: self.shared.publish(snapshot, self.master))
+        return cache
+
+    def test_worker_reads_published_snapshot(self):
+        refresher = self.refresher(30.5)
+        refresher.refresh()
+        reader = SharedSnapshot.attach(self.shared.name)
+        self.addCleanup(reader.close)
+
+        loaded = reader.load(self.master)
+        self.assertEqual(loaded['version'], refresher.cache['version'])
+        self.assertEqual(loaded['summary'].index.tolist(), ['2222', '1120'])
+        self.assertEqual(loaded['summary']['last'].tolist(), [30.5, 80.0])
+        self.assertEqual(loaded['summary']['source'].tolist(), ['live', 'yahoo'])
+        self.assertEqual(loaded['summary']['date'].tolist(), [pd.Timestamp('2026-10-15')] * 2)
+        self.assertEqual(loaded['market_overview']['current'], 11000.0)
+        self.assertEqual(loaded['market_overview']['status'], 'open')
+        self.assertIsNone(reader.load(self.master))
+
+    def test_restarted_refresher_continues_versions(self):
+        first = self.refresher(30.5)
+        for _ in range(3):
+            first.refresh()
+        reader = SharedSnapshot.attach(self.shared.name)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.load(self.master)['version'], 3)
+
+        restarted = self.refresher(31.0)
+        restarted.refresh()
+        loaded = reader.load(self.master)
+        self.assertEqual(loaded['version'], 4)
+        self.assertEqual(loaded['summary']['last'].tolist(), [31.0, 80.0])
+
+    def test_capacity_is_enforced(self):
+        companies = {str(1000 + i): {'name': f'شركة {i}'} for i in range(9)}
+        snapshot = {'summary': None, 'version': 1, 'last_update': datetime.now()}
+        with self.assertRaises(ValueError):
+            self.shared.publish(snapshot, SymbolMaster(companies))
+
+
+class SharedTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.text = SharedText.create(capacity=64)
+        self.addCleanup(self.text.unlink)
+        self.addCleanup(self.text.close)
+
+    def test_round_trip(self):
+        reader = SharedText.attach(self.text.name)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.read(), ('', 0.0))
+
+        self.text.write('tadawul_up 1\nطلبات 2\n')
+        text, updated_at = reader.read()
+        self.assertEqual(text, 'tadawul_up 1\nطلبات 2\n')
+        self.assertGreater(updated_at, 0)
+
+    def test_oversized_text_is_cut_at_last_full_line(self):
+        lines = [f'metric_{i} {i}\n' for i in range(10)]
+        self.text.write(''.join(lines))
+        text, _ = self.text.read()
+        self.assertLessEqual(len(text.encode('utf-8')), 64)
+        self.assertTrue(text.endswith('\n'))
+        self.assertEqual(text, ''.join(lines[:len(text.splitlines())]))
+
+
+if __name__ == '__main__':
+    unittest.main()
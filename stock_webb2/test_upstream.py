@@ -0,0 +1,115 @@
+"""
+اختبار طبقة upstream.py مع بديل لـ yfinance يرد بـ 429 كما تفعل yf.download:
+أعمدة فارغة للرموز المرفوضة مع تسجيل الخطأ بدلاً من رفعه
+
+    python -m unittest test_upstream
+"""
+
+import logging
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from providers import MarketDataProvider, YFinanceProvider, RateLimited, EmptyDownload, is_empty
+from upstream import ResilientProvider, UpstreamUnavailable, is_throttle
+
+RATE_LIMIT_ERROR = "YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')"
+
+
+def bars(tickers, empty=()):
+    """إطار بصيغة yf.download (الحقل، الرمز)؛ رموز empty كلها NaN"""
+    index = pd.date_range('2026-01-04', periods=2, freq='D')
+    columns = pd.MultiIndex.from_product([['Close', 'Volume'], tickers])
+    frame = pd.DataFrame(np.ones((2, len(columns))), index=index, columns=columns)
+    frame.loc[:, frame.columns.get_level_values(1).isin(empty)] = np.nan
+    return frame
+
+
+class StubYahoo:
+    """بديل yfinance: يرفض (429) الرموز في throttled"""
+
+    def __init__(self, throttled=()):
+        self.throttled = set(throttled)
+        self.calls = 0
+
+    def download(self, tickers, session=None, **kwargs):
+        self.calls += 1
+        rejected = [t for t in tickers if t in self.throttled]
+        if rejected:
+            logging.getLogger('yfinance').error(f'{rejected}: {RATE_LIMIT_ERROR}')
+        return bars(tickers, empty=rejected)
+
+
+class UpstreamThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger('yfinance').addHandler(logging.NullHandler())
+        self.yahoo = StubYahoo()
+        self.provider = ResilientProvider(YFinanceProvider(cache=False, client=self.yahoo),
+                                          attempts=3, backoff=0.001, failure_threshold=3,
+                                          reset_timeout=60, hedge=False)
+
+    def tearDown(self):
+        self.provider._executor.shutdown(wait=False)
+
+    def test_swallowed_429_is_raised(self):
+        self.yahoo.throttled = {'1120.SR'}
+        provider = YFinanceProvider(cache=False, client=self.yahoo)
+        with self.assertRaises(RateLimited) as raised:
+            provider.download(['2222.SR', '1120.SR'])
+        self.assertTrue(is_throttle(raised.exception))
+
+    def test_all_empty_without_error_is_raised(self):
+        class Silent(StubYahoo):
+            def download(self, tickers, session=None, **kwargs):
+                return bars(tickers, empty=tickers)
+        with self.assertRaises(EmptyDownload):
+            YFinanceProvider(cache=False, client=Silent()).download(['2222.SR', '1120.SR'])
+
+    def test_throttle_retries_and_shrinks_limit(self):
+        self.yahoo.throttled = {'2222.SR'}
+        with self.assertRaises(RateLimited):
+            self.provider.download(['2222.SR'])
+        guard = self.provider.guards['yahoo']
+        self.assertEqual(self.yahoo.calls, 3)
+        self.assertEqual(guard.retries, 2)
+        self.assertEqual(guard.limiter.throttled, 3)
+        self.assertLess(guard.limiter.limit, 4)
+        self.assertEqual(guard.breaker.state, 'open')
+        self.assertEqual(self.provider.last_good, {})
+
+        calls = self.yahoo.calls
+        with self.assertRaises(UpstreamUnavailable):
+            self.provider.download(['2222.SR'])
+        self.assertEqual(self.yahoo.calls, calls)
+
+    def test_last_good_served_but_never_empty(self):
+        good = self.provider.download(['2222.SR', '1120.SR'])
+        self.assertFalse(is_empty(good))
+        self.yahoo.throttled = {'2222.SR', '1120.SR'}
+        served = self.provider.download(['2222.SR', '1120.SR'])
+        pd.testing.assert_frame_equal(served, good)
+        self.assertTrue(served.attrs['stale'])
+        self.assertEqual(self.provider.guards['yahoo'].fallbacks, 1)
+        self.assertTrue(all(not is_empty(v) for _, v in self.provider.last_good.values()))
+
+    def test_live_quotes_never_served_from_last_good(self):
+        class Quotes(MarketDataProvider):
+            down = False
+
+            def get_individual_stock(self, symbol):
+                if self.down:
+                    raise ConnectionError('tkrtshare down')
+                return {'current': 30.5}
+        quotes = Quotes()
+        provider = ResilientProvider(quotes, attempts=1, hedge=False)
+        self.assertEqual(provider.get_individual_stock('2222'), {'current': 30.5})
+        quotes.down = True
+        with self.assertRaises(ConnectionError):
+            provider.get_individual_stock('2222')
+        provider._executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
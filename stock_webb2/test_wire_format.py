@@ -0,0 +1,86 @@
+"""
+اختبار صيغ البث (wire_format.py): الإطارات تُفك بوصف التخطيط في رسالة welcome
+كما يفعل العميل، وتعود نفس القيم في كل صيغة
+
+    python -m unittest test_wire_format
+"""
+
+import json
+import struct
+import unittest
+
+from wire_format import (EncodedUpdate, SymbolTable, encode_frame, negotiate, welcome,
+                         FRAME_HEADER, UPDATE_HEADER, msgpack)
+
+ARAMCO = {'price': 27.45, 'change': -0.15, 'change_percent': -0.54, 'volume': 12_345_678,
+          'high': 27.7, 'low': 27.35, 'timestamp': '13:05:42.250'}
+RAJHI = {'price': 96.1, 'volume': 1_500}
+
+
+def decode_struct(frame, fields):
+    """فك إطار struct بوصف الحقول من welcome (نفس منطق العميل)"""
+    kind, count = FRAME_HEADER.unpack_from(frame)
+    offset = FRAME_HEADER.size
+    updates = []
+    for _ in range(count):
+        symbol_id, mask = UPDATE_HEADER.unpack_from(frame, offset)
+        offset += UPDATE_HEADER.size
+        data = {}
+        for bit, field in enumerate(fields):
+            if mask & (1 << bit):
+                (value,) = struct.unpack_from('<' + field['type'], frame, offset)
+                offset += struct.calcsize('<' + field['type'])
+                data[field['name']] = value / field['scale'] if field['scale'] != 1 else value
+        updates.append((symbol_id, data))
+    assert offset == len(frame)
+    return kind, updates
+
+
+class WireFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.symbols = SymbolTable()
+        self.aramco = EncodedUpdate('2222', self.symbols.id('2222'), {'price': 27.45}, ARAMCO)
+        self.rajhi = EncodedUpdate('1120', self.symbols.id('1120'), RAJHI, RAJHI)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate(['cbor', 'struct']), 'struct')
+        self.assertEqual(negotiate(['cbor']), 'json')
+        self.assertEqual(negotiate(None), 'json')
+
+    def test_struct_round_trip(self):
+        fields = welcome('struct')['fields']
+        frame = encode_frame('struct', [self.aramco.fragment('struct', full=True), self.rajhi.fragment('struct')])
+        kind, updates = decode_struct(frame, fields)
+
+        self.assertEqual(kind, 1)
+        (aramco_id, aramco), (rajhi_id, rajhi) = updates
+        self.assertEqual((aramco_id, rajhi_id), (0, 1))
+        for name in ('price', 'change', 'change_percent', 'high', 'low'):
+            self.assertAlmostEqual(aramco[name], ARAMCO[name], places=3)
+        self.assertEqual(aramco['volume'], ARAMCO['volume'])
+        self.assertEqual(aramco['timestamp'], (13 * 3600 + 5 * 60 + 42) * 1000 + 250)
+        self.assertEqual(rajhi, {'price': 96.1, 'volume': 1_500})
+
+    def test_changes_only_fragment(self):
+        _, [(_, data)] = decode_struct(encode_frame('struct', [self.aramco.fragment('struct')]),
+                                       welcome('struct')['fields'])
+        self.assertEqual(data, {'price': 27.45})
+
+    def test_json_round_trip(self):
+        single = json.loads(encode_frame('json', [self.aramco.fragment('json', full=True)]))
+        self.assertEqual(single, {'type': 'stock_update', 'symbol': '2222', 'data': ARAMCO})
+
+        batch = json.loads(encode_frame('json', [self.aramco.fragment('json'), self.rajhi.fragment('json')]))
+        self.assertEqual(batch, {'type': 'batch', 'updates': [{'symbol': '2222', 'data': {'price': 27.45}},
+                                                              {'symbol': '1120', 'data': RAJHI}]})
+
+    @unittest.skipIf(msgpack is None, "مكتبة msgpack غير مثبتة")
+    def test_msgpack_round_trip(self):
+        frame = encode_frame('msgpack', [self.aramco.fragment('msgpack', full=True), self.rajhi.fragment('msgpack')])
+        self.assertEqual(msgpack.unpackb(frame), {'type': 'batch', 'updates': [
+            {'symbol': '2222', 'data': ARAMCO}, {'symbol': '1120', 'data': RAJHI}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,383 @@
+"""
+طبقة حماية طلبات مصادر البيانات (ياهو / تكرتشارت)
+تلف أي مزود (providers.py) فيستفيد منها StockAnalyzer و BatchDownloader و TadawulLive معاً:
+- AIMDLimiter: عدد الطلبات المتزامنة لكل مصدر يزيد تدريجياً مع النجاح ويُقسم عند التقييد (429)
+- إعادة المحاولة بانتظار أُسّي عشوائي (full jitter)
+- CircuitBreaker لكل مصدر: بعد أخطاء متتالية يتوقف الطلب مؤقتاً وتُقدم آخر نتيجة ناجحة
+  معلّمة بأنها قديمة (stale + وقت جلبها) - ما عدا الأسعار اللحظية وعمق السوق
+- التحوط (hedging): الطلب الذي تأخر أكثر من p95 المعتاد يُرسل مرة ثانية ويؤخذ الأسرع
+"""
+
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+import metrics
+from providers import MarketDataProvider, _key, is_empty
+
+THROTTLE_MARKERS = ('429', 'too many requests', 'rate limit', 'ratelimit')
+
+
+class UpstreamUnavailable(Exception):
+    """المصدر متوقف مؤقتاً (الدائرة مفتوحة) ولا توجد نتيجة سابقة للطلب"""
+
+
+def is_throttle(error):
+    """هل الخطأ تقييد من المصدر (HTTP 429 / YFRateLimitError)"""
+    text = f'{type(error).__name__} {error}'.lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+def stale(result, fetched_at):
+    """نسخة من نتيجة محفوظة معلّمة بأنها قديمة مع وقت جلبها الأصلي"""
+    if isinstance(result, dict):
+        return dict(result, stale=True, fetched_at=fetched_at)
+    if isinstance(result, pd.DataFrame):
+        result = result.copy()
+        result.attrs.update(stale=True, fetched_at=fetched_at)
+    return result
+
+
+def is_permanent(error):
+    """أخطاء لا تفيد إعادة المحاولة فيها ولا تدل على تعطل المصدر (رمز غير معروف مثلاً)"""
+    return isinstance(error, (LookupError, ValueError, TypeError, NotImplementedError))
+
+
+class AIMDLimiter:
+    """
+    حد تزامن متغير: +1 لكل نافذة طلبات ناجحة، وضرب في decrease عند التقييد
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, block=True):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if not block:
+                    return False
+                self._cond.wait()
+            self.in_flight += 1
+            return True
+
+    def release(self, outcome='ok'):
+        """
+        Args:
+            outcome: ok (زيادة الحد) أو throttled (تقليله) أو أي قيمة أخرى (بدون تغيير)
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == 'ok':
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif outcome == 'throttled':
+                self.throttled += 1
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """
+    closed: الطلبات تمر؛ open: بعد failure_threshold خطأ متتالي تُرفض الطلبات لمدة reset_timeout؛
+    half_open: يمر طلب تجريبي واحد - نجاحه يغلق الدائرة وفشله يعيد فتحها
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = 'closed'
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                    print(f" إيقاف مؤقت لطلبات المصدر {self.reset_timeout} ثانية بعد {self.failures} خطأ متتالي")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class SourceGuard:
+    """المحدد والقاطع وإحصائيات الزمن لمصدر واحد"""
+
+    def __init__(self, limiter, breaker):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.latencies = {}  # الدالة -> آخر أزمنة الطلبات الناجحة
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def observe(self, method, seconds):
+        self.latencies.setdefault(method, deque(maxlen=200)).append(seconds)
+
+    def hedge_delay(self, method, minimum):
+        """زمن الانتظار قبل إرسال طلب التحوط: p95 آخر الطلبات (None قبل توفر عينات كافية)"""
+        samples = self.latencies.get(method)
+        if not samples or len(samples) < 20:
+            return None
+        return max(minimum, float(np.percentile(samples, 95)))
+
+
+class ResilientProvider(MarketDataProvider):
+    """
+    مزود يلف مزوداً آخر بحد تزامن متكيف وإعادة محاولة وقاطع دائرة وتحوط لكل مصدر
+    """
+
+    HEDGED = ('get_individual_stock', 'get_market_depth', 'history', 'download')
+    LIVE = ('get_individual_stock', 'get_market_depth')  # لا تُقدم من آخر نتيجة ناجحة أبداً
+
+    def __init__(self, inner, initial_concurrency=4, max_concurrency=16, attempts=3,
+                 backoff=0.25, max_backoff=8.0, failure_threshold=5, reset_timeout=30,
+                 hedge=True, min_hedge_delay=0.05, max_last_good=2048):
+        """
+        Args:
+            inner: المزود الحقيقي (عادة InstrumentedProvider)
+            initial_concurrency / max_concurrency: حدود التزامن لكل مصدر
+            attempts: عدد المحاولات لكل طلب
+            backoff / max_backoff: أساس وسقف الانتظار بين المحاولات (ثواني)
+            failure_threshold / reset_timeout: إعدادات قاطع الدائرة
+            hedge: إرسال طلب ثانٍ للطلبات المتأخرة
+            max_last_good: أقصى عدد نتائج ناجحة محفوظة لتقديمها أثناء التعطل
+        """
+        self.inner = inner
+        self.source = inner.source
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.max_last_good = max_last_good
+        self.guards = {}
+        self.last_good = {}  # مفتاح الطلب -> (وقت الجلب، آخر نتيجة ناجحة)
+        self._guard_args = (initial_concurrency, max_concurrency, failure_threshold, reset_timeout)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_concurrency, thread_name_prefix='upstream-hedge')
+        metrics.register(self.collect_metrics)
+
+    @property
+    def listeners(self):
+        """مستمعو زمن الطلبات في المزود الداخلي (InstrumentedProvider)"""
+        return self.inner.listeners
+
+    def guard(self, source):
+        with self._lock:
+            guard = self.guards.get(source)
+            if guard is None:
+                initial, maximum, threshold, timeout = self._guard_args
+                guard = self.guards[source] = SourceGuard(AIMDLimiter(initial, maximum=maximum),
+                                                          CircuitBreaker(threshold, timeout))
+            return guard
+
+    # ---------- تنفيذ الطلب ----------
+    def _attempt(self, guard, method, args, kwargs):
+        """محاولة واحدة داخل حد التزامن"""
+        guard.limiter.acquire()
+        outcome = 'error'
+        started = time.perf_counter()
+        try:
+            result = getattr(self.inner, method)(*args, **kwargs)
+            outcome = 'ok'
+            guard.observe(method, time.perf_counter() - started)
+            return result
+        except Exception as e:
+            outcome = 'throttled' if is_throttle(e) else 'error'
+            raise
+        finally:
+            guard.limiter.release(outcome)
+
+    def _submit(self, guard, method, args, kwargs):
+        # نسخة من السياق حتى يُحسب زمن الطلب لطلب HTTP الحالي (profiling.py)
+        return self._executor.submit(contextvars.copy_context().run, self._attempt, guard, method, args, kwargs)
+
+    def _hedged(self, guard, method, args, kwargs):
+        """المحاولة مع طلب ثانٍ إذا تأخرت أكثر من p95 ووُجدت سعة متاحة"""
+        delay = guard.hedge_delay(method, self.min_hedge_delay) if self.hedge and method in self.HEDGED else None
+        if delay is None:
+            return self._attempt(guard, method, args, kwargs)
+        primary = self._submit(guard, method, args, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done or not guard.limiter.acquire(block=False):
+            return primary.result()
+        guard.limiter.release(None)  # السعة متوفرة - الطلب الثاني يحجزها بنفسه
+        guard.hedges += 1
+        hedge = self._submit(guard, method, args, kwargs)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        guard.hedge_wins += 1
+                    return future.result()
+        return primary.result()  # فشل الاثنان - يُرفع خطأ الطلب الأول
+
+    def _call(self, method, *args, **kwargs):
+        source = self.inner.source(method)
+        guard = self.guard(source)
+        key = _key(method, [args, kwargs])
+        error = None
+        for attempt in range(self.attempts):
+            if not guard.breaker.allow():
+                error = error or UpstreamUnavailable(f"المصدر {source} متوقف مؤقتاً")
+                break
+            try:
+                result = self._hedged(guard, method, args, kwargs)
+            except Exception as e:
+                if is_permanent(e):
+                    guard.breaker.record_success()  # المصدر يعمل والخطأ خاص بالطلب
+                    raise
+                if getattr(e, 'partial', None) is not None:
+                    # رُفض جزء من الرموز فقط: المصدر يعمل، والحد خُفض في _attempt؛
+                    # download يعيد طلب الرموز المرفوضة وحدها
+                    guard.breaker.record_success()
+                    raise
+                guard.breaker.record_failure()
+                error = e
+                if attempt + 1 < self.attempts:
+                    guard.retries += 1
+                    time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+                continue
+            guard.breaker.record_success()
+            self._remember(key, result)
+            return result
+
+        # آخر نتيجة ناجحة لنفس الطلب بدلاً من الفشل - السعر اللحظي القديم لا يُقدم كأنه حي
+        entry = self.last_good.get(key) if method not in self.LIVE else None
+        if entry is not None:
+            guard.fallbacks += 1
+            return stale(entry[1], entry[0])
+        raise error
+
+    def _remember(self, key, result):
+        if result is None or is_empty(result):
+            return  # استجابة فاشلة لا تُقدم لاحقاً كآخر نتيجة ناجحة
+        with self._lock:
+            self.last_good.pop(key, None)
+            self.last_good[key] = (time.time(), result)
+            if len(self.last_good) > self.max_last_good:
+                self.last_good.pop(next(iter(self.last_good)))
+
+    # ---------- واجهة المزود ----------
+    def connect(self):
+        return self.inner.connect()
+
+    def get_individual_stock(self, symbol):
+        return self._call('get_individual_stock', symbol)
+
+    def get_market_depth(self, symbol):
+        return self._call('get_market_depth', symbol)
+
+    def get_historical_data(self, symbol, period):
+        return self._call('get_historical_data', symbol, period)
+
+    def get_all_stocks(self):
+        return self._call('get_all_stocks')
+
+    def subscribe(self, symbols, handler):
+        return self.inner.subscribe(symbols, handler)
+
+    def download(self, tickers, **kwargs):
+        """
+        عند رفض جزء من الرموز (RateLimited مع partial) تُحفظ الأعمدة التي وصلت
+        ويُعاد طلب الرموز المرفوضة وحدها بعد الانتظار؛ ما بقي مرفوضاً يغيب من النتيجة
+        """
+        if isinstance(tickers, str):
+            return self._call('download', tickers, **kwargs)
+        requested = list(tickers)
+        pending, parts = requested, []
+        guard = self.guard(self.inner.source('download'))
+        for attempt in range(self.attempts):
+            try:
+                parts.append(self._call('download', pending, **kwargs))
+                pending = []
+                break
+            except Exception as e:
+                if getattr(e, 'partial', None) is None:
+                    if not parts:
+                        raise
+                    break  # تُعاد الأعمدة التي وصلت والباقي يُعد فاشلاً
+                parts.append(e.partial)
+                pending = e.missing
+                if attempt + 1 < self.attempts:
+                    guard.retries += 1
+                    time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+        if len(parts) == 1 and not pending:
+            return parts[0]
+        frame = pd.concat(parts, axis=1)
+        if not pending:
+            self._remember(_key('download', [(requested,), kwargs]), frame)
+        return frame
+
+    def history(self, ticker, period='1mo', interval='1d'):
+        return self._call('history', ticker, period=period, interval=interval)
+
+    # ---------- الحالة ----------
+    def stats(self):
+        return {source: {
+            'concurrency_limit': round(guard.limiter.limit, 2),
+            'in_flight': guard.limiter.in_flight,
+            'throttled': guard.limiter.throttled,
+            'breaker': guard.breaker.state,
+            'breaker_opens': guard.breaker.opens,
+            'retries': guard.retries,
+            'hedges': guard.hedges,
+            'hedge_wins': guard.hedge_wins,
+            'fallbacks': guard.fallbacks,
+        } for source, guard in list(self.guards.items())}
+
+    def collect_metrics(self):
+        stats = self.stats()
+        states = ('closed', 'half_open', 'open')
+
+        def family(name, kind, documentation, field):
+            return (name, kind, documentation, [({'source': s}, v[field]) for s, v in stats.items()])
+
+        return [
+            family('upstream_concurrency_limit', 'gauge', 'حد التزامن الحالي لكل مصدر', 'concurrency_limit'),
+            family('upstream_in_flight', 'gauge', 'الطلبات الجارية لكل مصدر', 'in_flight'),
+            family('upstream_throttled_total', 'counter', 'ردود التقييد (429) من المصدر', 'throttled'),
+            family('upstream_retries_total', 'counter', 'إعادات المحاولة', 'retries'),
+            family('upstream_hedges_total', 'counter', 'طلبات التحوط المرسلة', 'hedges'),
+            family('upstream_hedge_wins_total', 'counter', 'طلبات تحوط سبقت الطلب الأصلي', 'hedge_wins'),
+            family('upstream_fallbacks_total', 'counter', 'مرات تقديم آخر نتيجة ناجحة بدل الفشل', 'fallbacks'),
+            family('upstream_breaker_opens_total', 'counter', 'مرات فتح قاطع الدائرة', 'breaker_opens'),
+            ('upstream_breaker_state', 'gauge', 'حالة قاطع الدائرة (0 مغلق، 1 نصف مفتوح، 2 مفتوح)',
+             [({'source': s}, states.index(v['breaker'])) for s, v in stats.items()]),
+        ]
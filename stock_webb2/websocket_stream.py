@@ -6,37 +6,184 @@ WebSocket لبث البيانات المباشرة من تكرتشارت لاي
 import asyncio
 import websockets
 import json
-from datetime import datetime
-import threading
 import time
-from tkrtshare import tk
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+from history_store import HistoryStore
+from order_book import OrderBookManager
+from providers import LiveProvider
+import metrics
+from metrics import SYMBOL_FAILURES, STREAM_FANOUT_SECONDS, STREAM_POLL_SECONDS
+from wire_format import SymbolTable, EncodedUpdate, encode_frame, negotiate, welcome, dumps
+
+
+class ClientState:
+    """
+    حالة الإرسال لعميل واحد: آخر تحديث معلّق لكل رمز (دمج التحديثات المتتالية)
+    وإصدار آخر بيانات وصلته لكل رمز (أساس التغييرات التي تُرسل له)
+    """
+    
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.encoding = 'json'     # صيغة الإرسال المتفق عليها (hello / welcome)
+        self.pending = {}          # الرمز -> (آخر تحديث، هل يُرسل كاملاً)
+        self.versions = {}         # الرمز -> إصدار آخر بيانات أُرسلت أو وُضعت في الطابور
+        self.pending_since = None  # وقت أقدم تحديث معلّق
+        self.wakeup = asyncio.Event()
+        self.writer = None
+        self.frames_sent = 0
+        self.updates_conflated = 0
+    
+    def queue(self, update, version):
+        """
+        إضافة تحديث بإصداره - إذا وُجد تحديث معلّق لنفس الرمز يحل محله الأحدث،
+        ويُرسل عندها بالبيانات الكاملة لأن تغييراته وحدها لا تغطي السابق؛
+        وكذلك إذا لم يكن الإصدار السابق هو آخر ما وصل العميل (تغييراته محسوبة على أساس آخر)
+        """
+        if update.symbol in self.pending:
+            self.pending[update.symbol] = (update, True)
+            self.updates_conflated += 1
+        else:
+            self.pending[update.symbol] = (update, self.versions.get(update.symbol) != version - 1)
+        self.versions[update.symbol] = version
+        if self.pending_since is None:
+            self.pending_since = asyncio.get_running_loop().time()
+        self.wakeup.set()
+    
+    def take(self):
+        """سحب جميع التحديثات المعلقة دفعة واحدة"""
+        pending, self.pending, self.pending_since = self.pending, {}, None
+        return pending
+
 
 class TadawulLiveStream:
     """
     فئة لإدارة البث المباشر لبيانات الأسهم
     """
     
-    def __init__(self, host='localhost', port=8765):
+    def __init__(self, host='localhost', port=8765, poll_workers=16,
+                 batch_window=0.05, max_lag=10, max_subscriptions=200, write_limit=2 ** 16,
+                 stream_depth=True, max_books=500, provider=None, history_store=None):
         """
         تهيئة خادم WebSocket المحلي
         
         Args:
             host: عنوان الخادم (localhost)
             port: منفذ الخادم (8765)
+            poll_workers: عدد الخيوط لاستدعاءات تكرتشارت المتوازية
+            batch_window: مدة تجميع التحديثات المتتالية في إطار واحد (ثواني)
+            max_lag: أقصى تأخر مسموح للعميل قبل فصله (ثواني)
+            max_subscriptions: أقصى عدد رموز للعميل الواحد
+            write_limit: حجم مخزن الإرسال لكل اتصال قبل انتظار تفريغه (بايت)
+            stream_depth: استطلاع عمق السوق وبث المستويات المتغيرة فقط
+            max_books: أقصى عدد دفاتر أوامر في الذاكرة
+            provider: مزود البيانات (providers.py) - تكرتشارت افتراضياً
+            history_store: المخزن التاريخي المشترك مع التطبيق (كاتب واحد لنفس المجلد)
         """
         self.host = host
         self.port = port
         self.server = None
         self.connected_clients = set()
-        self.tk_share = tk.TkShare()
-        self.subscribed_symbols = set()
+        self.tk_share = provider or LiveProvider()
+        self.client_symbols = {}  # العميل -> الرموز التي اشترك فيها
+        self.client_states = {}   # العميل -> ClientState
+        self.symbol_clients = {}  # الرمز -> العملاء المشتركون فيه
+        self.watched_symbols = set()  # رموز تُستطلع دائماً حتى بدون مشتركين (لحالة السوق في التطبيق)
         self.is_streaming = False
-        self.stream_thread = None
+        self.poll_interval = 2
+        self.poll_task = None
+        self.poll_workers = poll_workers
+        self.executor = None
+        self.poll_stats = {
+            'cycles': 0,
+            'symbols_polled': 0,
+            'last_cycle_ms': 0.0,
+            'avg_cycle_ms': 0.0,
+            'max_cycle_ms': 0.0,
+            'missed_deadlines': 0
+        }
+        self.batch_window = batch_window
+        self.max_lag = max_lag
+        self.max_subscriptions = max_subscriptions
+        self.write_limit = write_limit
+        self.slow_disconnects = 0
         self.stream_data = {}  # تخزين بيانات البث
+        self.last_published = {}  # الرمز -> آخر حقول نُشرت (أساس حساب التغييرات)
+        self.published_versions = {}  # الرمز -> عدد التحديثات المتغيرة المنشورة (إصدار last_published)
+        self.symbols = SymbolTable()  # معرّفات رقمية للرموز في الصيغة الثنائية
+        self.stream_depth = stream_depth
+        self.books = OrderBookManager(max_books=max_books)  # دفاتر الأوامر للرموز المشتركة
+        self.history = history_store or HistoryStore()  # المخزن المحلي للبيانات التاريخية
+        self.listeners = []  # دوال تستقبل كل تحديث جديد (مثل قناة SSE في تطبيق Flask)
+        self.cycle_listeners = []  # دوال تستقبل رموز كل دورة استطلاع ناجحة (تجديد عمر القيم الحية)
+        self.frames_sent = 0  # إطارات عملاء مفصولين (للمجموع التراكمي)
+        self.updates_conflated = 0
+        metrics.register(self.collect_metrics)
         
         print(f" تم تهيئة خادم WebSocket على {host}:{port}")
     
+    @property
+    def subscribed_symbols(self):
+        """الرموز التي يشترك فيها عميل واحد على الأقل"""
+        return set(self.symbol_clients)
+
+    def watch(self, symbols):
+        """إضافة رموز تُستطلع في كل دورة بدون مشتركين - تحديثاتها تصل للمستمعين فقط"""
+        self.watched_symbols.update(symbols)
+
+    def subscribe_client(self, websocket, symbol):
+        """
+        اشتراك عميل في رمز
+
+        Returns:
+            True إذا كان هذا أول مشترك في الرمز (يضاف لمجموعة الاستطلاع)
+        """
+        self.client_symbols.setdefault(websocket, set()).add(symbol)
+        clients = self.symbol_clients.setdefault(symbol, set())
+        clients.add(websocket)
+        return len(clients) == 1
+
+    def unsubscribe_client(self, websocket, symbol):
+        """
+        إلغاء اشتراك عميل من رمز - يُحذف الرمز من الاستطلاع عند خروج آخر مشترك
+
+        Returns:
+            True إذا لم يعد هناك أي مشترك في الرمز
+        """
+        self.client_symbols.get(websocket, set()).discard(symbol)
+        clients = self.symbol_clients.get(symbol)
+        if clients is None:
+            return False
+        clients.discard(websocket)
+        if not clients:
+            del self.symbol_clients[symbol]
+            self.books.discard(symbol)
+            return True
+        return False
+
+    def remove_client(self, websocket):
+        """إزالة جميع اشتراكات العميل عند انقطاعه"""
+        for symbol in self.client_symbols.pop(websocket, set()):
+            self.unsubscribe_client(websocket, symbol)
+
+    def add_listener(self, callback):
+        """تسجيل دالة تُستدعى مع كل تحديث سهم تغيرت قيمه: callback(stock_data)"""
+        self.listeners.append(callback)
+
+    def add_cycle_listener(self, callback):
+        """تسجيل دالة تُستدعى بعد كل دورة استطلاع برموز الأسعار المستلمة: callback(symbols)"""
+        self.cycle_listeners.append(callback)
+
+    @staticmethod
+    def _notify(listeners, *args):
+        """استدعاء المستمعين - خطأ أحدهم لا يوقف الباقين ولا دورة الاستطلاع"""
+        for callback in listeners:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f" خطأ في مستمع البث {getattr(callback, '__name__', callback)}: {e}")
+
     def connect_to_tadawul(self):
         """الاتصال بتكرتشارت"""
         try:
@@ -71,12 +218,18 @@ class TadawulLiveStream:
                     "timestamp": datetime.now().strftime("%H:%M:%S.%f")[:-3]
                 }
             }
+            if data.get("stale"):
+                # قيمة محفوظة من مزود متوقف - بوقت جلبها الأصلي ولا تُعامل كسعر حي
+                formatted_data["data"]["stale"] = True
+                formatted_data["data"]["timestamp"] = datetime.fromtimestamp(
+                    data.get("fetched_at", 0)).strftime("%H:%M:%S.%f")[:-3]
             
             # تحديث بيانات البث
             self.stream_data[symbol] = formatted_data
             
             return formatted_data
         except Exception as e:
+            SYMBOL_FAILURES.inc(symbol=symbol, source=self.tk_share.source('get_individual_stock'))
             return {
                 "type": "error",
                 "symbol": symbol,
@@ -84,53 +237,93 @@ class TadawulLiveStream:
                 "timestamp": datetime.now().isoformat()
             }
     
-    def get_market_depth(self, symbol):
-        """الحصول على عمق السوق"""
+    def fetch_history(self, symbol, period):
+        """جلب بيانات تاريخية من تكرتشارت كـ DataFrame"""
+        df = pd.DataFrame(self.tk_share.get_historical_data(symbol, period))
+        df['date'] = pd.to_datetime(df['date'])
+        return df.set_index('date')
+
+    def get_history(self, symbol, period="1d"):
+        """بيانات تاريخية من المخزن المحلي كقائمة سجلات جاهزة للإرسال"""
+        hist = self.history.get(symbol, period, fetch=self.fetch_history)
+        return [{
+            "date": date.strftime("%Y-%m-%d"),
+            "open": row.Open,
+            "high": row.High,
+            "low": row.Low,
+            "close": row.Close,
+            "volume": row.Volume
+        } for date, row in zip(hist.index, hist.itertuples(index=False))]
+
+    def fetch_market_depth(self, symbol):
+        """جلب لقطة عمق السوق من تكرتشارت (None عند الفشل)"""
         try:
-            depth = self.tk_share.get_market_depth(symbol)
-            return {
-                "type": "market_depth",
-                "symbol": symbol,
-                "bids": depth.get("bids", [])[:5],  # أول 5 أوامر شراء
-                "asks": depth.get("asks", [])[:5],  # أول 5 أوامر بيع
-                "timestamp": datetime.now().isoformat()
-            }
+            return self.tk_share.get_market_depth(symbol)
         except Exception as e:
-            return {"error": str(e)}
+            print(f" خطأ في جلب عمق {symbol}: {e}")
+            SYMBOL_FAILURES.inc(symbol=symbol, source=self.tk_share.source('get_market_depth'))
+            return None
+
+    def get_market_depth(self, symbol):
+        """الحصول على عمق السوق - أفضل 5 مستويات من دفتر الأوامر"""
+        depth = self.fetch_market_depth(symbol)
+        if depth is None:
+            return {"error": f"تعذر جلب عمق السوق لـ {symbol}"}
+        book = self.books.get(symbol)
+        book.replace(depth.get("bids", []), depth.get("asks", []))
+        return dict(type="market_depth", symbol=symbol, **book.snapshot(self.books.depth),
+                    spread=book.spread, timestamp=datetime.now().isoformat())
     
-    async def handler(self, websocket, path):
+    async def handler(self, websocket, path=None):
         """
         معالج اتصالات WebSocket
         """
         client_id = id(websocket)
         self.connected_clients.add(websocket)
+        state = ClientState(websocket)
+        state.writer = asyncio.get_running_loop().create_task(self.client_writer(state))
+        self.client_states[websocket] = state
         
         print(f" عميل متصل [{client_id}] - إجمالي العملاء: {len(self.connected_clients)}")
         
         try:
-            async for message in self.connected_clients:
+            async for message in websocket:
                 try:
                     data = json.loads(message)
                     
                     # معالجة الرسائل الواردة من العملاء
-                    if data.get("type") == "subscribe":
+                    if data.get("type") == "hello":
+                        state.encoding = negotiate(data.get("encodings"))
+                        await websocket.send(dumps(welcome(state.encoding)))
+                    
+                    elif data.get("type") == "subscribe":
                         symbol = data.get("symbol")
-                        if symbol:
-                            self.subscribed_symbols.add(symbol)
-                            print(f" اشتراك جديد في {symbol}")
+                        if symbol and len(self.client_symbols.get(websocket, ())) >= self.max_subscriptions:
+                            await websocket.send(dumps({
+                                "type": "error",
+                                "message": f"الحد الأقصى للاشتراكات {self.max_subscriptions} رمز"
+                            }))
+                        elif symbol:
+                            # البيانات الأولية تُجلب قبل الاشتراك، ثم يُسجَّل إصدارها أساساً للعميل
+                            # بدون انتظار بينهما - فلا يصله تغيير محسوب على بيانات لم يستلمها
+                            stock_data, version = await self.initial_data(symbol)
+                            if self.subscribe_client(websocket, symbol):
+                                print(f" اشتراك جديد في {symbol}")
+                            state.versions[symbol] = version
                             
-                            # إرسال بيانات أولية
-                            stock_data = self.get_realtime_data(symbol)
-                            await websocket.send(json.dumps(stock_data))
+                            # إرسال بيانات أولية كاملة - التحديثات التالية تحمل الحقول المتغيرة فقط
+                            await websocket.send(dumps(dict(stock_data, id=self.symbols.id(symbol))))
+                            depth = self.books.snapshot_message(symbol)
+                            if depth is not None:
+                                await websocket.send(dumps(depth))
                     
                     elif data.get("type") == "unsubscribe":
                         symbol = data.get("symbol")
-                        if symbol in self.subscribed_symbols:
-                            self.subscribed_symbols.remove(symbol)
+                        if self.unsubscribe_client(websocket, symbol):
                             print(f" إلغاء اشتراك من {symbol}")
                     
                     elif data.get("type") == "ping":
-                        await websocket.send(json.dumps({
+                        await websocket.send(dumps({
                             "type": "pong",
                             "timestamp": datetime.now().isoformat()
                         }))
@@ -139,20 +332,21 @@ class TadawulLiveStream:
                         symbol = data.get("symbol")
                         period = data.get("period", "1d")
                         try:
-                            hist_data = self.tk_share.get_historical_data(symbol, period)
-                            await websocket.send(json.dumps({
+                            loop = asyncio.get_running_loop()
+                            hist_data = await loop.run_in_executor(None, self.get_history, symbol, period)
+                            await websocket.send(dumps({
                                 "type": "history_data",
                                 "symbol": symbol,
                                 "data": hist_data
                             }))
                         except Exception as e:
-                            await websocket.send(json.dumps({
+                            await websocket.send(dumps({
                                 "type": "error",
                                 "message": str(e)
                             }))
                 
                 except json.JSONDecodeError:
-                    await websocket.send(json.dumps({
+                    await websocket.send(dumps({
                         "type": "error",
                         "message": "رسالة غير صالحة"
                     }))
@@ -160,65 +354,215 @@ class TadawulLiveStream:
         except websockets.exceptions.ConnectionClosed:
             print(f" عميل مفصول [{client_id}]")
         finally:
+            state.writer.cancel()
+            self.frames_sent += state.frames_sent
+            self.updates_conflated += state.updates_conflated
+            self.client_states.pop(websocket, None)
+            self.remove_client(websocket)
             self.connected_clients.remove(websocket)
             print(f" إجمالي العملاء المتبقين: {len(self.connected_clients)}")
     
     def start_streaming(self, interval=2):
         """
-        بدء بث البيانات للمشتركين
+        بدء بث البيانات للمشتركين كمهمة asyncio داخل حلقة الخادم
+        (يجب استدعاؤها من داخل الحلقة)
         
         Args:
             interval: الفترة بين كل تحديث بالثواني
         """
-        if not self.connect_to_tadawul():
+        self.is_streaming = True
+        self.poll_interval = interval
+        self.poll_task = asyncio.get_running_loop().create_task(self.poll_loop())
+        print(f" بدأ البث المباشر (تحديث كل {interval} ثواني)")
+    
+    async def poll_loop(self):
+        """
+        حلقة الاستطلاع: جلب جميع الرموز المشتركة بالتوازي في كل دورة
+        مع جدولة ثابتة لا تنجرف (كل دورة تبدأ عند موعدها المحدد مسبقاً)
+        الفترة تُقرأ من poll_interval في كل دورة فيمكن تغييرها أثناء البث
+        """
+        loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.poll_workers,
+                                           thread_name_prefix='tadawul-poll')
+        
+        if not await loop.run_in_executor(self.executor, self.connect_to_tadawul):
             print("❌ لا يمكن بدء البث - الاتصال بتكرتشارت فشل")
+            self.is_streaming = False
             return
         
-        self.is_streaming = True
+        next_tick = loop.time()
+        while self.is_streaming:
+            started = loop.time()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f" خطأ في البث: {e}")
+            self._record_cycle(loop.time() - started)
+            
+            # الموعد التالي محسوب من الموعد السابق وليس من نهاية الدورة
+            interval = self.poll_interval
+            next_tick += interval
+            now = loop.time()
+            if now > next_tick:
+                missed = int((now - next_tick) // interval) + 1
+                self.poll_stats['missed_deadlines'] += missed
+                next_tick += missed * interval
+            await asyncio.sleep(next_tick - now)
+    
+    async def poll_once(self):
+        """دورة استطلاع واحدة - الاستدعاءات المعطِّلة لتكرتشارت تعمل في مجمع خيوط محدود"""
+        loop = asyncio.get_running_loop()
+        subscribed = list(self.symbol_clients)
+        symbols = subscribed + [s for s in self.watched_symbols if s not in self.symbol_clients]
+        calls = [loop.run_in_executor(self.executor, self.get_realtime_data, symbol) for symbol in symbols]
+        if self.stream_depth:
+            # عمق السوق للرموز المشتركة فقط
+            calls += [loop.run_in_executor(self.executor, self.fetch_market_depth, symbol) for symbol in subscribed]
+        results = await asyncio.gather(*calls)
         
-        def stream_loop():
-            while self.is_streaming:
-                try:
-                    # تحديث البيانات لكل سهم مشترك
-                    for symbol in list(self.subscribed_symbols):
-                        stock_data = self.get_realtime_data(symbol)
-                        
-                        # إرسال البيانات لجميع العملاء المتصلين
-                        if self.connected_clients:
-                            message = json.dumps(stock_data)
-                            websockets.broadcast(self.connected_clients, message)
-                    
-                    # انتظر قبل التحديث التالي
-                    time.sleep(interval)
-                    
-                except Exception as e:
-                    print(f" خطأ في البث: {e}")
-                    time.sleep(5)  # انتظر 5 ثواني قبل إعادة المحاولة
+        for symbol, stock_data in zip(symbols, results):
+            self.publish(symbol, stock_data)
+        self._notify(self.cycle_listeners, [
+            symbol for symbol, stock_data in zip(symbols, results)
+            if stock_data.get("type") == "stock_update" and not stock_data["data"].get("stale")])
+        for symbol, depth in zip(subscribed, results[len(symbols):]):
+            if depth is not None:
+                self.publish_depth(symbol, depth)
+        self.poll_stats['symbols_polled'] = len(symbols)
+    
+    def publish_depth(self, symbol, depth):
+        """تحديث دفتر الرمز وبث المستويات المتغيرة فقط لمشتركيه"""
+        clients = self.symbol_clients.get(symbol)
+        if not clients:
+            return
+        message = self.books.update(symbol, depth)
+        if message is not None:
+            websockets.broadcast(clients, dumps(message))
+    
+    def publish(self, symbol, stock_data):
+        """
+        نشر تحديث سهم من داخل حلقة الخادم للمشتركين فيه فقط
         
-        # بدء البث في thread منفصل
-        self.stream_thread = threading.Thread(target=stream_loop, daemon=True)
-        self.stream_thread.start()
-        print(f" بدأ البث المباشر (تحديث كل {interval} ثواني)")
+        تُحسب الحقول المتغيرة وتُرمّز مرة واحدة لكل صيغة، ثم تُضاف لطابور
+        كل عميل مشترك حيث تحل محل أي تحديث لم يُرسل بعد لنفس الرمز؛
+        المستمعون يُبلَّغون بالتحديثات التي تغيرت قيمها فقط
+        """
+        clients = self.symbol_clients.get(symbol)
+        if stock_data.get("type") != "stock_update":
+            if clients:
+                websockets.broadcast(clients, dumps(stock_data))
+            return
+        
+        data = stock_data["data"]
+        previous = self.last_published.get(symbol, {})
+        # الوقت يتغير في كل دورة: لا يُعد تغييراً بمفرده، ويُرسل مع أي تغيير حقيقي
+        changes = {key: value for key, value in data.items()
+                   if key != "timestamp" and previous.get(key) != value}
+        if changes and "timestamp" in data:
+            changes["timestamp"] = data["timestamp"]
+        self.last_published[symbol] = data
+        if not changes:
+            return
+        version = self.published_versions.get(symbol, 0) + 1
+        self.published_versions[symbol] = version
+        self._notify(self.listeners, stock_data)
+        if not clients:
+            return
+        
+        started = time.perf_counter()
+        update = EncodedUpdate(symbol, self.symbols.id(symbol), changes, data)
+        for websocket in clients:
+            state = self.client_states.get(websocket)
+            if state is not None:
+                state.queue(update, version)
+        STREAM_FANOUT_SECONDS.observe(time.perf_counter() - started)
+    
+    async def initial_data(self, symbol):
+        """
+        البيانات الكاملة لمشترك جديد مع إصدارها - من آخر تحديث منشور إن وجد،
+        وإلا من المصدر مباشرة دون تغيير أساس النشر المشترك (last_published)
+        
+        Returns:
+            (الرسالة، إصدار last_published الذي تُحسب عليه التغييرات التالية للعميل)
+        """
+        if symbol not in self.last_published:
+            loop = asyncio.get_running_loop()
+            stock_data = await loop.run_in_executor(self.executor, self.get_realtime_data, symbol)
+            # دورة الاستطلاع قد تنشر الرمز أثناء الجلب فيُستخدم المنشور
+            if symbol not in self.last_published:
+                return stock_data, self.published_versions.get(symbol, 0)
+        
+        data = self.last_published[symbol]
+        return {"type": "stock_update", "symbol": symbol, "data": data}, self.published_versions.get(symbol, 0)
+    
+    async def client_writer(self, state):
+        """
+        مهمة الإرسال لعميل واحد: تجمع التحديثات المعلقة في إطار واحد،
+        وتنتظر تفريغ مخزن الإرسال قبل الإطار التالي (الدمج يستمر أثناء الانتظار)،
+        وتفصل العميل إذا تجاوز تأخره الحد المسموح
+        """
+        websocket = state.websocket
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await state.wakeup.wait()
+                state.wakeup.clear()
+                await asyncio.sleep(self.batch_window)
+                
+                if state.pending_since is not None and loop.time() - state.pending_since > self.max_lag:
+                    raise asyncio.TimeoutError
+                
+                updates = state.take()
+                if not updates:
+                    continue
+                frame = encode_frame(state.encoding, [
+                    update.fragment(state.encoding, full) for update, full in updates.values()
+                ])
+                
+                await asyncio.wait_for(websocket.send(frame), timeout=self.max_lag)
+                state.frames_sent += 1
+        except asyncio.TimeoutError:
+            self.slow_disconnects += 1
+            print(f" فصل عميل بطيء [{id(websocket)}] - تأخر أكثر من {self.max_lag} ثانية")
+            await websocket.close(code=1013, reason="slow consumer")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            # خطأ ترميز أو إرسال غير متوقع: لا يبقى العميل متصلاً بلا مهمة إرسال
+            print(f" خطأ في الإرسال للعميل [{id(websocket)}]: {e}")
+            await websocket.close(code=1011, reason="internal error")
+    
+    def _record_cycle(self, elapsed):
+        STREAM_POLL_SECONDS.observe(elapsed)
+        stats = self.poll_stats
+        stats['cycles'] += 1
+        stats['last_cycle_ms'] = round(elapsed * 1000, 1)
+        stats['max_cycle_ms'] = max(stats['max_cycle_ms'], stats['last_cycle_ms'])
+        stats['avg_cycle_ms'] = round(stats['avg_cycle_ms'] + (stats['last_cycle_ms'] - stats['avg_cycle_ms']) / stats['cycles'], 1)
     
     def stop_streaming(self):
         """إيقاف البث المباشر"""
         self.is_streaming = False
-        if self.stream_thread:
-            self.stream_thread.join(timeout=5)
+        if self.poll_task:
+            self.poll_task.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False)
         print("⏹ تم إيقاف البث المباشر")
     
-    async def start_server(self):
-        """بدء خادم WebSocket"""
+    async def start_server(self, interval=2):
+        """بدء خادم WebSocket مع البث كل interval ثانية"""
         try:
             self.server = await websockets.serve(
                 self.handler,
                 self.host,
-                self.port
+                self.port,
+                write_limit=self.write_limit,
+                process_request=self.process_request
             )
             print(f" خادم WebSocket يعمل على ws://{self.host}:{self.port}")
             
             # بدء بث البيانات
-            self.start_streaming()
+            self.start_streaming(interval)
             
             # استمر في التشغيل
             await self.server.wait_closed()
@@ -226,14 +570,85 @@ class TadawulLiveStream:
         except Exception as e:
             print(f" خطأ في تشغيل الخادم: {e}")
     
-    def get_connection_status(self):
-        """الحصول على حالة الاتصال"""
-        return {
+    def process_request(self, connection, request):
+        """
+        طلبات HTTP على نفس المنفذ: /metrics (Prometheus) و /status (JSON)؛
+        أي مسار آخر يكمل مصافحة WebSocket
+        """
+        path, _, query = request.path.partition('?')
+        if path == '/metrics':
+            response = connection.respond(200, metrics.render())
+            del response.headers['Content-Type']
+            response.headers['Content-Type'] = metrics.CONTENT_TYPE
+            return response
+        if path == '/status':
+            status = self.get_connection_status(clients='clients=1' in query)
+            response = connection.respond(200, dumps(status) + '\n')
+            del response.headers['Content-Type']
+            response.headers['Content-Type'] = 'application/json'
+            return response
+        return None
+    
+    def queue_depths(self):
+        """عدد التحديثات المعلقة لكل عميل"""
+        return [len(state.pending) for state in list(self.client_states.values())]
+    
+    def collect_metrics(self):
+        """مقاييس البث لـ metrics.render"""
+        depths = self.queue_depths()
+        states = list(self.client_states.values())
+        return [
+            ('stream_clients', 'gauge', 'عملاء WebSocket المتصلون', [({}, len(self.connected_clients))]),
+            ('stream_subscribed_symbols', 'gauge', 'الرموز التي لها مشترك واحد على الأقل', [({}, len(self.symbol_clients))]),
+            ('stream_client_queue_depth', 'gauge', 'التحديثات المعلقة في طوابير العملاء',
+             [({'stat': 'max'}, max(depths, default=0)), ({'stat': 'total'}, sum(depths))]),
+            ('stream_frames_sent_total', 'counter', 'الإطارات المرسلة للعملاء',
+             [({}, self.frames_sent + sum(state.frames_sent for state in states))]),
+            ('stream_updates_conflated_total', 'counter', 'تحديثات حل محلها تحديث أحدث قبل إرسالها',
+             [({}, self.updates_conflated + sum(state.updates_conflated for state in states))]),
+            ('stream_slow_disconnects_total', 'counter', 'عملاء فُصلوا لتجاوز التأخر المسموح', [({}, self.slow_disconnects)]),
+            ('stream_poll_missed_deadlines_total', 'counter', 'دورات استطلاع فاتت موعدها',
+             [({}, self.poll_stats['missed_deadlines'])]),
+            ('stream_watched_symbols', 'gauge', 'رموز تُستطلع بدون مشتركين', [({}, len(self.watched_symbols))]),
+        ]
+    
+    def get_connection_status(self, clients=False):
+        """
+        الحصول على حالة الاتصال
+        
+        Args:
+            clients: إضافة تفاصيل كل عميل (الطابور والتأخر والإطارات)
+        """
+        depths = self.queue_depths()
+        status = {
             "websocket_clients": len(self.connected_clients),
-            "subscribed_symbols": list(self.subscribed_symbols),
+            "subscribed_symbols": {symbol: len(clients) for symbol, clients in self.symbol_clients.items()},
+            "watched_symbols": len(self.watched_symbols),
             "is_streaming": self.is_streaming,
+            "poll": dict(self.poll_stats),
+            "pending_updates": sum(depths),
+            "queue_depth": {"max": max(depths, default=0), "avg": round(sum(depths) / len(depths), 2) if depths else 0.0},
+            "fanout": STREAM_FANOUT_SECONDS.summary(),
+            "frames_sent": self.frames_sent + sum(state.frames_sent for state in self.client_states.values()),
+            "updates_conflated": self.updates_conflated + sum(state.updates_conflated for state in self.client_states.values()),
+            "slow_disconnects": self.slow_disconnects,
+            "order_books": self.books.stats(),
+            "encodings": {encoding: sum(1 for state in self.client_states.values() if state.encoding == encoding)
+                          for encoding in {state.encoding for state in self.client_states.values()}},
             "last_update": datetime.now().strftime("%H:%M:%S")
         }
+        if clients:
+            now = time.monotonic()  # نفس ساعة حلقة asyncio (pending_since)
+            status["clients"] = [{
+                "id": id(websocket),
+                "encoding": state.encoding,
+                "subscriptions": len(self.client_symbols.get(websocket, ())),
+                "queue_depth": len(state.pending),
+                "lag_ms": round((now - state.pending_since) * 1000, 1) if state.pending_since else 0.0,
+                "frames_sent": state.frames_sent,
+                "updates_conflated": state.updates_conflated,
+            } for websocket, state in list(self.client_states.items())]
+        return status
 
 
 # كود JavaScript للاتصال بالـ WebSocket من المتصفح
@@ -245,6 +660,11 @@ class TadawulWebSocketClient {
         this.ws = null;
         this.connected = false;
         this.subscriptions = new Set();
+        this.state = {};  // آخر بيانات كاملة لكل رمز (التحديثات تحمل الحقول المتغيرة فقط)
+        this.encodings = ['struct', 'json'];  // الصيغ المفضلة بالترتيب
+        this.fields = null;    // وصف التخطيط الثنائي من رسالة welcome
+        this.symbolIds = {};   // المعرّف الرقمي -> الرمز
+        this.books = {};       // الرمز -> {bids: Map, asks: Map} (السعر -> الكمية)
         this.callbacks = {
             'stock_update': [],
             'market_depth': [],
@@ -256,10 +676,12 @@ class TadawulWebSocketClient {
     
     connect() {
         this.ws = new WebSocket(this.url);
+        this.ws.binaryType = 'arraybuffer';
         
         this.ws.onopen = () => {
             this.connected = true;
             console.log(' متصل بخادم WebSocket');
+            this.ws.send(JSON.stringify({ type: 'hello', encodings: this.encodings }));
             this.triggerCallback('connected', {});
             
             // إعادة الاشتراك في الرموز السابقة
@@ -270,8 +692,25 @@ class TadawulWebSocketClient {
         
         this.ws.onmessage = (event) => {
             try {
+                if (event.data instanceof ArrayBuffer) {
+                    this.decodeFrame(event.data).forEach(update => this.handleStockUpdate(update));
+                    return;
+                }
                 const data = JSON.parse(event.data);
-                this.triggerCallback(data.type, data);
+                if (data.type === 'welcome') {
+                    this.fields = data.fields || null;
+                } else if (data.type === 'market_depth') {
+                    this.handleDepth(data);
+                } else if (data.type === 'batch') {
+                    data.updates.forEach(update => this.handleStockUpdate(update));
+                } else if (data.type === 'stock_update') {
+                    if (data.id !== undefined) {
+                        this.symbolIds[data.id] = data.symbol;
+                    }
+                    this.handleStockUpdate(data);
+                } else {
+                    this.triggerCallback(data.type, data);
+                }
             } catch (e) {
                 console.error('❌ خطأ في معالجة الرسالة:', e);
             }
@@ -279,6 +718,10 @@ class TadawulWebSocketClient {
         
         this.ws.onclose = () => {
             this.connected = false;
+            this.state = {};
+            this.fields = null;
+            this.symbolIds = {};
+            this.books = {};
             console.log(' انقطع الاتصال بخادم WebSocket');
             this.triggerCallback('disconnected', {});
             
@@ -292,6 +735,76 @@ class TadawulWebSocketClient {
         };
     }
     
+    decodeFrame(buffer) {
+        // إطار ثنائي: نوع (uint8)، عدد (uint16)، ثم لكل تحديث: معرّف الرمز وقناع الحقول والقيم
+        const view = new DataView(buffer);
+        const count = view.getUint16(1, true);
+        const updates = [];
+        let offset = 3;
+        for (let i = 0; i < count; i++) {
+            const id = view.getUint16(offset, true);
+            const mask = view.getUint16(offset + 2, true);
+            offset += 4;
+            const data = {};
+            this.fields.forEach((field, bit) => {
+                if (!(mask & (1 << bit))) return;
+                let value;
+                if (field.type === 'i') {
+                    value = view.getInt32(offset, true);
+                    offset += 4;
+                } else if (field.type === 'I') {
+                    value = view.getUint32(offset, true);
+                    offset += 4;
+                } else {
+                    value = Number(view.getBigUint64(offset, true));
+                    offset += 8;
+                }
+                data[field.name] = field.name === 'timestamp' ? this.formatTime(value) : value / field.scale;
+            });
+            updates.push({ symbol: this.symbolIds[id], data: data });
+        }
+        return updates;
+    }
+    
+    formatTime(ms) {
+        const pad = (n, width = 2) => String(n).padStart(width, '0');
+        return `${pad(Math.floor(ms / 3600000))}:${pad(Math.floor(ms / 60000) % 60)}:` +
+               `${pad(Math.floor(ms / 1000) % 60)}.${pad(ms % 1000, 3)}`;
+    }
+    
+    handleDepth(message) {
+        // تطبيق المستويات المتغيرة فقط (الكمية 0 = حذف المستوى)
+        if (message.snapshot || !this.books[message.symbol]) {
+            this.books[message.symbol] = { bids: new Map(), asks: new Map() };
+        }
+        const book = this.books[message.symbol];
+        [['bids', message.bids], ['asks', message.asks]].forEach(([side, levels]) => {
+            (levels || []).forEach(([price, quantity]) => {
+                if (quantity > 0) {
+                    book[side].set(price, quantity);
+                } else {
+                    book[side].delete(price);
+                }
+            });
+        });
+        const levels = (side, order) => [...book[side].entries()]
+            .sort((a, b) => order * (a[0] - b[0]))
+            .map(([price, quantity]) => ({ price: price, quantity: quantity }));
+        this.triggerCallback('market_depth', {
+            type: 'market_depth',
+            symbol: message.symbol,
+            bids: levels('bids', -1),
+            asks: levels('asks', 1)
+        });
+    }
+    
+    handleStockUpdate(update) {
+        // دمج الحقول المتغيرة مع آخر بيانات كاملة للرمز
+        const merged = Object.assign(this.state[update.symbol] || {}, update.data);
+        this.state[update.symbol] = merged;
+        this.triggerCallback('stock_update', { type: 'stock_update', symbol: update.symbol, data: merged });
+    }
+    
     disconnect() {
         if (this.ws) {
             this.ws.close();
@@ -329,6 +842,8 @@ class TadawulWebSocketClient {
         }));
         
         this.subscriptions.delete(symbol);
+        delete this.state[symbol];
+        delete this.books[symbol];
         console.log(` إلغاء اشتراك من ${symbol}`);
     }
     
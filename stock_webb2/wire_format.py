@@ -0,0 +1,156 @@
+"""
+صيغ إرسال تحديثات البث المباشر
+يتفق العميل والخادم على الصيغة عند الاتصال (hello / welcome):
+  struct  - تخطيط ثنائي ثابت: معرّف رقمي للرمز وأسعار كأعداد صحيحة مضروبة بمعامل
+  msgpack - MessagePack (إذا كانت المكتبة مثبتة)
+  json    - الصيغة الافتراضية، عبر orjson إذا كان مثبتاً
+كل تحديث يُرمّز مرة واحدة لكل صيغة ثم يُعاد استخدامه لجميع العملاء
+"""
+
+import json
+import struct
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# حقول التخطيط الثنائي بالترتيب: (الاسم، صيغة struct، معامل التحويل)
+# الحقول غير الرقمية (مثل orders) لا تُرسل في هذه الصيغة
+STRUCT_FIELDS = (
+    ('price', 'i', 1000),
+    ('change', 'i', 1000),
+    ('change_percent', 'i', 1000),
+    ('volume', 'Q', 1),
+    ('high', 'i', 1000),
+    ('low', 'i', 1000),
+    ('open', 'i', 1000),
+    ('previous_close', 'i', 1000),
+    ('bid', 'i', 1000),
+    ('ask', 'i', 1000),
+    ('timestamp', 'I', 1),  # ميلي ثانية منذ منتصف الليل
+)
+FIELD_INDEX = {name: bit for bit, (name, _, _) in enumerate(STRUCT_FIELDS)}
+
+FRAME_UPDATES = 1
+FRAME_HEADER = struct.Struct('<BH')   # نوع الإطار، عدد التحديثات
+UPDATE_HEADER = struct.Struct('<HH')  # معرّف الرمز، قناع الحقول الموجودة
+
+ENCODINGS = ['struct'] + (['msgpack'] if msgpack else []) + ['json']
+
+
+def dumps(data):
+    """ترميز JSON كنص - orjson إذا توفر"""
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode()
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def negotiate(requested):
+    """أول صيغة يطلبها العميل ويدعمها الخادم (json افتراضياً)"""
+    for encoding in requested or ():
+        if encoding in ENCODINGS:
+            return encoding
+    return 'json'
+
+
+def welcome(encoding):
+    """رسالة تأكيد الصيغة مع وصف التخطيط الثنائي ليفك العميل الإطارات"""
+    message = {"type": "welcome", "encoding": encoding}
+    if encoding == 'struct':
+        message["fields"] = [{"name": name, "type": fmt, "scale": scale}
+                             for name, fmt, scale in STRUCT_FIELDS]
+    return message
+
+
+class SymbolTable:
+    """معرّفات رقمية ثابتة للرموز طوال عمر الخادم"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def id(self, symbol):
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.ids[symbol] = len(self.ids)
+        return symbol_id
+
+
+def _scaled(value, fmt, scale):
+    if isinstance(value, str):
+        # الوقت بصيغة HH:MM:SS.mmm
+        t = datetime.strptime(value, "%H:%M:%S.%f")
+        return ((t.hour * 60 + t.minute) * 60 + t.second) * 1000 + t.microsecond // 1000
+    if value is None or value != value:
+        return 0
+    value = int(round(value * scale))
+    return max(value, 0) if fmt in ('Q', 'I') else value
+
+
+def _pack_struct(symbol_id, data):
+    mask = 0
+    formats = '<'
+    values = []
+    for name, fmt, scale in STRUCT_FIELDS:
+        if name in data:
+            mask |= 1 << FIELD_INDEX[name]
+            formats += fmt
+            values.append(_scaled(data[name], fmt, scale))
+    return UPDATE_HEADER.pack(symbol_id, mask) + struct.pack(formats, *values)
+
+
+class EncodedUpdate:
+    """
+    تحديث سهم واحد مع أجزائه المرمّزة (تُحسب عند أول طلب لكل صيغة ثم تُحفظ)
+
+    changes: الحقول المتغيرة منذ التحديث السابق؛ data: البيانات الكاملة
+    """
+
+    __slots__ = ('symbol', 'symbol_id', 'changes', 'data', '_fragments')
+
+    def __init__(self, symbol, symbol_id, changes, data):
+        self.symbol = symbol
+        self.symbol_id = symbol_id
+        self.changes = changes
+        self.data = data
+        self._fragments = {}
+
+    def fragment(self, encoding, full=False):
+        key = (encoding, full)
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            data = self.data if full else self.changes
+            if encoding == 'struct':
+                fragment = _pack_struct(self.symbol_id, data)
+            elif encoding == 'msgpack':
+                fragment = msgpack.packb({"symbol": self.symbol, "data": data}, default=str)
+            else:
+                # بدون الأقواس الخارجية ليُستخدم في الإطار المفرد والمجمّع
+                fragment = dumps({"symbol": self.symbol, "data": data})[1:-1]
+            self._fragments[key] = fragment
+        return fragment
+
+
+def encode_frame(encoding, fragments):
+    """
+    تجميع أجزاء مرمّزة مسبقاً في إطار واحد بدون إعادة ترميز البيانات
+
+    Returns:
+        bytes للصيغ الثنائية، أو نص JSON
+    """
+    if encoding == 'struct':
+        return FRAME_HEADER.pack(FRAME_UPDATES, len(fragments)) + b''.join(fragments)
+    if encoding == 'msgpack':
+        packer = msgpack.Packer()
+        return (packer.pack_map_header(2) + packer.pack("type") + packer.pack("batch")
+                + packer.pack("updates") + packer.pack_array_header(len(fragments))
+                + b''.join(fragments))
+    if len(fragments) == 1:
+        return '{"type":"stock_update",' + fragments[0] + '}'
+    return '{"type":"batch","updates":[' + ','.join('{' + f + '}' for f in fragments) + ']}'